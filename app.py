@@ -1,13 +1,30 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, Response
 import os
 import cv2
 import numpy as np
 import pytesseract
 from PIL import Image
 import io
+from contextlib import nullcontext
 import boto3
 from dotenv import load_dotenv # For loading environment variables from .env
-import uuid # Import uuid for unique filenames
+import region_packing
+import engine_race
+import region_routing
+import progressive_ocr
+import textract_batcher
+import single_flight
+import text_detection
+import page_bands
+import binarization
+import ocr_pipeline
+import scratch_buffers
+import tiled_ocr
+import request_metrics
+from request_metrics import RequestTimer
+from tracing import TraceContext, start_span
+import traffic_capture
+import profiling
 
 # Load environment variables from .env file
 load_dotenv()
@@ -30,6 +47,23 @@ AWS_REGION_NAME = os.environ.get('AWS_REGION_NAME', 'us-east-1') # Default to us
 S3_BUCKET_NAME = os.environ.get('S3_BUCKET_NAME') # IMPORTANT: Set this environment variable in .env
 S3_REGION = os.environ.get('S3_REGION', AWS_REGION_NAME) # Use same region as Textract by default
 
+# 'auto' model: Tesseract runs first and the request escalates to Textract only when the mean
+# word confidence, or the confidence at AUTO_LOW_PERCENTILE, is below its threshold (0-100).
+# AUTO_ESCALATION is 'page' (re-OCR the whole image) or 'regions' (only lines below
+# AUTO_REGION_CONFIDENCE, packed into one Textract call).
+AUTO_MIN_MEAN_CONFIDENCE = float(os.environ.get('AUTO_MIN_MEAN_CONFIDENCE', 80))
+AUTO_MIN_LOW_CONFIDENCE = float(os.environ.get('AUTO_MIN_LOW_CONFIDENCE', 40))
+AUTO_LOW_PERCENTILE = float(os.environ.get('AUTO_LOW_PERCENTILE', 10))
+AUTO_ESCALATION = os.environ.get('AUTO_ESCALATION', 'page')
+AUTO_REGION_CONFIDENCE = float(os.environ.get('AUTO_REGION_CONFIDENCE', 60))
+
+# 'race' model: Tesseract and Textract start together and the first acceptable result wins.
+# 'hedge' model: RACE_PRIMARY starts alone and the other engine only starts once the primary
+# has run longer than its recent p90 (see engine_race.py). A Tesseract result is acceptable when
+# its mean word confidence reaches RACE_MIN_CONFIDENCE; a Textract result when it is not empty.
+RACE_PRIMARY = os.environ.get('RACE_PRIMARY', 'tesseract')
+RACE_MIN_CONFIDENCE = float(os.environ.get('RACE_MIN_CONFIDENCE', 70))
+
 # Initialize Textract client if AWS credentials are provided
 textract_client = None
 if AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY:
@@ -73,44 +107,159 @@ def index():
     return render_template('index.html')
 
 
-def preprocess_image_from_bytes(image_bytes):
+def image_pixel_count(image_bytes):
+    """
+    Returns width * height from the image header without decoding the pixel data (None if unknown).
+    Gigapixel scans are OCR'd in tiles, so their headers are read under a raised PIL limit (see
+    tiled_ocr.header_pixel_limit()).
+    """
+    try:
+        with tiled_ocr.header_pixel_limit(), Image.open(io.BytesIO(image_bytes)) as img:
+            return img.width * img.height
+    except Exception:
+        return None
+
+def decode_upright_page(image_bytes, timer):
+    """
+    Decodes image bytes straight to grey. With PAGE_CROP on, a photographed page is then cut out
+    of its background and rectified (see page_crop.py); with DESKEW on, sideways, upside-down
+    and skewed pages are turned upright (see deskew.py). These are the UPRIGHT stages of the
+    shared pipeline (see ocr_pipeline/). The decisions are left in timer.preprocessing.
+    """
+    page, decisions = ocr_pipeline.UPRIGHT.run(ocr_pipeline.EncodedImage(image_bytes), timer=timer)
+    if decisions:
+        timer.preprocessing = dict(timer.preprocessing or {}, **decisions)
+    return page.pixels
+
+def preprocess_image_from_bytes(image_bytes, timer=None, binarizer=None, binarizer_requested=False):
     """
     Preprocesses the image using OpenCV for better OCR accuracy.
-    Converts to grayscale, applies Gaussian blur, and adaptive thresholding.
-    Takes image bytes as input.
+    Converts to grayscale, applies Gaussian blur, and thresholding with the named
+    binarizer (see binarization.py; BINARIZATION by default). binarizer_requested says the
+    request named it, so the quality probe's 'light' profile does not swap it for Otsu.
+    Takes image bytes as input. Stage durations are recorded on timer if one is given.
+    The stages are the PREPROCESS pipeline shared with the Lambda (see ocr_pipeline/): the
+    image is decoded straight to grey and blurred and thresholded in place, so the decoded
+    grey array is the only full-size buffer (the PIL image shares its memory).
+    The page is first cut out of its background and turned upright where configured (see
+    decode_upright_page()). With QUALITY_PROBE on, the page is then measured and only gets the
+    preprocessing its profile calls for (see quality_probe.py). The decisions are left in
+    timer.preprocessing.
     """
+    timer = timer or RequestTimer()
     try:
-        np_array = np.frombuffer(image_bytes, np.uint8)
-        image = cv2.imdecode(np_array, cv2.IMREAD_COLOR)
-
-        if image is None:
-            raise ValueError("Could not decode image bytes for preprocessing.")
-
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-        thresh = cv2.adaptiveThreshold(blurred, 255,
-                                       cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                                       cv2.THRESH_BINARY, 11, 2)
-        return Image.fromarray(thresh)
+        page, decisions = ocr_pipeline.PREPROCESS.run(
+            ocr_pipeline.EncodedImage(image_bytes),
+            ocr_pipeline.PipelineConfig(binarization=binarizer, binarization_requested=binarizer_requested), timer)
+        if decisions:
+            timer.preprocessing = dict(timer.preprocessing or {}, **decisions)
+        if 'profile' in decisions:
+            request_metrics.PREPROCESSING_PROFILES.inc(decisions['profile'])
+        return Image.fromarray(page.pixels)
     except Exception as e:
         print(f"Error during image preprocessing from bytes: {e}")
         raise
 
-def ocr_with_tesseract(image_bytes_for_tesseract):
+def binarize_crop(crop, binarizer=None):
+    """
+    Blurs and thresholds a crop of a grey page into the calling thread's scratch buffer
+    (see scratch_buffers.py). Crops may overlap, so they cannot be processed in place;
+    the result is only valid until the same thread binarizes its next crop.
+    The quality probe's profiles are chosen per page, so they do not apply to crops.
+    """
+    binary = scratch_buffers.scratch('crop', crop.shape)
+    binarization.blur(crop, dst=binary)
+    return binarization.threshold(binary, binarizer, dst=binary)
+
+def ocr_with_tesseract(image_bytes_for_tesseract, timer=None, binarizer=None, binarizer_requested=False):
     """
     Performs OCR on image bytes using Tesseract.
     The image bytes are assumed to be downloaded from S3 if coming from that flow.
     """
+    timer = timer or RequestTimer()
     try:
+        pixel_count = timer.pixel_count or image_pixel_count(image_bytes_for_tesseract)
+        if pixel_count and pixel_count >= tiled_ocr.TILED_MIN_PIXELS:
+            return ocr_tiled_image(image_bytes_for_tesseract, pixel_count, timer, binarizer)
+        if text_detection.TEXT_DETECTION != 'off':
+            return ocr_detected_text(image_bytes_for_tesseract, timer, binarizer)
         # Preprocess the downloaded image bytes for Tesseract
-        preprocessed_pil_image = preprocess_image_from_bytes(image_bytes_for_tesseract)
-        text = pytesseract.image_to_string(preprocessed_pil_image)
+        preprocessed_pil_image = preprocess_image_from_bytes(image_bytes_for_tesseract, timer, binarizer, binarizer_requested)
+        with timer.stage('tesseract'):
+            if page_bands.OCR_BAND_WORKERS > 1:
+                text = ocr_page_bands(np.asarray(preprocessed_pil_image))
+            else:
+                text = pytesseract.image_to_string(preprocessed_pil_image)
         return text
     except pytesseract.TesseractNotFoundError:
         raise Exception("Tesseract is not installed or not found in your system's PATH. Please install it or set pytesseract.pytesseract.tesseract_cmd.")
     except Exception as e:
         raise Exception(f"Tesseract OCR failed: {e}")
 
+def ocr_page_bands(binary):
+    """
+    OCRs a preprocessed page as horizontal bands cut through blank rows (see page_bands.py),
+    one tesseract process per band, and joins the band texts top to bottom: with a blank line
+    where the cut went between paragraphs, as tesseract itself would, and a newline otherwise.
+    """
+    ranges, separators = page_bands.band_ranges(binary, page_bands.OCR_BAND_WORKERS)
+    if len(ranges) == 1:
+        return pytesseract.image_to_string(Image.fromarray(binary))
+    texts = scratch_buffers.map_crops(lambda r: pytesseract.image_to_string(Image.fromarray(binary[r[0]:r[1]])), ranges)
+    text, pending = "", ""
+    for separator, band_text in zip([""] + separators, texts):
+        pending = max(pending, separator, key=len) # A blank band keeps the widest break it spans
+        if band_text.strip():
+            text += (pending if text else "") + band_text.strip("\n")
+            pending = ""
+    return text
+
+def ocr_tiled_image(image_bytes, pixel_count, timer, binarizer=None):
+    """
+    OCRs a very large image in overlapping tiles (see tiled_ocr.py). The image is decoded once,
+    straight to grey; blur, thresholding and OCR then work on one tile at a time, so the
+    full-size BGR, blurred and thresholded copies of preprocess_image_from_bytes() never exist.
+    The decode is the UPRIGHT pipeline's, with the page crop and deskew off: both would make
+    another full-size copy of a page too large for the memory budget.
+    """
+    tiled_ocr.check_budget(pixel_count)
+    page, _ = ocr_pipeline.UPRIGHT.run(ocr_pipeline.EncodedImage(image_bytes),
+                                       ocr_pipeline.PipelineConfig(page_crop=False, deskew=False), timer)
+    gray = page.pixels
+
+    def read(tile):
+        binary = binarize_crop(tile, binarizer)
+        data = pytesseract.image_to_data(Image.fromarray(binary), output_type=pytesseract.Output.DICT)
+        return words_from_tesseract_data(data)
+
+    with timer.stage('tiles'):
+        text, details = tiled_ocr.ocr_tiled(gray, read)
+    print(f"Tiled OCR of a {pixel_count / 1e6:.0f} MP image: {details}")
+    return text
+
+def ocr_detected_text(image_bytes, timer, binarizer=None):
+    """
+    Locates text blocks first (see text_detection.py), then preprocesses and OCRs only those
+    crops, in parallel. Dense pages, where the blocks cover most of the image, are OCR'd whole.
+    Detection runs on the upright page (see decode_upright_page()).
+    """
+    gray = decode_upright_page(image_bytes, timer)
+    with timer.stage('detect'):
+        boxes = text_detection.detect_text_boxes(gray)
+    if text_detection.coverage(boxes, gray.shape) > text_detection.TEXT_DETECTION_MAX_COVERAGE:
+        boxes = [[0, 0, gray.shape[1], gray.shape[0]]]
+    if not boxes:
+        return ""
+
+    def read(box):
+        left, top, width, height = box
+        binary = binarize_crop(gray[top:top + height, left:left + width], binarizer)
+        return pytesseract.image_to_string(Image.fromarray(binary))
+
+    with timer.stage('tesseract'):
+        texts = scratch_buffers.map_crops(read, boxes)
+    return "\n\n".join(text.strip() for text in texts if text.strip())
+
 def ocr_with_textract_s3(bucket_name, s3_key):
     """
     Performs OCR on an image stored in S3 using Amazon Textract.
@@ -130,23 +279,164 @@ def ocr_with_textract_s3(bucket_name, s3_key):
                 }
             }
         )
-        extracted_text = ""
-        for item in response.get('Blocks', []):
-            if item['BlockType'] == 'LINE':
-                extracted_text += item['Text'] + "\n"
-        return extracted_text.strip()
+        result, _ = ocr_pipeline.TEXTRACT_TEXT.run(ocr_pipeline.TextractBlocks(response.get('Blocks', [])))
+        return result.text
     except Exception as e:
         raise Exception(f"Amazon Textract OCR failed for S3 object: {e}")
 
-def upload_to_s3(file_bytes, filename, content_type):
-    """Uploads file bytes to S3 and returns the S3 key."""
+# Small images sent to Textract share calls through one batcher per process (see textract_batcher.py)
+mosaic_batcher = textract_batcher.MosaicBatcher(lambda document: textract_client.detect_document_text(Document=document))
+
+# Identical in-flight /upload requests share one execution
+coalescer = single_flight.SingleFlight()
+
+def ocr_with_textract_mosaic(image_bytes):
+    """
+    Performs OCR on a small image with Amazon Textract, batched with other small images.
+    The mosaic tile is the UPRIGHT pipeline's decode, with the page crop and deskew off: Textract
+    reads a batch of one from the original bytes, and the blocks must fit both.
+    """
+    if not textract_client:
+        raise Exception("Amazon Textract client is not initialized. Check AWS credentials.")
+    try:
+        page, _ = ocr_pipeline.UPRIGHT.run(ocr_pipeline.EncodedImage(image_bytes),
+                                           ocr_pipeline.PipelineConfig(page_crop=False, deskew=False))
+        blocks = mosaic_batcher.detect(image_bytes, page.pixels)
+        result, _ = ocr_pipeline.TEXTRACT_TEXT.run(ocr_pipeline.TextractBlocks(blocks))
+        return result.text
+    except Exception as e:
+        raise Exception(f"Amazon Textract OCR failed for batched image: {e}")
+
+def ocr_with_tesseract_data(image_bytes, timer=None, binarizer=None, binarizer_requested=False):
+    """
+    Like ocr_with_tesseract(), but returns the recognised words instead of plain text.
+    Each word is {'text', 'confidence' (0-100), 'bbox': [left, top, width, height], 'line'},
+    where 'line' is Tesseract's (block, paragraph, line) number.
+    """
+    timer = timer or RequestTimer()
+    try:
+        preprocessed_pil_image = preprocess_image_from_bytes(image_bytes, timer, binarizer, binarizer_requested)
+        with timer.stage('tesseract'):
+            data = pytesseract.image_to_data(preprocessed_pil_image, output_type=pytesseract.Output.DICT)
+    except pytesseract.TesseractNotFoundError:
+        raise Exception("Tesseract is not installed or not found in your system's PATH. Please install it or set pytesseract.pytesseract.tesseract_cmd.")
+    except Exception as e:
+        raise Exception(f"Tesseract OCR failed: {e}")
+    return words_from_tesseract_data(data)
+
+def words_from_tesseract_data(data):
+    """Converts image_to_data() columns into the word dicts described in ocr_with_tesseract_data()."""
+    words = []
+    for i, text in enumerate(data['text']):
+        confidence = float(data['conf'][i])
+        if confidence < 0 or not text.strip(): # -1 marks block/line rows rather than words
+            continue
+        words.append({
+            'text': text,
+            'confidence': confidence,
+            'bbox': [data['left'][i], data['top'][i], data['width'][i], data['height'][i]],
+            'line': (data['block_num'][i], data['par_num'][i], data['line_num'][i]),
+        })
+    return words
+
+def group_lines(words):
+    """Groups words into lines in Tesseract's reading order: [(line key, [words])]."""
+    lines = []
+    for word in words:
+        if lines and lines[-1][0] == word['line']:
+            lines[-1][1].append(word)
+        else:
+            lines.append((word['line'], [word]))
+    return lines
+
+def lines_to_text(lines, replacements=None):
+    """
+    Joins grouped lines into text, with a blank line between paragraphs like image_to_string().
+    replacements maps line indexes to text that is used instead of Tesseract's words.
+    """
+    replacements = replacements or {}
+    text_lines, previous_paragraph = [], None
+    for index, ((block, paragraph, _), line_words) in enumerate(lines):
+        if previous_paragraph is not None and (block, paragraph) != previous_paragraph:
+            text_lines.append("")
+        text_lines.append(replacements.get(index, " ".join(word['text'] for word in line_words)))
+        previous_paragraph = (block, paragraph)
+    return "\n".join(text_lines)
+
+def confidence_summary(words):
+    """Returns (mean confidence, confidence at AUTO_LOW_PERCENTILE); both 0 when no words were found."""
+    if not words:
+        return 0.0, 0.0
+    confidences = np.array([word['confidence'] for word in words])
+    return float(confidences.mean()), float(np.percentile(confidences, AUTO_LOW_PERCENTILE))
+
+def reocr_lines_with_textract(image_bytes, lines, line_indexes, timer):
+    """
+    Re-reads the given lines with Textract. The line crops are packed onto one canvas so the
+    whole escalation is a single API call. Returns {line index: text} for the lines Textract read.
+    The line boxes are in the coordinates of the upright page Tesseract read, so the crops are
+    cut from that page: decode_upright_page() is deterministic, and running it again here
+    rebuilds the page instead of keeping a full-size copy through every Tesseract pass.
+    """
+    gray = decode_upright_page(image_bytes, timer)
+    height, width = gray.shape
+    boxes = [region_packing.clip_box(region_packing.union_box([w['bbox'] for w in lines[i][1]]),
+                                     width, height, padding=4) for i in line_indexes]
+    canvas, slots = region_packing.pack_vertically(gray, boxes)
+    ok, encoded = cv2.imencode('.png', canvas)
+    if not ok:
+        raise Exception("Failed to encode the region canvas for Textract.")
+    with timer.stage('textract'):
+        response = textract_client.detect_document_text(Document={'Bytes': encoded.tobytes()})
+    assigned = region_packing.lines_by_slot(response.get('Blocks', []), slots, canvas.shape[0])
+    return {line_indexes[slot]: " ".join(texts) for slot, texts in assigned.items()}
+
+def ocr_auto(image_bytes, s3_key, timer, binarizer=None, binarizer_requested=False):
+    """
+    Runs Tesseract and escalates to Textract only when Tesseract is not confident enough
+    (see the AUTO_* settings). Returns (text, details) where details describes the decision.
+    """
+    words = ocr_with_tesseract_data(image_bytes, timer, binarizer, binarizer_requested)
+    lines = group_lines(words)
+    mean_confidence, low_confidence = confidence_summary(words)
+    details = {'route': 'tesseract', 'mean_confidence': round(mean_confidence, 1),
+               'low_confidence': round(low_confidence, 1)}
+
+    confident = mean_confidence >= AUTO_MIN_MEAN_CONFIDENCE and low_confidence >= AUTO_MIN_LOW_CONFIDENCE
+    if confident or not textract_client:
+        if not confident:
+            print("Tesseract confidence is low but Textract is not available; keeping the Tesseract result.")
+        return lines_to_text(lines), details
+
+    if AUTO_ESCALATION == 'regions' and lines:
+        low_lines = [i for i, (_, line_words) in enumerate(lines)
+                     if np.mean([w['confidence'] for w in line_words]) < AUTO_REGION_CONFIDENCE]
+        if low_lines:
+            replacements = reocr_lines_with_textract(image_bytes, lines, low_lines, timer)
+            details.update(route='textract_regions', regions=len(low_lines))
+            return lines_to_text(lines, replacements), details
+
+    print(f"Escalating to Textract (mean confidence {mean_confidence:.1f}, p{AUTO_LOW_PERCENTILE:g} {low_confidence:.1f})")
+    with timer.stage('textract'):
+        text = ocr_with_textract_s3(S3_BUCKET_NAME, s3_key)
+    details['route'] = 'textract_page'
+    return text, details
+
+def upload_to_s3(file_bytes, filename, content_type, trace=None):
+    """
+    Uploads file bytes to S3 and returns the S3 key.
+    The trace context (job_id, trace_id, parent span) is stored as object metadata so the
+    Lambda processing the object continues the same trace and uses the same job_id.
+    """
     if not s3_client or not S3_BUCKET_NAME:
         raise Exception("S3 client not initialized or bucket name not set. Cannot upload to S3.")
+    trace = trace or TraceContext()
     
-    # Create a unique filename for S3 to avoid collisions
-    s3_key = f"uploads/{uuid.uuid4()}-{filename}" 
+    # Create a unique filename for S3 to avoid collisions (the job_id is a full UUID)
+    s3_key = f"uploads/{trace.job_id}-{filename}" 
     try:
-        s3_client.put_object(Bucket=S3_BUCKET_NAME, Key=s3_key, Body=file_bytes, ContentType=content_type)
+        s3_client.put_object(Bucket=S3_BUCKET_NAME, Key=s3_key, Body=file_bytes, ContentType=content_type,
+                             Metadata=trace.to_s3_metadata())
         print(f"Uploaded {filename} to s3://{S3_BUCKET_NAME}/{s3_key}")
         return s3_key
     except Exception as e:
@@ -164,61 +454,301 @@ def delete_from_s3(s3_key):
         print(f"Error deleting object {s3_key} from S3: {e}")
 
 
+def ocr_race(image_bytes, s3_key, timer, hedge=False, binarizer=None, binarizer_requested=False):
+    """
+    Runs Tesseract and Textract as competing attempts (see engine_race.race()) and returns
+    (text, details). The losing Tesseract process is killed; a losing Textract call is abandoned.
+    Tesseract reads the uploaded bytes directly rather than downloading them back from S3.
+    Its preprocessing overlaps the race, so it is timed apart from the request; its decisions
+    are left in timer.preprocessing when Tesseract wins.
+    """
+    tesseract_timer = RequestTimer()
+
+    def tesseract_attempt(cancel_event):
+        preprocessed_pil_image = preprocess_image_from_bytes(image_bytes, tesseract_timer, binarizer, binarizer_requested)
+        words = words_from_tesseract_data(engine_race.tesseract_data_cancellable(preprocessed_pil_image, cancel_event))
+        mean_confidence, _ = confidence_summary(words)
+        return lines_to_text(group_lines(words)), bool(words) and mean_confidence >= RACE_MIN_CONFIDENCE
+
+    def textract_attempt(cancel_event):
+        text = ocr_with_textract_s3(S3_BUCKET_NAME, s3_key)
+        return text, bool(text.strip())
+
+    attempts = [('tesseract', tesseract_attempt)]
+    if textract_client:
+        attempts.append(('textract', textract_attempt))
+    if RACE_PRIMARY == 'textract':
+        attempts.reverse()
+
+    hedge_after = engine_race.LATENCY.hedge_delay(attempts[0][0]) if hedge else None
+    with timer.stage('race'):
+        winner, text, details = engine_race.race(attempts, hedge_after)
+    if winner == 'tesseract' and tesseract_timer.preprocessing:
+        timer.preprocessing = dict(timer.preprocessing or {}, **tesseract_timer.preprocessing)
+    print(f"{winner} won the {'hedged ' if hedge else ''}race in {details['latency_ms'][winner]}ms")
+    return text, details
+
+
+def ocr_routed(image_bytes, timer, binarizer=None):
+    """
+    Reads each text region with Tesseract and sends only the hard regions to Textract
+    (see region_routing.py). Returns (text, details). Regions are found on the upright page
+    (see decode_upright_page()).
+    """
+    gray = decode_upright_page(image_bytes, timer)
+
+    def ocr_local(crop):
+        binary = binarize_crop(crop, binarizer)
+        data = pytesseract.image_to_data(Image.fromarray(binary), output_type=pytesseract.Output.DICT)
+        words = words_from_tesseract_data(data)
+        mean_confidence, _ = confidence_summary(words)
+        return lines_to_text(group_lines(words)), mean_confidence
+
+    def ocr_remote(canvas):
+        if not textract_client:
+            print("Hard regions found but Textract is not available; keeping the Tesseract text.")
+            return []
+        ok, encoded = cv2.imencode('.png', canvas)
+        if not ok:
+            raise Exception("Failed to encode the region canvas for Textract.")
+        return textract_client.detect_document_text(Document={'Bytes': encoded.tobytes()}).get('Blocks', [])
+
+    try:
+        with timer.stage('regions'):
+            text, details = region_routing.route_regions(gray, ocr_local, ocr_remote)
+    except pytesseract.TesseractNotFoundError:
+        raise Exception("Tesseract is not installed or not found in your system's PATH. Please install it or set pytesseract.pytesseract.tesseract_cmd.")
+    print(f"Routed {details['hard_regions']} of {details['regions']} regions to Textract")
+    return text, details
+
+def ocr_progressive(image_bytes, timer, binarizer=None):
+    """
+    Reads a reduced copy of the page first and re-reads only its low-confidence lines from the
+    full-resolution page (see progressive_ocr.py). Returns (text, details). A page on which the
+    first pass finds no words at all is read again whole at full resolution.
+    """
+    gray = decode_upright_page(image_bytes, timer)
+
+    def ocr_line(crop):
+        binary = progressive_ocr.refine_preprocess(crop)
+        data = pytesseract.image_to_data(Image.fromarray(binary), config='--psm 7', output_type=pytesseract.Output.DICT)
+        return words_from_tesseract_data(data)
+
+    try:
+        with timer.stage('reduce'):
+            small, scale = progressive_ocr.reduce(gray)
+            binarization.binarize(small, binarizer, dst=small)
+        with timer.stage('tesseract'):
+            data = pytesseract.image_to_data(Image.fromarray(small), output_type=pytesseract.Output.DICT)
+        words = progressive_ocr.scale_words(words_from_tesseract_data(data), 1.0 / scale)
+        if not words:
+            with timer.stage('full_pass'):
+                binarization.binarize(gray, binarizer, dst=gray)
+                text = pytesseract.image_to_string(Image.fromarray(gray))
+            return text, {'scale': scale, 'lines': 0, 'refined_lines': 0, 'replaced_lines': 0,
+                          'refined_pixel_fraction': 1.0, 'full_pass': True}
+
+        lines = group_lines(words)
+        with timer.stage('refine'):
+            replacements, details = progressive_ocr.refine_lines(gray, lines, ocr_line)
+    except pytesseract.TesseractNotFoundError:
+        raise Exception("Tesseract is not installed or not found in your system's PATH. Please install it or set pytesseract.pytesseract.tesseract_cmd.")
+    print(f"Progressive OCR re-read {details['refined_lines']} of {details['lines']} lines at full resolution")
+    return lines_to_text(lines, replacements), dict(details, scale=scale, full_pass=False)
+
+
 # --- Flask Routes ---
 
+OCR_MODELS = ('tesseract', 'textract', 'auto', 'race', 'hedge', 'routed', 'progressive')
+
+@app.route('/metrics')
+def metrics():
+    """Exposes request metrics in the Prometheus text format."""
+    return Response(request_metrics.render_metrics(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     """
     Handles image upload, uploads to S3, and performs OCR using selected model.
+    Per-stage durations are returned in a Server-Timing header and recorded for /metrics.
+    """
+    ocr_model = request.form.get('ocr_model', 'tesseract') # Default to tesseract
+    engine = ocr_model if ocr_model in OCR_MODELS else 'invalid' # Bounded label values for metrics
+    trace = TraceContext()
+    capture = traffic_capture.should_capture()
+    profile = profiling.RequestProfile(trace.trace_id) if profiling.should_profile(request.headers) else None
+    request_metrics.IN_FLIGHT.inc(engine)
+    try:
+        with start_span('upload', trace, engine=engine) as root_span:
+            timer = RequestTimer(trace.child(root_span.span_id))
+            if profile:
+                with profile:
+                    response, status, captured = _process_upload(ocr_model, timer, capture)
+            else:
+                response, status, captured = _process_upload(ocr_model, timer, capture)
+            root_span.set_attribute('status_code', status)
+    finally:
+        request_metrics.IN_FLIGHT.dec(engine)
+
+    if status >= 500:
+        request_metrics.REQUEST_ERRORS.inc(engine, timer.failed_stage or 'unknown')
+    request_metrics.record_request(timer, engine, status)
+    if captured:
+        traffic_capture.capture_request(captured, ocr_model, timer, status)
+    response.headers['Server-Timing'] = timer.server_timing_header()
+    response.headers['X-Trace-Id'] = trace.trace_id
+    if timer.peak_rss is not None:
+        response.headers['X-Peak-RSS-Bytes'] = str(timer.peak_rss)
+        response.headers['X-RSS-Growth-Bytes'] = str(timer.rss_growth())
+    if profile and profile.paths:
+        response.headers['X-Profile-Id'] = trace.trace_id
+    return response, status
+
+def _process_upload(ocr_model, timer, capture=False):
+    """
+    Runs the upload/OCR flow for upload_file() and returns (response, status, captured), where
+    captured is the traffic_capture.describe_upload() of the image if capture is set (else None).
     """
     if 'image' not in request.files:
-        return jsonify({'error': 'No image file provided'}), 400
+        return jsonify({'error': 'No image file provided'}), 400, None
 
     file = request.files['image']
-    ocr_model = request.form.get('ocr_model', 'tesseract') # Default to tesseract
 
     if file.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
+        return jsonify({'error': 'No selected file'}), 400, None
 
-    s3_key = None # Initialize s3_key to None, will be set upon successful S3 upload
+    try:
+        # Optional per-request override of the binarization policy (see binarization.py)
+        binarizer = binarization.backend_for(ocr_model, request.form.get('binarization'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400, None
+    binarizer_requested = bool(request.form.get('binarization'))
 
     if file:
+        # The bytes are held in an EncodedImage so that _run_ocr() can release them early
+        upload = ocr_pipeline.EncodedImage(file.read())
+        file.close() # Werkzeug keeps its own copy of a small upload in memory until the request ends
+        captured = traffic_capture.describe_upload(upload.data) if capture else None
+        timer.pixel_count = image_pixel_count(upload.data)
+
+        if not single_flight.COALESCE_ENABLED:
+            payload, status = _run_ocr(upload, file.filename, file.content_type, ocr_model, timer,
+                                       binarizer=binarizer, binarizer_requested=binarizer_requested)
+            return jsonify(payload), status, captured
+
+        # Identical requests in flight at the same time share one execution (see single_flight.py)
+        key = single_flight.coalescing_key(upload.data, ocr_model, {'binarization': binarizer, 'requested': binarizer_requested})
+        # The shared run records its stages on its own timer: a leader that times out stops waiting
+        # while the run may still be writing to it. They are merged into timer once the run has finished.
+        shared_timer = RequestTimer(timer.trace)
+        shared_timer.pixel_count = timer.pixel_count
+        def run_shared(flight):
+            # The shared work runs on the single-flight thread, which a profile of this request must follow
+            with profiling.sampled_thread(timer.trace.trace_id):
+                return _run_ocr(upload, file.filename, file.content_type, ocr_model, shared_timer, flight,
+                                binarizer, binarizer_requested)
+
+        flight, leader = coalescer.join(key, run_shared)
+        if not leader:
+            upload.data = None # The leader's run reads its own copy
         try:
-            image_bytes = file.read() # Read image content as bytes
-            original_filename = file.filename
-            content_type = file.content_type
-
-            # --- Step 1: Upload image to S3 ---
-            if s3_client and S3_BUCKET_NAME:
-                s3_key = upload_to_s3(image_bytes, original_filename, content_type)
+            with nullcontext() if leader else timer.stage('coalesced'):
+                payload, status = coalescer.wait(flight)
+        except TimeoutError:
+            timer.failed_stage = timer.current_stage
+            return jsonify({'error': 'Timed out waiting for OCR to finish'}), 504, captured
+        except Exception as e:
+            print(f"Server error: {e}")
+            if leader:
+                timer.merge(shared_timer)
+            timer.failed_stage = timer.failed_stage or timer.current_stage
+            return jsonify({'error': str(e)}), 500, captured
+        if leader:
+            timer.merge(shared_timer)
+        else:
+            if status >= 500:
+                timer.failed_stage = 'coalesced' # The failing stage was recorded on the leader's timer
+            request_metrics.COALESCED_REQUESTS.inc(ocr_model)
+            if 'job_id' in payload:
+                payload = dict(payload, job_id=timer.trace.job_id, coalesced_with=payload['job_id'])
+        return jsonify(payload), status, captured
+
+def _run_ocr(upload, original_filename, content_type, ocr_model, timer, flight=None, binarizer=None, binarizer_requested=False):
+    """
+    Uploads the image to S3, runs the selected OCR model and returns (payload dict, status).
+    Runs outside the request context when coalesced, so it must not touch flask.request.
+    upload is an EncodedImage of the uploaded bytes. They are released (upload.data = None) once the
+    S3 upload and the OCR are done, or right after the S3 upload when Textract reads the image from S3.
+    """
+    s3_key = None # Initialize s3_key to None, will be set upon successful S3 upload
+    try:
+        # --- Step 1: Upload image to S3 ---
+        if s3_client and S3_BUCKET_NAME:
+            with timer.stage('s3_upload'):
+                s3_key = upload_to_s3(upload.data, original_filename, content_type, timer.trace)
+        else:
+            # If S3 is not configured/available, return an error as S3 upload is a requirement
+            return {'error': 'S3 configuration missing. Cannot upload image to S3.'}, 500
+
+        if flight:
+            flight.check_cancelled()
+
+        # --- Step 2: Perform OCR based on selected model ---
+        extracted_text = ""
+        if ocr_model == 'tesseract':
+            print("Using Tesseract OCR...")
+            # The uploaded bytes are already in memory; downloading them back from S3 would only add a second copy
+            extracted_text = ocr_with_tesseract(upload.data, timer, binarizer, binarizer_requested)
+        elif ocr_model == 'textract':
+            if textract_batcher.MOSAIC_ENABLED and timer.pixel_count and timer.pixel_count <= textract_batcher.MOSAIC_MAX_IMAGE_PIXELS:
+                print("Using Amazon Textract OCR (batched with other small images)...")
+                with timer.stage('textract'):
+                    extracted_text = ocr_with_textract_mosaic(upload.data)
             else:
-                # If S3 is not configured/available, return an error as S3 upload is a requirement
-                return jsonify({'error': 'S3 configuration missing. Cannot upload image to S3.'}), 500
-
-            # --- Step 2: Perform OCR based on selected model ---
-            extracted_text = ""
-            if ocr_model == 'tesseract':
-                print("Using Tesseract OCR (downloading from S3 temporarily)...")
-                # Download image from S3 for Tesseract processing
-                s3_object = s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=s3_key)
-                downloaded_image_bytes = s3_object['Body'].read()
-                extracted_text = ocr_with_tesseract(downloaded_image_bytes)
-            elif ocr_model == 'textract':
                 print("Using Amazon Textract OCR (directly from S3)...")
-                extracted_text = ocr_with_textract_s3(S3_BUCKET_NAME, s3_key)
-            else:
-                return jsonify({'error': 'Invalid OCR model selected'}), 400
+                upload.data = None
+                with timer.stage('textract'):
+                    extracted_text = ocr_with_textract_s3(S3_BUCKET_NAME, s3_key)
+        elif ocr_model == 'auto':
+            print("Using auto OCR (Tesseract first, Textract if confidence is low)...")
+            extracted_text, routing = ocr_auto(upload.data, s3_key, timer, binarizer, binarizer_requested)
+            request_metrics.AUTO_ROUTES.inc(routing['route'])
+            return _with_preprocessing({'text': extracted_text, 'job_id': timer.trace.job_id, 'routing': routing}, timer), 200
+        elif ocr_model in ('race', 'hedge'):
+            print(f"Using {ocr_model} OCR (Tesseract and Textract compete)...")
+            extracted_text, race_details = ocr_race(upload.data, s3_key, timer, hedge=ocr_model == 'hedge',
+                                                    binarizer=binarizer, binarizer_requested=binarizer_requested)
+            return _with_preprocessing({'text': extracted_text, 'job_id': timer.trace.job_id, 'race': race_details}, timer), 200
+        elif ocr_model == 'routed':
+            print("Using region-routed OCR (hard regions go to Textract)...")
+            extracted_text, routing = ocr_routed(upload.data, timer, binarizer)
+            return _with_preprocessing({'text': extracted_text, 'job_id': timer.trace.job_id, 'routing': routing}, timer), 200
+        elif ocr_model == 'progressive':
+            print("Using progressive OCR (reduced page first, low-confidence lines at full resolution)...")
+            extracted_text, progressive = ocr_progressive(upload.data, timer, binarizer)
+            return _with_preprocessing({'text': extracted_text, 'job_id': timer.trace.job_id, 'progressive': progressive}, timer), 200
+        else:
+            return {'error': 'Invalid OCR model selected'}, 400
+
+        return _with_preprocessing({'text': extracted_text, 'job_id': timer.trace.job_id}, timer), 200
 
-            return jsonify({'text': extracted_text}), 200
-
-        except Exception as e:
-            print(f"Server error: {e}")
-            return jsonify({'error': str(e)}), 500
-        finally:
-            # --- Step 3: Clean up image from S3 (optional, but recommended for temporary files) ---
-            if s3_key: # Only try to delete if an S3 key was successfully generated
+    except Exception as e:
+        print(f"Server error: {e}")
+        timer.failed_stage = timer.current_stage
+        return {'error': str(e)}, 500
+    finally:
+        upload.data = None
+        # --- Step 3: Clean up image from S3 (optional, but recommended for temporary files) ---
+        if s3_key: # Only try to delete if an S3 key was successfully generated
+            with timer.stage('s3_delete'):
                 delete_from_s3(s3_key)
 
+def _with_preprocessing(payload, timer):
+    """Adds the preprocessing decisions (page corners, orientation, quality profile) to a response payload, if any were made."""
+    if timer.preprocessing:
+        payload['preprocessing'] = timer.preprocessing
+    return payload
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
 
@@ -0,0 +1,146 @@
+"""
+Compares the binarization backends (see binarization.py) for speed and accuracy.
+
+Every backend binarizes the same synthetic pages: clean, noisy and unevenly lit
+(a brightness falloff across the page, as from a phone photo or a curled scan).
+Reported per backend and page:
+
+- ms and megapixels per second for blur + threshold (median of --repeat runs),
+- pixel F-measure of the ink against the clean render's ink,
+- character error rate of Tesseract on the binary image (when Tesseract is installed).
+
+    python -m benchmarks.bench_binarization --output binarization.json
+
+The summary recommends the cheapest backend whose mean CER (or, without Tesseract,
+F-measure) is within --tolerance of the most accurate one.
+"""
+import sys
+import json
+import time
+import argparse
+import statistics
+
+import cv2
+import numpy as np
+import pytesseract
+from PIL import Image
+
+import binarization
+from benchmarks.synthetic_docs import render_document, character_error_rate
+from benchmarks.bench_pipeline import tesseract_available
+
+DEFAULT_RESOLUTIONS = ['1240x1754', '2480x3508'] # A4 at 150 and 300 DPI
+DEFAULT_FONT_SIZES = [16, 28]
+DEFAULT_NOISE_LEVELS = [0, 12]
+DEFAULT_SHADING = [0.0, 0.5]
+
+
+def apply_shading(gray, shading):
+    """Darkens the page linearly from the top-left corner (factor 1) to the bottom-right (1 - shading)."""
+    if not shading:
+        return gray
+    height, width = gray.shape
+    ramp = 1.0 - shading * (np.add.outer(np.arange(height) / height, np.arange(width) / width) / 2.0)
+    return (gray * ramp).astype(np.uint8)
+
+
+def f_measure(binary, reference_ink):
+    """Harmonic mean of ink precision and recall against the reference (ink is 0 in binary)."""
+    ink = binary == 0
+    true_positives = np.count_nonzero(ink & reference_ink)
+    if not true_positives:
+        return 0.0
+    precision = true_positives / np.count_nonzero(ink)
+    recall = true_positives / np.count_nonzero(reference_ink)
+    return 2 * precision * recall / (precision + recall)
+
+
+def run_backend(backend, gray, reference_ink, text, repeat, with_ocr):
+    seconds = []
+    for _ in range(repeat + 1): # The first run warms up caches and is discarded
+        start = time.perf_counter()
+        binary = binarization.binarize(gray, backend)
+        seconds.append(time.perf_counter() - start)
+    median = statistics.median(seconds[1:])
+    result = {
+        'median_ms': round(median * 1000, 3),
+        'mp_per_s': round(gray.size / 1e6 / median, 2) if median > 0 else None,
+        'f_measure': round(f_measure(binary, reference_ink), 4),
+    }
+    if with_ocr:
+        result['cer'] = round(character_error_rate(text, pytesseract.image_to_string(Image.fromarray(binary))), 4)
+    return result
+
+
+def run_benchmarks(args):
+    with_ocr = tesseract_available()
+    if not with_ocr:
+        print("Tesseract not found; reporting speed and F-measure only.", file=sys.stderr)
+
+    results = {}
+    for resolution in args.resolutions:
+        width, height = (int(v) for v in resolution.split('x'))
+        for font_px in args.font_sizes:
+            clean, text = render_document(width, height, font_px, 0, args.seed)
+            reference_ink = cv2.cvtColor(clean, cv2.COLOR_BGR2GRAY) < 128
+            for noise in args.noise_levels:
+                page = clean if not noise else render_document(width, height, font_px, noise, args.seed)[0]
+                for shading in args.shading:
+                    gray = apply_shading(cv2.cvtColor(page, cv2.COLOR_BGR2GRAY), shading)
+                    case_id = f"{width}x{height}-{font_px}px-noise{noise}-shading{shading}"
+                    for backend in args.backends:
+                        key = f"{backend}/{case_id}"
+                        results[key] = run_backend(backend, gray, reference_ink, text, args.repeat, with_ocr)
+                        print(f"{key}: " + ", ".join(f"{name}={value}" for name, value in results[key].items()))
+    return results
+
+
+def summarize(results, backends, tolerance):
+    """Mean figures per backend plus the cheapest backend within tolerance of the most accurate."""
+    summary = {}
+    for backend in backends:
+        cases = [result for key, result in results.items() if key.startswith(backend + '/')]
+        summary[backend] = {name: round(statistics.mean(case[name] for case in cases), 4)
+                            for name in ('median_ms', 'f_measure', 'cer') if cases and name in cases[0]}
+
+    if all('cer' in figures for figures in summary.values()):
+        best = min(figures['cer'] for figures in summary.values())
+        eligible = [b for b, figures in summary.items() if figures['cer'] <= best + tolerance]
+    else:
+        best = max(figures['f_measure'] for figures in summary.values())
+        eligible = [b for b, figures in summary.items() if figures['f_measure'] >= best - tolerance]
+    return summary, min(eligible, key=lambda b: summary[b]['median_ms'])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', nargs='+', default=list(binarization.BACKENDS), choices=list(binarization.BACKENDS))
+    parser.add_argument('--resolutions', nargs='+', default=DEFAULT_RESOLUTIONS, help="WIDTHxHEIGHT")
+    parser.add_argument('--font-sizes', nargs='+', type=int, default=DEFAULT_FONT_SIZES)
+    parser.add_argument('--noise-levels', nargs='+', type=int, default=DEFAULT_NOISE_LEVELS)
+    parser.add_argument('--shading', nargs='+', type=float, default=DEFAULT_SHADING,
+                        help="Brightness falloff across the page, 0 (even) to 1")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tolerance', type=float, default=0.01,
+                        help="Accuracy (CER or F-measure) a cheaper backend may give up (default 0.01)")
+    parser.add_argument('--output', help="Write results as JSON to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run_benchmarks(args)
+    summary, recommended = summarize(results, args.backends, args.tolerance)
+    for backend, figures in summary.items():
+        print(f"{backend}: " + ", ".join(f"mean {name}={value}" for name, value in figures.items()))
+    print(f"Cheapest backend within {args.tolerance} of the most accurate: {recommended}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'cases': results, 'summary': summary, 'recommended': recommended}, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
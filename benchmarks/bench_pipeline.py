@@ -0,0 +1,175 @@
+"""
+Benchmarks the preprocessing and OCR hot paths on synthetic documents.
+
+Times every stage separately (decode, blur, threshold, encode, OCR) for
+app.preprocess_image_from_bytes(), lambda_function.preprocess_image_opencv() and
+app.ocr_with_tesseract(), and reports throughput per megapixel and peak traced memory.
+
+    python -m benchmarks.bench_pipeline --output bench.json
+    python -m benchmarks.bench_pipeline --baseline bench.json --max-regression 10
+
+With --baseline the run fails (exit code 1) when any stage's median is more than
+--max-regression percent slower than in the baseline.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import tracemalloc
+
+# lambda_function creates boto3 clients at import time, which need a region
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import pytesseract
+
+import app
+import lambda_function
+from request_metrics import RequestTimer
+from benchmarks.synthetic_docs import generate_documents, character_error_rate
+
+DEFAULT_RESOLUTIONS = ['1240x1754', '2480x3508'] # A4 at 150 and 300 DPI
+DEFAULT_FONT_SIZES = [16, 28]
+DEFAULT_NOISE_LEVELS = [0, 12]
+DEFAULT_ENCODINGS = ['png', 'jpg', 'tiff']
+
+
+def _preprocess_flask(document, timer):
+    app.preprocess_image_from_bytes(document.encoded, timer)
+
+def _preprocess_lambda(document, timer):
+    lambda_function.preprocess_image_opencv(document.encoded, timer)
+
+def _ocr_tesseract(document, timer):
+    return app.ocr_with_tesseract(document.encoded, timer)
+
+TARGETS = {
+    'flask_preprocess': _preprocess_flask,
+    'lambda_preprocess': _preprocess_lambda,
+    'tesseract': _ocr_tesseract,
+}
+
+
+def tesseract_available():
+    try:
+        pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
+
+
+def run_target(target, document, repeat, warmup=1):
+    """Runs one target on one document and returns per-stage timings, peak memory and accuracy."""
+    function = TARGETS[target]
+    for _ in range(warmup):
+        function(document, RequestTimer())
+
+    samples = {}
+    output = None
+    for _ in range(repeat):
+        timer = RequestTimer()
+        output = function(document, timer)
+        for stage, seconds in timer.timings.items():
+            samples.setdefault(stage, []).append(seconds)
+        samples.setdefault('total', []).append(sum(timer.timings.values()))
+
+    # Memory is measured in a separate pass because tracing allocations slows the timed runs down
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        function(document, RequestTimer())
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    stages = {}
+    for stage, values in samples.items():
+        median = statistics.median(values)
+        stages[stage] = {
+            'median_ms': round(median * 1000, 3),
+            'min_ms': round(min(values) * 1000, 3),
+            'max_ms': round(max(values) * 1000, 3),
+            'mp_per_s': round(document.megapixels / median, 2) if median > 0 else None,
+        }
+    result = {'megapixels': round(document.megapixels, 3), 'peak_bytes': peak_bytes, 'stages': stages}
+    if isinstance(output, str):
+        result['cer'] = round(character_error_rate(document.text, output), 4)
+    return result
+
+
+def run_benchmarks(args):
+    targets = [t for t in args.targets if t != 'tesseract' or tesseract_available()]
+    if len(targets) != len(args.targets):
+        print("Tesseract not found; skipping the OCR target.", file=sys.stderr)
+
+    resolutions = [tuple(int(v) for v in r.split('x')) for r in args.resolutions]
+    results = {}
+    for document in generate_documents(resolutions, args.font_sizes, args.noise_levels, args.encodings, args.seed):
+        for target in targets:
+            key = f"{target}/{document.case_id}"
+            results[key] = run_target(target, document, args.repeat)
+            stages = results[key]['stages']
+            summary = ", ".join(f"{name}={s['median_ms']:.1f}ms" for name, s in stages.items())
+            print(f"{key}: {summary}, peak={results[key]['peak_bytes'] / 1e6:.1f}MB"
+                  + (f", cer={results[key]['cer']:.3f}" if 'cer' in results[key] else ""))
+    return results
+
+
+def find_regressions(results, baseline, max_regression_pct, min_ms):
+    """Returns a description of every stage whose median slowed down by more than max_regression_pct."""
+    regressions = []
+    for key, result in results.items():
+        baseline_stages = baseline.get(key, {}).get('stages', {})
+        for stage, timing in result['stages'].items():
+            before = baseline_stages.get(stage, {}).get('median_ms')
+            if not before or before < min_ms:
+                continue # Stages this fast are dominated by timer noise
+            change_pct = (timing['median_ms'] - before) / before * 100.0
+            if change_pct > max_regression_pct:
+                regressions.append(f"{key} {stage}: {before:.2f}ms -> {timing['median_ms']:.2f}ms (+{change_pct:.1f}%)")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--targets', nargs='+', default=list(TARGETS), choices=list(TARGETS))
+    parser.add_argument('--resolutions', nargs='+', default=DEFAULT_RESOLUTIONS, help="WIDTHxHEIGHT")
+    parser.add_argument('--font-sizes', nargs='+', type=int, default=DEFAULT_FONT_SIZES)
+    parser.add_argument('--noise-levels', nargs='+', type=int, default=DEFAULT_NOISE_LEVELS)
+    parser.add_argument('--encodings', nargs='+', default=DEFAULT_ENCODINGS, choices=['png', 'jpg', 'tiff'])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write results as JSON to this file")
+    parser.add_argument('--baseline', help="Compare against a previous --output file")
+    parser.add_argument('--max-regression', type=float, default=float(os.environ.get('BENCH_MAX_REGRESSION', 10)),
+                        help="Allowed slowdown per stage in percent (default 10)")
+    parser.add_argument('--min-ms', type=float, default=1.0, help="Ignore stages faster than this in the baseline")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    started = time.time()
+    results = run_benchmarks(args)
+    print(f"Benchmarked {len(results)} cases in {time.time() - started:.1f}s")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.max_regression, args.min_ms)
+        if regressions:
+            print(f"{len(regressions)} stage(s) regressed by more than {args.max_regression}%:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"No stage regressed by more than {args.max_regression}%.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
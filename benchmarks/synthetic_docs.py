@@ -0,0 +1,114 @@
+"""
+Generates synthetic document images with known ground-truth text, entirely in memory.
+Used by the benchmarks so every run measures the same pixels.
+"""
+import random
+
+import cv2
+import numpy as np
+
+VOCABULARY = (
+    "invoice total amount due date account number payment received balance customer "
+    "order quantity price description tax subtotal reference shipping address phone "
+    "receipt thank you for your business signature approved department report summary"
+).split()
+
+ENCODINGS = {
+    'png': ('.png', []),
+    'jpg': ('.jpg', [cv2.IMWRITE_JPEG_QUALITY, 90]),
+    'tiff': ('.tiff', []),
+}
+
+
+class SyntheticDocument:
+    def __init__(self, image, text, width, height, font_px, noise, encoding, encoded):
+        self.image = image # Rendered BGR image before encoding
+        self.text = text # Ground truth, one line per rendered text line
+        self.width = width
+        self.height = height
+        self.font_px = font_px
+        self.noise = noise
+        self.encoding = encoding
+        self.encoded = encoded # Encoded image bytes, as an upload would deliver them
+
+    @property
+    def case_id(self):
+        return f"{self.width}x{self.height}-{self.font_px}px-noise{self.noise}-{self.encoding}"
+
+    @property
+    def megapixels(self):
+        return self.width * self.height / 1_000_000
+
+
+def render_document(width, height, font_px, noise=0, seed=0):
+    """
+    Renders black text lines on a white page. font_px is the approximate cap height in pixels,
+    noise the standard deviation of additive Gaussian noise (0 for a clean render).
+    Returns (bgr_image, ground_truth_text).
+    """
+    rng = random.Random(seed)
+    image = np.full((height, width, 3), 255, np.uint8)
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    scale = cv2.getFontScaleFromHeight(font, font_px)
+    thickness = max(1, font_px // 12)
+    margin = max(10, width // 20)
+    line_height = int(font_px * 1.8)
+
+    lines = []
+    y = margin + font_px
+    while y < height - margin:
+        words = []
+        while True:
+            candidate = words + [rng.choice(VOCABULARY)]
+            (text_width, _), _ = cv2.getTextSize(" ".join(candidate), font, scale, thickness)
+            if text_width > width - 2 * margin:
+                break
+            words = candidate
+        if not words:
+            break
+        line = " ".join(words)
+        cv2.putText(image, line, (margin, y), font, scale, (0, 0, 0), thickness, cv2.LINE_AA)
+        lines.append(line)
+        y += line_height
+
+    if noise:
+        noise_rng = np.random.default_rng(seed)
+        noisy = image.astype(np.int16) + noise_rng.normal(0, noise, image.shape).astype(np.int16)
+        image = np.clip(noisy, 0, 255).astype(np.uint8)
+
+    return image, "\n".join(lines)
+
+
+def encode_image(image, encoding):
+    extension, params = ENCODINGS[encoding]
+    ok, buffer = cv2.imencode(extension, image, params)
+    if not ok:
+        raise ValueError(f"Could not encode synthetic document as {encoding}")
+    return buffer.tobytes()
+
+
+def generate_documents(resolutions, font_sizes, noise_levels, encodings, seed=0):
+    """Yields a SyntheticDocument for every combination of the given parameters."""
+    for width, height in resolutions:
+        for font_px in font_sizes:
+            for noise in noise_levels:
+                image, text = render_document(width, height, font_px, noise, seed)
+                for encoding in encodings:
+                    yield SyntheticDocument(image, text, width, height, font_px, noise, encoding,
+                                            encode_image(image, encoding))
+
+
+def character_error_rate(reference, hypothesis):
+    """Levenshtein distance between the two texts (whitespace-normalized) divided by the reference length."""
+    reference = " ".join(reference.split())
+    hypothesis = " ".join(hypothesis.split())
+    if not reference:
+        return 0.0 if not hypothesis else 1.0
+
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_char in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_char in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref_char != hyp_char)))
+        previous = current
+    return previous[-1] / len(reference)
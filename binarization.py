@@ -0,0 +1,111 @@
+import os
+
+import cv2
+import numpy as np
+
+# --- Configuration ---
+# BINARIZATION names the default backend (see BACKENDS): 'gaussian' (adaptive Gaussian-weighted
+# threshold, the original pipeline), 'otsu' (one global threshold), 'bradley' (local mean) or
+# 'sauvola' (local mean and deviation). BINARIZATION_POLICY overrides it per OCR model, e.g.
+# "tesseract=sauvola,routed=bradley"; a request may still name its own backend. The Lambda has
+# neither OCR models nor request parameters, so it always uses BINARIZATION and ignores the policy.
+# Unknown backend names in either setting fail the import, so a typo stops the process at startup.
+# bradley and sauvola keep running window sums, so their cost per pixel does not depend on
+# BINARIZATION_WINDOW.
+BINARIZATION = os.environ.get('BINARIZATION', 'gaussian').lower()
+BINARIZATION_POLICY = dict(
+    entry.strip().lower().split('=', 1) for entry in os.environ.get('BINARIZATION_POLICY', '').split(',') if '=' in entry)
+BINARIZATION_WINDOW = int(os.environ.get('BINARIZATION_WINDOW', 31)) # Side of the local window (odd), bradley and sauvola
+BRADLEY_T = float(os.environ.get('BRADLEY_T', 0.15)) # Ink is at least this fraction darker than the local mean
+SAUVOLA_K = float(os.environ.get('SAUVOLA_K', 0.2))
+SAUVOLA_R = 128.0 # Dynamic range of the standard deviation for 8-bit images
+BLUR_KERNEL = (5, 5)
+
+
+def _gaussian(blurred, dst):
+    return cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2, dst=dst)
+
+
+def _otsu(blurred, dst):
+    _, binary = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=dst)
+    return binary
+
+
+def _local_mean(blurred, squares=False):
+    """
+    Mean of the pixels (or of their squares) in the BINARIZATION_WINDOW square around every pixel.
+    cv2.boxFilter keeps running window sums, the separable form of an integral image: the cost
+    per pixel is constant whatever the window size, without full-size integral tables.
+    """
+    window = (BINARIZATION_WINDOW, BINARIZATION_WINDOW)
+    box_filter = cv2.sqrBoxFilter if squares else cv2.boxFilter
+    return box_filter(blurred, cv2.CV_32F, window, borderType=cv2.BORDER_REFLECT)
+
+
+def _write_binary(background, dst, shape):
+    """Writes background pixels as 255 and ink as 0 (the THRESH_BINARY convention of the other backends)."""
+    binary = dst if dst is not None else np.empty(shape, np.uint8)
+    np.multiply(background, 255, out=binary, casting='unsafe')
+    return binary
+
+
+def _bradley(blurred, dst):
+    threshold = _local_mean(blurred)
+    threshold *= 1.0 - BRADLEY_T
+    return _write_binary(blurred >= threshold, dst, blurred.shape)
+
+
+def _sauvola(blurred, dst):
+    mean = _local_mean(blurred)
+    deviation = cv2.sqrt(cv2.max(_local_mean(blurred, squares=True) - mean * mean, 0.0))
+    # threshold = mean * (1 + k * (deviation / R - 1)), computed in place in deviation
+    deviation *= SAUVOLA_K / SAUVOLA_R
+    deviation += 1.0 - SAUVOLA_K
+    deviation *= mean
+    return _write_binary(blurred >= deviation, dst, blurred.shape)
+
+
+# name -> function(blurred grey image, dst or None) returning the binary image (dst may alias the input)
+BACKENDS = {
+    'gaussian': _gaussian,
+    'otsu': _otsu,
+    'bradley': _bradley,
+    'sauvola': _sauvola,
+}
+
+
+def _check_configuration():
+    """Raises ValueError if BINARIZATION or BINARIZATION_POLICY names a backend that does not exist."""
+    configured = [('BINARIZATION', BINARIZATION)]
+    configured += [(f"BINARIZATION_POLICY ({model})", name) for model, name in BINARIZATION_POLICY.items()]
+    for setting, name in configured:
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown binarization '{name}' in {setting}; choose one of {', '.join(BACKENDS)}.")
+
+
+_check_configuration()
+
+
+def backend_for(ocr_model=None, requested=None):
+    """
+    Resolves the backend for one request: the requested name if given, else the policy for
+    ocr_model, else BINARIZATION. Raises ValueError for unknown names.
+    """
+    name = (requested or BINARIZATION_POLICY.get(ocr_model) or BINARIZATION).lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown binarization '{name}'; choose one of {', '.join(BACKENDS)}.")
+    return name
+
+
+def blur(gray, dst=None):
+    return cv2.GaussianBlur(gray, BLUR_KERNEL, 0, dst=dst)
+
+
+def threshold(blurred, method=None, dst=None):
+    """Binarizes a blurred grey image with the named backend (default BINARIZATION); dst may be blurred itself."""
+    return BACKENDS[method or BINARIZATION](blurred, dst)
+
+
+def binarize(gray, method=None, dst=None):
+    """Blur plus threshold. With dst (which may be gray itself) no full-size array is allocated for the blur."""
+    return threshold(blur(gray, dst=dst), method, dst=dst)
@@ -0,0 +1,146 @@
+import os
+
+import cv2
+import numpy as np
+
+# --- Configuration ---
+# With DESKEW on, pages are checked for sideways or upside-down orientation and for skew before
+# preprocessing. The analysis runs on a copy whose longer side is at most DESKEW_MAX_SIDE; the
+# full-resolution page is then rotated once, and only if it is off by a quarter turn or by
+# more than DESKEW_MIN_ANGLE degrees. Skew is searched within +-DESKEW_MAX_ANGLE degrees.
+# EXIF orientation needs no handling here: cv2.imdecode already applies it.
+DESKEW = os.environ.get('DESKEW', 'false').lower() == 'true'
+DESKEW_MAX_SIDE = int(os.environ.get('DESKEW_MAX_SIDE', 1024))
+DESKEW_MIN_ANGLE = float(os.environ.get('DESKEW_MIN_ANGLE', 0.3))
+DESKEW_MAX_ANGLE = float(os.environ.get('DESKEW_MAX_ANGLE', 15))
+DESKEW_MAX_POINTS = 40000 # Ink pixels sampled for the skew search
+# The upside-down test needs glyph detail, so it reads one window of this side at full
+# resolution, centred on the ink, rather than the reduced copy
+DESKEW_FLIP_WINDOW = 1024
+# Upright Latin text has more ink in ascenders than in descenders; a page is only turned
+# upside down when its descender ink exceeds its ascender ink by this factor
+DESKEW_FLIP_RATIO = float(os.environ.get('DESKEW_FLIP_RATIO', 1.25))
+
+
+def _ink_mask(small):
+    """Ink as 1 (local mean threshold, so uneven lighting does not matter)."""
+    mask = cv2.adaptiveThreshold(small, 1, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 25, 15)
+    return cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((2, 2), np.uint8))
+
+
+def _profile_score(ys, xs, angles_deg):
+    """
+    For each candidate angle, the sum of squares of the row histogram of the ink rotated by that
+    angle: lines of text give sharp peaks (high score) only when they are horizontal.
+    """
+    scores = []
+    for angle in np.radians(angles_deg):
+        rows = np.round(ys * np.cos(angle) - xs * np.sin(angle)).astype(np.int64)
+        counts = np.bincount(rows - rows.min())
+        scores.append(float(np.dot(counts, counts)))
+    return np.array(scores)
+
+
+def _ink_points(mask):
+    """Row and column coordinates (float) of up to DESKEW_MAX_POINTS ink pixels."""
+    ys, xs = np.nonzero(mask)
+    if ys.size > DESKEW_MAX_POINTS:
+        keep = np.random.default_rng(0).choice(ys.size, DESKEW_MAX_POINTS, replace=False)
+        ys, xs = ys[keep], xs[keep]
+    return ys.astype(np.float64), xs.astype(np.float64)
+
+
+def _skew_angle(ys, xs):
+    """
+    Returns (angle, score): the angle in degrees (counter-clockwise) by which the text lines
+    formed by the ink points are tilted, and how peaky the profile is at that angle.
+    """
+    # Coarse search over the whole range, then a fine one around the best coarse angle
+    coarse = np.arange(-DESKEW_MAX_ANGLE, DESKEW_MAX_ANGLE + 1e-9, 1.0)
+    best = coarse[_profile_score(ys, xs, coarse).argmax()]
+    fine = np.arange(best - 1.0, best + 1.0 + 1e-9, 0.1)
+    scores = _profile_score(ys, xs, fine)
+    return float(fine[scores.argmax()]), float(scores.max())
+
+
+def _is_upside_down(mask):
+    """
+    Compares ink above and below the x-height bands of the text lines in a levelled ink mask.
+    The bands are the densest rows; the rows between two bands are split halfway, the upper
+    half holding the descenders of the line above and the lower half the ascenders of the line
+    below. Upright Latin text carries more ink in ascenders and capitals than in descenders.
+    """
+    rows = mask.sum(axis=1, dtype=np.float64)
+    if not rows.any():
+        return False
+    core = np.concatenate(([0], (rows >= 0.5 * np.percentile(rows[rows > 0], 90)).astype(np.int8), [0]))
+    edges = np.flatnonzero(np.diff(core))
+    bands = [(start, end) for start, end in zip(edges[0::2], edges[1::2]) if end - start >= 2]
+    above = below = 0.0
+    for (_, upper_end), (lower_start, _) in zip(bands, bands[1:]):
+        middle = (upper_end + lower_start) // 2
+        below += rows[upper_end:middle].sum()
+        above += rows[middle:lower_start].sum()
+    return below > DESKEW_FLIP_RATIO * max(above, 1.0)
+
+
+def detect(gray):
+    """
+    Returns (quarter_turns, skew_degrees): rotate the page counter-clockwise by
+    quarter_turns * 90 degrees and then by skew_degrees to make its text upright and level.
+    """
+    scale = min(1.0, DESKEW_MAX_SIDE / float(max(gray.shape)))
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1.0 else gray
+    mask = _ink_mask(small)
+
+    ys, xs = _ink_points(mask)
+    if ys.size < 100:
+        return 0, 0.0
+    # Sideways text has level lines once the page is turned a quarter: (-x, y) are the
+    # coordinates (up to an offset) of the ink after a quarter turn counter-clockwise
+    skew, score = _skew_angle(ys, xs)
+    turned_skew, turned_score = _skew_angle(-xs, ys)
+    quarter_turns = 0
+    if turned_score > score:
+        quarter_turns, skew = 1, turned_skew
+    if abs(skew) < DESKEW_MIN_ANGLE:
+        skew = 0.0
+    centre = (float(xs.mean()) / scale, float(ys.mean()) / scale)
+    if _is_upside_down(_ink_mask(_levelled_window(gray, centre, quarter_turns, skew))):
+        quarter_turns += 2
+    return quarter_turns % 4, skew
+
+
+def _levelled_window(gray, centre, quarter_turns, skew):
+    """The DESKEW_FLIP_WINDOW square around centre (x, y) of the page, rotated as detected."""
+    half = DESKEW_FLIP_WINDOW // 2
+    reach = int(half * 1.5) # Enough margin that the rotated window has no empty corners
+    x, y = int(centre[0]), int(centre[1])
+    crop = gray[max(0, y - reach):y + reach, max(0, x - reach):x + reach]
+    levelled = _rotate(crop, quarter_turns, skew)
+    cy, cx = levelled.shape[0] // 2, levelled.shape[1] // 2
+    return levelled[max(0, cy - half):cy + half, max(0, cx - half):cx + half]
+
+
+def _rotate(image, quarter_turns, skew, border=255):
+    """One warp for the combined rotation, onto a canvas large enough to keep every corner."""
+    angle = quarter_turns * 90.0 + skew
+    height, width = image.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width / 2.0, height / 2.0), angle, 1.0)
+    cos, sin = abs(matrix[0, 0]), abs(matrix[0, 1])
+    new_width, new_height = int(round(height * sin + width * cos)), int(round(height * cos + width * sin))
+    matrix[0, 2] += new_width / 2.0 - width / 2.0
+    matrix[1, 2] += new_height / 2.0 - height / 2.0
+    return cv2.warpAffine(image, matrix, (new_width, new_height), flags=cv2.INTER_LINEAR,
+                          borderMode=cv2.BORDER_CONSTANT, borderValue=border)
+
+
+_QUARTER_TURNS = {1: cv2.ROTATE_90_COUNTERCLOCKWISE, 2: cv2.ROTATE_180, 3: cv2.ROTATE_90_CLOCKWISE}
+
+
+def correct(gray, quarter_turns, skew):
+    """Applies detect()'s result to the full-resolution page, with a single rotation (none if upright)."""
+    if not skew:
+        # Exact quarter turns need no interpolation
+        return cv2.rotate(gray, _QUARTER_TURNS[quarter_turns]) if quarter_turns else gray
+    return _rotate(gray, quarter_turns, skew)
@@ -0,0 +1,87 @@
+import os
+import json
+import time
+from contextlib import contextmanager, nullcontext
+from tracing import start_span
+from request_metrics import size_bucket # Shared with the Flask app, so both use the same dimension values
+
+# --- Configuration ---
+# CloudWatch extracts metrics from log lines in Embedded Metric Format (EMF), so the Lambda needs
+# no metrics client: each record is a single JSON line printed to stdout.
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'OCRConverter')
+FUNCTION_NAME = os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')
+
+
+def metric_name(stage):
+    """The metric for a stage's duration, in CamelCase: 'page_crop' -> 'PageCropTime'."""
+    return "".join(part.capitalize() for part in stage.split('_')) + "Time"
+
+
+class StageTimer:
+    """
+    Collects per-stage durations for one unit of work (a record or a page) and emits them
+    as a single EMF record. Stage durations become metrics named "<Stage>Time" in milliseconds;
+    image size, pixel count and block count are attached as metrics and properties.
+    If a trace is given, every stage is also exported as a span of that trace.
+    """
+
+    def __init__(self, path='record', trace=None):
+        self.trace = trace
+        self.timings = {}
+        self.properties = {'path': path}
+        if trace:
+            self.properties.update({'job_id': trace.job_id, 'trace_id': trace.trace_id})
+        self.pixel_count = None
+        self.block_count = None
+        self.image_bytes = None
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            with start_span(name, self.trace) if self.trace else nullcontext():
+                yield
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000.0
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed_ms
+
+    def set_property(self, key, value):
+        self.properties[key] = value
+
+    def to_record(self):
+        """Builds the EMF document for everything recorded so far."""
+        bucket = size_bucket(self.pixel_count)
+        metrics = {metric_name(stage): round(ms, 3) for stage, ms in self.timings.items()}
+        definitions = [{'Name': name, 'Unit': 'Milliseconds'} for name in metrics]
+
+        if self.image_bytes is not None:
+            metrics['ImageBytes'] = self.image_bytes
+            definitions.append({'Name': 'ImageBytes', 'Unit': 'Bytes'})
+        if self.pixel_count is not None:
+            metrics['Megapixels'] = round(self.pixel_count / 1_000_000, 4)
+            definitions.append({'Name': 'Megapixels', 'Unit': 'None'})
+        if self.block_count is not None:
+            metrics['BlockCount'] = self.block_count
+            definitions.append({'Name': 'BlockCount', 'Unit': 'Count'})
+
+        record = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': METRICS_NAMESPACE,
+                    'Dimensions': [['FunctionName'], ['FunctionName', 'SizeBucket']],
+                    'Metrics': definitions,
+                }],
+            },
+            'FunctionName': FUNCTION_NAME,
+            'SizeBucket': bucket,
+        }
+        if self.pixel_count is not None:
+            record['pixel_count'] = self.pixel_count
+        record.update(self.properties)
+        record.update(metrics)
+        return record
+
+    def emit(self):
+        # Printed rather than logged: the Lambda log formatter would prefix the line and break EMF parsing
+        print(json.dumps(self.to_record()), flush=True)
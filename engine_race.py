@@ -0,0 +1,194 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+import pytesseract
+
+# --- Configuration ---
+# Hedged mode starts the secondary engine once the primary has run longer than its recent p90.
+# Until RACE_HEDGE_MIN_SAMPLES latencies have been seen, RACE_HEDGE_DEFAULT_MS is used instead.
+RACE_HEDGE_DEFAULT_MS = float(os.environ.get('RACE_HEDGE_DEFAULT_MS', 2000))
+RACE_HEDGE_MIN_SAMPLES = int(os.environ.get('RACE_HEDGE_MIN_SAMPLES', 20))
+RACE_LATENCY_WINDOW = int(os.environ.get('RACE_LATENCY_WINDOW', 200))
+RACE_POLL_SECONDS = 0.02
+
+
+class Cancelled(Exception):
+    """Raised inside an engine attempt that lost the race."""
+
+
+class LatencyTracker:
+    """
+    Keeps the most recent completed latencies per engine. Cancelled attempts are not recorded,
+    so each window describes how long the engine takes when it is allowed to finish.
+    """
+
+    def __init__(self, window=RACE_LATENCY_WINDOW):
+        self._samples = {}
+        self._window = window
+        self._lock = threading.Lock()
+
+    def record(self, engine, seconds):
+        with self._lock:
+            self._samples.setdefault(engine, deque(maxlen=self._window)).append(seconds)
+
+    def percentile(self, engine, pct, min_samples=RACE_HEDGE_MIN_SAMPLES):
+        with self._lock:
+            samples = list(self._samples.get(engine, ()))
+        if len(samples) < min_samples:
+            return None
+        return float(np.percentile(samples, pct))
+
+    def hedge_delay(self, engine):
+        """Seconds to wait for engine before hedging: its p90, or the default while warming up."""
+        p90 = self.percentile(engine, 90)
+        return p90 if p90 is not None else RACE_HEDGE_DEFAULT_MS / 1000.0
+
+
+LATENCY = LatencyTracker()
+
+
+def _parse_tsv(path):
+    """Reads Tesseract's TSV output into the column dict of pytesseract's image_to_data(DICT)."""
+    with open(path, encoding='utf-8') as f:
+        rows = [line.rstrip('\n').split('\t') for line in f]
+    header, rows = rows[0], [row for row in rows[1:] if len(row) == len(rows[0])]
+    data = {column: [row[i] for row in rows] for i, column in enumerate(header)}
+    for column in header:
+        if column != 'text':
+            data[column] = [float(v) if column == 'conf' else int(v) for v in data[column]]
+    return data
+
+
+def tesseract_data_cancellable(pil_image, cancel_event):
+    """
+    Runs the tesseract binary on pil_image and returns image_to_data()-style columns.
+    pytesseract does not expose its subprocess, so the binary is started here directly and
+    killed as soon as cancel_event is set, freeing the CPU for the request that won.
+    stderr goes to a file in the work directory rather than a pipe that nobody reads while polling,
+    so a chatty tesseract cannot block on a full pipe buffer.
+    """
+    workdir = tempfile.mkdtemp(prefix='ocr-race-')
+    try:
+        image_path = os.path.join(workdir, 'input.png')
+        stderr_path = os.path.join(workdir, 'stderr.txt')
+        pil_image.save(image_path)
+        output_base = os.path.join(workdir, 'out')
+        command = [pytesseract.pytesseract.tesseract_cmd, image_path, output_base, 'tsv']
+        with open(stderr_path, 'wb') as stderr:
+            process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=stderr)
+        while process.poll() is None:
+            if cancel_event.wait(RACE_POLL_SECONDS):
+                process.kill()
+                process.wait()
+                raise Cancelled("tesseract was cancelled")
+        if process.returncode != 0:
+            with open(stderr_path, encoding='utf-8', errors='replace') as stderr:
+                message = stderr.read().strip()
+            raise Exception(message or f"tesseract exited with {process.returncode}")
+        return _parse_tsv(output_base + '.tsv')
+    except FileNotFoundError:
+        raise pytesseract.TesseractNotFoundError()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def race(attempts, hedge_after=None):
+    """
+    Runs engine attempts concurrently and returns the first acceptable result.
+
+    attempts is a list of (name, function) in priority order; function(cancel_event) returns
+    (result, acceptable). Once an acceptable result arrives every other attempt's cancel_event is
+    set. With hedge_after (seconds) only the first attempt starts; the rest start only if it has
+    not produced an acceptable result by then (still running, failed or unacceptable).
+    If no result is acceptable the first one to complete (in priority order) is returned, and if
+    every attempt failed the last error is raised.
+
+    Returns (name, result, details) where details lists which engines started and their latencies.
+    """
+    cancel_events = {name: threading.Event() for name, _ in attempts}
+    started_at, latencies, results, errors = {}, {}, {}, {}
+    pool = ThreadPoolExecutor(max_workers=len(attempts), thread_name_prefix='ocr-race')
+
+    def run(name, function):
+        start = time.perf_counter()
+        try:
+            return function(cancel_events[name])
+        finally:
+            latencies[name] = time.perf_counter() - start
+
+    def start(name, function):
+        started_at[name] = time.perf_counter()
+        return pool.submit(run, name, function)
+
+    futures = {}
+
+    def settle(future):
+        """Records the outcome of a finished attempt; returns True if its result is acceptable."""
+        name = futures[future]
+        try:
+            result, acceptable = future.result()
+        except Cancelled:
+            return False
+        except Exception as e:
+            errors[name] = e
+            return False
+        LATENCY.record(name, latencies[name])
+        results[name] = result
+        return acceptable
+
+    def win(name):
+        for other, event in cancel_events.items():
+            if other != name:
+                event.set()
+        return name, results[name], _details(name, attempts, started_at, latencies, hedge_after)
+
+    try:
+        pending_attempts, pending = list(attempts), set()
+        if hedge_after is not None:
+            name, function = pending_attempts.pop(0)
+            primary = start(name, function)
+            futures[primary] = name
+            done, pending = wait([primary], timeout=hedge_after)
+            # The hedge only starts if the primary is late, failed or returned an unacceptable result
+            if done and settle(primary):
+                return win(name)
+            if done:
+                print(f"{name} finished without an acceptable result; starting the hedge")
+            else:
+                print(f"{name} exceeded {hedge_after * 1000:.0f}ms; starting the hedge")
+        for name, function in pending_attempts:
+            future = start(name, function)
+            futures[future] = name
+            pending.add(future)
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if settle(future):
+                    return win(futures[future])
+
+        for name, _ in attempts:
+            if name in results:
+                details = _details(name, attempts, started_at, latencies, hedge_after, acceptable=False)
+                return name, results[name], details
+        raise list(errors.values())[-1]
+    finally:
+        # Losing Textract calls cannot be interrupted; their threads finish in the background
+        pool.shutdown(wait=False)
+
+
+def _details(winner, attempts, started_at, latencies, hedge_after, acceptable=True):
+    return {
+        'winner': winner,
+        'acceptable': acceptable,
+        'started': [name for name, _ in attempts if name in started_at],
+        'hedge_after_ms': round(hedge_after * 1000, 1) if hedge_after is not None else None,
+        'latency_ms': {name: round(seconds * 1000, 1) for name, seconds in latencies.items()},
+    }
@@ -2,11 +2,18 @@ import os
 import io
 import json
 import boto3
-import cv2
-import numpy as np
 from PIL import Image
 import logging
+import random
+import re
 import time # Using time.time() for timestamping (consider datetime for human readability)
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError, HTTPClientError, ConnectionError as BotoConnectionError
+from result_store import build_result_attributes
+import ocr_pipeline
+from emf_metrics import StageTimer
+from tracing import TraceContext, start_span
 
 # Setup logging
 logger = logging.getLogger()
@@ -17,152 +24,711 @@ logger.setLevel(logging.INFO)
 s3_client = boto3.client('s3')
 textract_client = boto3.client('textract')
 dynamodb_client = boto3.client('dynamodb')
+lambda_client = boto3.client('lambda') # Used to re-enqueue remaining work before the function times out
 
-# X-Ray integration: Lambda will automatically instrument if X-Ray is enabled on the function.
-# No code changes needed here beyond importing if you use a specific SDK patch.
-# For standard Lambda functions, just enabling it in console/Terraform is enough.
-# import aws_xray_sdk.core
-# aws_xray_sdk.core.patch_all() # This line would be used if you need deeper SDK instrumentation
+# Tracing: the Flask app stores a trace context (job_id, trace_id, parent span) as S3 object metadata.
+# Spans for every stage are emitted through the exporter configured in tracing.py (TRACE_EXPORTER).
+# X-Ray can still be enabled on the function for AWS-side service maps.
 
 # Environment variables for Lambda (set via Terraform or Lambda console)
 DYNAMODB_TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME')
 PREPROCESSED_IMAGES_PREFIX = os.environ.get('PREPROCESSED_IMAGES_PREFIX', 'preprocessed-images/')
+# Fraction of invocations whose full event is logged; the rest only log a one-line summary
+EVENT_LOG_SAMPLE_RATE = float(os.environ.get('EVENT_LOG_SAMPLE_RATE', 0.01))
 
-def preprocess_image_opencv(image_bytes):
+# Deadline handling (milliseconds). The safety margin is reserved for writing checkpoints and
+# re-enqueueing unfinished work before Lambda terminates the invocation.
+DEADLINE_SAFETY_MARGIN_MS = int(os.environ.get('DEADLINE_SAFETY_MARGIN_MS', 3000))
+OPTIONAL_STAGE_MIN_REMAINING_MS = int(os.environ.get('OPTIONAL_STAGE_MIN_REMAINING_MS', 20000)) # Preprocessing is skipped below this
+TEXTRACT_MIN_REMAINING_MS = int(os.environ.get('TEXTRACT_MIN_REMAINING_MS', 10000)) # Work is handed off below this
+MAX_HANDOFFS = int(os.environ.get('MAX_HANDOFFS', 3)) # Jobs are marked FAILED after this many hand-offs
+
+# Fan-out / fan-in for multi-page documents. Multi-page inputs are split into one object per page
+# under WORK_PAGES_PREFIX; an S3 event notification on that prefix invokes this function once per page.
+# Configure the notification with the prefix only, so page results written under WORK_RESULTS_PREFIX
+# do not trigger further invocations.
+SPLIT_ENABLED = os.environ.get('SPLIT_ENABLED', 'true').lower() == 'true'
+SPLIT_MIN_PAGES = int(os.environ.get('SPLIT_MIN_PAGES', 2))
+SPLIT_UPLOAD_CONCURRENCY = int(os.environ.get('SPLIT_UPLOAD_CONCURRENCY', 16))
+WORK_PREFIX = os.environ.get('WORK_PREFIX', 'work/')
+WORK_PAGES_PREFIX = f"{WORK_PREFIX}pages/"
+WORK_RESULTS_PREFIX = f"{WORK_PREFIX}results/"
+MULTI_PAGE_EXTENSIONS = ('.tif', '.tiff') # Formats that can carry several pages
+PAGE_SEPARATOR = "\n\n"
+PAGE_PIXELS_METADATA = 'pixel-count' # Page object metadata: the page's pixel count, for the page's metrics
+
+def preprocess_image_opencv(image_bytes, timer=None):
     """
     Preprocesses the image using OpenCV for better OCR accuracy.
-    Converts to grayscale, applies Gaussian blur, and adaptive thresholding.
-    Returns preprocessed image bytes (PNG format).
+    Runs the PREPROCESS_PNG pipeline shared with the Flask app (see ocr_pipeline/): grey
+    decode, the configured page crop, deskew and quality probe, then blur and thresholding
+    with the BINARIZATION backend (see binarization.py). BINARIZATION_POLICY does not apply:
+    the Lambda has no OCR model choice, so it always uses the default backend.
+    Returns (preprocessed image bytes as a PNG stream, decisions), where decisions holds the page
+    corners, rotation and quality profile the pipeline chose (empty when none applied).
+    Every stage's duration is recorded on timer if one is given.
     """
+    timer = timer or StageTimer()
+
+    def record_pixel_count(stage, seconds, buffer):
+        if stage == 'decode':
+            timer.pixel_count = buffer.pixels.size
+
     try:
-        np_array = np.frombuffer(image_bytes, np.uint8)
-        image = cv2.imdecode(np_array, cv2.IMREAD_COLOR)
-
-        if image is None:
-            logger.error("Could not decode image bytes for preprocessing.")
-            raise ValueError("Could not decode image bytes.")
-
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-        
-        # Adaptive thresholding (often good for varied lighting and text clarity)
-        thresh = cv2.adaptiveThreshold(blurred, 255,
-                                       cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                                       cv2.THRESH_BINARY, 11, 2)
-        
-        # Encode the preprocessed image back to bytes (PNG format for consistency)
-        is_success, buffer = cv2.imencode(".png", thresh)
-        if not is_success:
-            logger.error("Failed to encode preprocessed image to PNG.")
-            raise Exception("Failed to encode preprocessed image.")
-        
-        return io.BytesIO(buffer)
+        encoded, decisions = ocr_pipeline.PREPROCESS_PNG.run(ocr_pipeline.EncodedImage(image_bytes), timer=timer,
+                                                             hooks=(record_pixel_count,))
+        return io.BytesIO(encoded.data), decisions
 
     except Exception as e:
         logger.error(f"Error during image preprocessing with OpenCV: {e}", exc_info=True)
         raise
 
-def lambda_handler(event, context):
-    logger.info(f"Received event: {json.dumps(event)}")
-    
-    # Expecting an S3 PutObject event
-    if 'Records' not in event:
-        logger.error("Event does not contain S3 records.")
-        return {'statusCode': 400, 'body': 'Invalid event format'}
+def update_job_item(job_id, attributes, unless_completed=False):
+    """
+    Sets the given attributes (name -> DynamoDB typed value) on the job item.
+    Every attribute name is aliased, so reserved words such as 'status' need no special handling.
+    With unless_completed, a job that is already COMPLETED is left untouched and
+    ConditionalCheckFailedException is raised.
+    """
+    names = {}
+    values = {}
+    assignments = []
+    for i, (name, value) in enumerate(attributes.items()):
+        names[f"#a{i}"] = name
+        values[f":v{i}"] = value
+        assignments.append(f"#a{i} = :v{i}")
 
-    s3_record = event['Records'][0]['s3']
-    bucket_name = s3_record['bucket']['name']
-    original_s3_key = s3_record['object']['key']
+    condition = {}
+    if unless_completed:
+        names['#s'] = 'status'
+        values[':completed'] = {'S': 'COMPLETED'}
+        condition['ConditionExpression'] = "attribute_not_exists(#s) OR #s <> :completed"
 
-    if not DYNAMODB_TABLE_NAME:
-        logger.error("DYNAMODB_TABLE_NAME environment variable not set.")
-        return {'statusCode': 500, 'body': 'DynamoDB table name not configured.'}
+    dynamodb_client.update_item(
+        TableName=DYNAMODB_TABLE_NAME,
+        Key={'job_id': {'S': job_id}},
+        UpdateExpression="SET " + ", ".join(assignments),
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values,
+        **condition
+    )
 
-    # Extract job_id from the S3 key
-    # Assuming S3 key format is "original-images/{job_id}-{original_filename}"
-    job_id_part = original_s3_key.split('/')[-1] # Gets "uuid-filename.ext"
-    job_id = job_id_part.split('-')[0] # Gets "uuid"
+def job_completed(job_id):
+    """True if the job item is already COMPLETED (False if it cannot be read)."""
+    try:
+        item = dynamodb_client.get_item(
+            TableName=DYNAMODB_TABLE_NAME,
+            Key={'job_id': {'S': job_id}},
+            ProjectionExpression='#s',
+            ExpressionAttributeNames={'#s': 'status'}
+        ).get('Item', {})
+    except Exception as e:
+        logger.warning(f"Could not read the status of job_id {job_id}: {e}")
+        return False
+    return item.get('status', {}).get('S') == 'COMPLETED'
+
+UUID_PREFIX_PATTERN = re.compile(r'^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}')
+
+def job_id_from_key(s3_key):
+    """Derives the job_id from an S3 key of the form "original-images/{job_id}-{original_filename}"."""
+    if s3_key.startswith(WORK_PAGES_PREFIX):
+        return parse_page_key(s3_key)[0]
+
+    job_id_part = s3_key.split('/')[-1] # Gets "uuid-filename.ext"
+    uuid_match = UUID_PREFIX_PATTERN.match(job_id_part)
+    # A UUID contains hyphens itself, so take the whole UUID rather than the text before the first '-'
+    job_id = uuid_match.group(0) if uuid_match else job_id_part.split('-')[0]
 
     if not job_id:
-        logger.error(f"Could not extract job_id from S3 key: {original_s3_key}. Using full key as fallback job_id.")
-        job_id = original_s3_key # Fallback, though current Flask expects UUID.
+        logger.error(f"Could not extract job_id from S3 key: {s3_key}. Using full key as fallback job_id.")
+        job_id = s3_key # Fallback, though current Flask expects UUID.
+    return job_id
+
+
+# --- Deadline Handling ---
+
+class DeadlineApproaching(Exception):
+    """Raised when there is not enough time left in the invocation to run the next required stage."""
+
+
+class Deadline:
+    """Tracks the remaining execution time of the invocation via the Lambda context."""
+
+    def __init__(self, context):
+        self.context = context
+
+    def remaining_ms(self):
+        # Local runs and tests may pass no context at all; treat them as unbounded
+        if self.context is None or not hasattr(self.context, 'get_remaining_time_in_millis'):
+            return float('inf')
+        return self.context.get_remaining_time_in_millis()
+
+    def usable_ms(self):
+        """Remaining time minus the margin reserved for checkpointing and handing off."""
+        return self.remaining_ms() - DEADLINE_SAFETY_MARGIN_MS
+
+    def has_time_for(self, required_ms):
+        return self.usable_ms() >= required_ms
+
+
+class PendingWork:
+    """
+    The records of one invocation together with their per-job checkpoints.
+    hand_off() checkpoints every unfinished job and re-enqueues the remaining records
+    as a new asynchronous invocation of this function. It runs at most once, whether it
+    is triggered by the handler loop or by the deadline watchdog.
+    When the watchdog fires, the remaining records include the one still in progress, which
+    may yet finish before the timeout. Checkpoints never overwrite a COMPLETED job, and the
+    resumed invocation skips original records whose job is already COMPLETED, so that
+    record is not processed (and billed) twice.
+    """
+
+    def __init__(self, records, checkpoints, handoff_count, context):
+        self.records = records
+        self.position = 0 # Index of the first record that has not finished yet
+        self.checkpoints = checkpoints
+        self.handoff_count = handoff_count
+        self.context = context
+        self.handed_off = False
+        self._lock = threading.Lock()
 
-    # Start X-Ray subsegment for detailed tracing of this Lambda invocation
-    # with aws_xray_sdk.core.in_segment('OCR_Processing_Lambda'): # Uncomment if using SDK patch
+    def hand_off(self, reason):
+        with self._lock:
+            if self.handed_off:
+                return
+            self.handed_off = True
+
+        remaining = self.records[self.position:]
+        if not remaining:
+            return
+        logger.warning(f"Handing off {len(remaining)} record(s): {reason}")
+
+        if self.handoff_count >= MAX_HANDOFFS or self.context is None:
+            for record in remaining:
+                mark_job_failed(job_id_from_key(record['s3']['object']['key']),
+                                f"Deadline exceeded after {self.handoff_count} hand-off(s): {reason}")
+            return
+
+        for record in remaining:
+            job_id = job_id_from_key(record['s3']['object']['key'])
+            checkpoint = self.checkpoints.get(job_id, {})
+            try:
+                update_job_item(job_id, {
+                    'status': {'S': 'RESUMING'},
+                    'checkpoint_stage': {'S': checkpoint.get('stage', 'PENDING')},
+                    'handoff_count': {'N': str(self.handoff_count + 1)},
+                    'updated_at': {'S': str(time.time())}
+                }, unless_completed=True)
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                    logger.info(f"job_id {job_id} completed while handing off; not checkpointing it.")
+                else:
+                    logger.error(f"Failed to checkpoint job_id {job_id}: {e}")
+            except Exception as e:
+                logger.error(f"Failed to checkpoint job_id {job_id}: {e}")
+
+        payload = {'Records': remaining, 'checkpoints': self.checkpoints, 'handoff_count': self.handoff_count + 1}
+        try:
+            lambda_client.invoke(
+                FunctionName=self.context.invoked_function_arn,
+                InvocationType='Event',
+                Payload=json.dumps(payload).encode('utf-8')
+            )
+            logger.info(f"Re-enqueued {len(remaining)} record(s) (hand-off {self.handoff_count + 1}).")
+        except Exception as e:
+            logger.error(f"Failed to re-enqueue remaining work: {e}", exc_info=True)
+            for record in remaining:
+                mark_job_failed(job_id_from_key(record['s3']['object']['key']), f"Hand-off failed: {e}")
+
+
+def mark_job_failed(job_id, error_message):
+    """
+    Writes FAILED status and the error message to the job item.
+    A job that already COMPLETED is left untouched, e.g. when a redelivered page event
+    arrives after the work objects have been cleaned up.
+    """
     try:
-        # 1. Download original image from S3
-        logger.info(f"Downloading s3://{bucket_name}/{original_s3_key}")
-        response = s3_client.get_object(Bucket=bucket_name, Key=original_s3_key)
-        original_image_bytes = response['Body'].read()
-        logger.info("Original image downloaded.")
-
-        # 2. Preprocess image with OpenCV
-        logger.info("Preprocessing image with OpenCV...")
-        preprocessed_image_stream = preprocess_image_opencv(original_image_bytes)
-        preprocessed_s3_key = f"{PREPROCESSED_IMAGES_PREFIX}{job_id}-preprocessed.png"
-        
-        # 3. Upload preprocessed image to S3
-        logger.info(f"Uploading preprocessed image to s3://{bucket_name}/{preprocessed_s3_key}")
-        s3_client.put_object(
-            Bucket=bucket_name, 
-            Key=preprocessed_s3_key, 
-            Body=preprocessed_image_stream.getvalue(), 
-            ContentType='image/png' # Force PNG as output for preprocessed image
+        dynamodb_client.update_item(
+            TableName=DYNAMODB_TABLE_NAME,
+            Key={'job_id': {'S': job_id}},
+            UpdateExpression="SET #s = :status, error_message = :error_msg, updated_at = :updated_at",
+            ConditionExpression="attribute_not_exists(#s) OR #s <> :completed",
+            ExpressionAttributeNames={'#s': 'status'}, # 'status' is a reserved keyword in DynamoDB, so using an alias
+            ExpressionAttributeValues={
+                ':status': {'S': 'FAILED'},
+                ':completed': {'S': 'COMPLETED'},
+                ':error_msg': {'S': error_message},
+                ':updated_at': {'S': str(time.time())}
+            }
         )
-        logger.info("Preprocessed image uploaded.")
+        logger.info(f"DynamoDB updated for job_id: {job_id} with status FAILED.")
+    except ClientError as db_e:
+        if db_e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+            logger.info(f"job_id {job_id} already COMPLETED; not marking it FAILED.")
+        else:
+            logger.error(f"Failed to update DynamoDB with FAILED status for job_id {job_id}: {db_e}")
+    except Exception as db_e:
+        logger.error(f"Failed to update DynamoDB with FAILED status for job_id {job_id}: {db_e}")
+
+
+# Error codes of transient AWS failures (throttling, timeouts, server errors). A page that hits one
+# is retried rather than failing its whole job; see is_retryable().
+RETRYABLE_ERROR_CODES = {
+    'ThrottlingException', 'ProvisionedThroughputExceededException', 'RequestLimitExceeded',
+    'LimitExceededException', 'TooManyRequestsException', 'SlowDown', 'RequestTimeout',
+    'InternalServerError', 'InternalError', 'ServiceUnavailable', 'ServiceUnavailableException',
+}
+
+
+def is_retryable(error):
+    """True for throttling, timeouts, connection errors and 5xx responses, which a later attempt can get past."""
+    if isinstance(error, ClientError):
+        code = error.response.get('Error', {}).get('Code')
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        return code in RETRYABLE_ERROR_CODES or status >= 500
+    return isinstance(error, (HTTPClientError, BotoConnectionError))
+
+
+def download_object(bucket_name, s3_key, timer):
+    """Downloads an S3 object and records the download duration and size on timer."""
+    logger.info(f"Downloading s3://{bucket_name}/{s3_key}")
+    with timer.stage('download'):
+        response = s3_client.get_object(Bucket=bucket_name, Key=s3_key)
+        image_bytes = response['Body'].read()
+    timer.image_bytes = len(image_bytes)
+    timer.pixel_count = image_pixel_count(image_bytes)
+    logger.info("Original image downloaded.")
+    return image_bytes
+
+
+def read_trace_context(bucket_name, s3_key):
+    """
+    Reads the trace context the uploader stored as object metadata.
+    Objects without one (e.g. uploaded by other producers) get a new trace keyed by the job_id in the key.
+    Returns (trace, metadata); metadata is empty if the object could not be read.
+    """
+    metadata = {}
+    try:
+        metadata = s3_client.head_object(Bucket=bucket_name, Key=s3_key).get('Metadata', {})
+        trace = TraceContext.from_s3_metadata(metadata)
+        if trace:
+            return trace, metadata
+    except Exception as e:
+        logger.warning(f"Could not read trace metadata for s3://{bucket_name}/{s3_key}: {e}")
+    return TraceContext(job_id=job_id_from_key(s3_key)), metadata
+
+
+def process_record(record, deadline, checkpoints):
+    """
+    Processes a single S3 record inside a span that continues the uploader's trace.
+    Page objects written by the splitter go to process_page_record(), everything else to
+    process_original_record().
+    """
+    bucket_name = record['s3']['bucket']['name']
+    s3_key = record['s3']['object']['key']
+    trace, metadata = read_trace_context(bucket_name, s3_key)
+    is_page = s3_key.startswith(WORK_PAGES_PREFIX)
+
+    with start_span('lambda.page' if is_page else 'lambda.record', trace, s3_key=s3_key) as span:
+        if is_page:
+            return process_page_record(record, deadline, trace.child(span.span_id), metadata)
+        return process_original_record(record, deadline, checkpoints, trace.child(span.span_id))
+
+
+def process_original_record(record, deadline, checkpoints, trace):
+    """
+    Runs the OCR flow for an uploaded object: download, (optional) preprocessing, Textract and
+    result persistence. Progress is recorded in checkpoints so a hand-off can resume after the
+    last completed stage. Raises DeadlineApproaching when a required stage no longer fits.
+    Returns True on success, False if the job failed.
+    """
+    s3_record = record['s3']
+    bucket_name = s3_record['bucket']['name']
+    original_s3_key = s3_record['object']['key']
+    job_id = trace.job_id
+    checkpoint = checkpoints.setdefault(job_id, {'stage': 'PENDING'})
+
+    timer = StageTimer('record', trace)
+    try:
+        preprocessed_s3_key = checkpoint.get('preprocessed_s3_key')
+        original_image_bytes = None
+
+        # Multi-page documents are split into per-page objects, each processed by its own invocation
+        if checkpoint['stage'] == 'PENDING' and SPLIT_ENABLED and original_s3_key.lower().endswith(MULTI_PAGE_EXTENSIONS):
+            if not deadline.has_time_for(TEXTRACT_MIN_REMAINING_MS):
+                raise DeadlineApproaching(f"{deadline.remaining_ms()} ms left before splitting job_id {job_id}")
+            original_image_bytes = download_object(bucket_name, original_s3_key, timer)
+            page_count = count_document_pages(original_image_bytes)
+            if page_count >= SPLIT_MIN_PAGES:
+                with timer.stage('split'):
+                    split = split_document(bucket_name, trace, original_image_bytes, page_count)
+                if not split:
+                    logger.info(f"job_id {job_id} is already COMPLETED; not splitting it again.")
+                    checkpoint['stage'] = 'COMPLETED'
+                    timer.set_property('outcome', 'already_completed')
+                    return True
+                timer.set_property('page_count', page_count)
+                checkpoint['stage'] = 'SPLIT'
+        if checkpoint['stage'] == 'SPLIT':
+            timer.set_property('outcome', 'split')
+            return True
+
+        # 1-3. Download, preprocess and upload the preprocessed image.
+        # The preprocessed image is not used by Textract, so this stage is skipped when time is short
+        # or when a previous invocation already completed it.
+        if checkpoint['stage'] == 'PENDING':
+            if deadline.has_time_for(OPTIONAL_STAGE_MIN_REMAINING_MS):
+                if original_image_bytes is None:
+                    original_image_bytes = download_object(bucket_name, original_s3_key, timer)
+
+                logger.info("Preprocessing image with OpenCV...")
+                preprocessed_image_stream, preprocessing = preprocess_image_opencv(original_image_bytes, timer)
+                if 'profile' in preprocessing:
+                    # A property rather than a dimension: it explains a record without multiplying the metric series
+                    timer.set_property('profile', preprocessing['profile'])
+                preprocessed_s3_key = f"{PREPROCESSED_IMAGES_PREFIX}{job_id}-preprocessed.png"
+
+                logger.info(f"Uploading preprocessed image to s3://{bucket_name}/{preprocessed_s3_key}")
+                with timer.stage('upload'):
+                    s3_client.put_object(
+                        Bucket=bucket_name,
+                        Key=preprocessed_s3_key,
+                        Body=preprocessed_image_stream.getvalue(),
+                        ContentType='image/png' # Force PNG as output for preprocessed image
+                    )
+                logger.info("Preprocessed image uploaded.")
+                # The decisions travel with the checkpoint, so a hand-off still stores them with the result
+                checkpoint.update({'stage': 'PREPROCESSED', 'preprocessed_s3_key': preprocessed_s3_key,
+                                   'preprocessing': preprocessing})
+            else:
+                logger.warning(f"Skipping preprocessing for job_id {job_id}: {deadline.remaining_ms()} ms remaining.")
+                checkpoint['stage'] = 'PREPROCESSING_SKIPPED'
 
         # 4. Perform OCR with Amazon Textract on the original S3 object (Textract prefers raw)
+        if not deadline.has_time_for(TEXTRACT_MIN_REMAINING_MS):
+            raise DeadlineApproaching(f"{deadline.remaining_ms()} ms left before Textract for job_id {job_id}")
+
         logger.info(f"Performing OCR with Amazon Textract on s3://{bucket_name}/{original_s3_key}")
-        textract_response = textract_client.detect_document_text(
-            Document={
-                'S3Object': {
-                    'Bucket': bucket_name,
-                    'Name': original_s3_key
+        with timer.stage('textract'):
+            textract_response = textract_client.detect_document_text(
+                Document={
+                    'S3Object': {
+                        'Bucket': bucket_name,
+                        'Name': original_s3_key
+                    }
                 }
-            }
-        )
-        extracted_text = ""
-        for item in textract_response.get('Blocks', []):
-            if item['BlockType'] == 'LINE':
-                extracted_text += item['Text'] + "\n"
-        extracted_text = extracted_text.strip()
+            )
+        timer.block_count = len(textract_response.get('Blocks', []))
+        result, _ = ocr_pipeline.TEXTRACT_TEXT.run(ocr_pipeline.TextractBlocks(textract_response.get('Blocks', [])), timer=timer)
+        extracted_text = result.text
         logger.info("Textract OCR completed.")
 
         # 5. Update DynamoDB with results
+        # Small results are stored compressed on the item, large ones are offloaded to S3
         logger.info(f"Updating DynamoDB for job_id: {job_id}")
+        # The S3 offload of a large result is timed as its own 'offload' stage
+        attributes = build_result_attributes(s3_client, bucket_name, job_id, extracted_text, words=result.words, timer=timer)
+        attributes.update({
+            'status': {'S': 'COMPLETED'},
+            'trace_id': {'S': trace.trace_id},
+            'updated_at': {'S': str(time.time())}
+        })
+        if preprocessed_s3_key:
+            attributes['preprocessed_s3_key'] = {'S': preprocessed_s3_key}
+        if checkpoint.get('preprocessing'):
+            attributes['preprocessing'] = {'S': json.dumps(checkpoint['preprocessing'])}
+        with timer.stage('dynamodb'):
+            update_job_item(job_id, attributes)
+        checkpoint['stage'] = 'COMPLETED'
+        logger.info(f"DynamoDB updated for job_id: {job_id} with status COMPLETED.")
+        timer.set_property('outcome', 'completed')
+        return True
+
+    except DeadlineApproaching:
+        timer.set_property('outcome', 'handed_off')
+        raise
+    except Exception as e:
+        logger.error(f"Error during Lambda execution for S3 key {original_s3_key}: {e}", exc_info=True)
+        mark_job_failed(job_id, str(e))
+        timer.set_property('outcome', 'failed')
+        return False
+    finally:
+        timer.emit()
+
+
+# --- Fan-out / Fan-in ---
+
+def page_s3_key(job_id, page_index):
+    return f"{WORK_PAGES_PREFIX}{job_id}/{page_index:05d}.png"
+
+def page_result_s3_key(job_id, page_index):
+    return f"{WORK_RESULTS_PREFIX}{job_id}/{page_index:05d}.json"
+
+def parse_page_key(s3_key):
+    """Returns (job_id, page_index) for a key of the form "{WORK_PAGES_PREFIX}{job_id}/{page_index}.png"."""
+    job_id, page_name = s3_key[len(WORK_PAGES_PREFIX):].split('/', 1)
+    return job_id, int(page_name.split('.')[0])
+
+def image_pixel_count(image_bytes):
+    """width * height of the (first page of the) image, read from its header (None if unreadable)."""
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            return image.width * image.height
+    except Exception:
+        return None
+
+def count_document_pages(image_bytes):
+    """Returns the number of pages (frames) in a document without decoding them."""
+    with Image.open(io.BytesIO(image_bytes)) as document:
+        return getattr(document, 'n_frames', 1)
+
+def iter_document_pages(image_bytes):
+    """
+    Yields (PNG bytes, pixel count) for every page of a multi-page document, decoding one page
+    at a time.
+    """
+    with Image.open(io.BytesIO(image_bytes)) as document:
+        for page_index in range(getattr(document, 'n_frames', 1)):
+            document.seek(page_index)
+            buffer = io.BytesIO()
+            document.save(buffer, format='PNG')
+            yield buffer.getvalue(), document.width * document.height
+
+def split_document(bucket_name, trace, image_bytes, page_count):
+    """
+    Fan-out: records the page count on the job item and writes one PNG object per page under
+    WORK_PAGES_PREFIX. Splitting again (e.g. after a hand-off) rewrites the same keys and keeps
+    the completion counter, so duplicate page events are harmless. Page objects carry the
+    trace context so page invocations continue the same trace.
+    Returns False, without writing anything, if the job is already COMPLETED: its work objects
+    are gone, and resetting it to PROCESSING would leave it to fail on the next aggregation.
+    """
+    job_id = trace.job_id
+    logger.info(f"Splitting job_id {job_id} into {page_count} pages")
+    try:
         dynamodb_client.update_item(
             TableName=DYNAMODB_TABLE_NAME,
             Key={'job_id': {'S': job_id}},
-            UpdateExpression="SET #s = :status, extracted_text = :text, preprocessed_s3_key = :preprocessed_key, updated_at = :updated_at",
-            ExpressionAttributeNames={'#s': 'status'}, # 'status' is a reserved keyword in DynamoDB, so using an alias
+            UpdateExpression="SET #s = :status, page_count = :page_count, pages_completed = if_not_exists(pages_completed, :zero), trace_id = :trace_id, updated_at = :updated_at",
+            ConditionExpression="attribute_not_exists(#s) OR #s <> :completed",
+            ExpressionAttributeNames={'#s': 'status'},
             ExpressionAttributeValues={
-                ':status': {'S': 'COMPLETED'},
-                ':text': {'S': extracted_text},
-                ':preprocessed_key': {'S': preprocessed_s3_key},
+                ':status': {'S': 'PROCESSING'},
+                ':completed': {'S': 'COMPLETED'},
+                ':page_count': {'N': str(page_count)},
+                ':zero': {'N': '0'},
+                ':trace_id': {'S': trace.trace_id},
                 ':updated_at': {'S': str(time.time())}
             }
         )
-        logger.info(f"DynamoDB updated for job_id: {job_id} with status COMPLETED.")
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+            return False
+        raise
+    page_metadata = trace.to_s3_metadata()
 
-        return {'statusCode': 200, 'body': 'OCR processed and results saved.'}
+    # Pages are decoded sequentially, uploads run concurrently
+    with ThreadPoolExecutor(max_workers=SPLIT_UPLOAD_CONCURRENCY) as pool:
+        futures = [
+            pool.submit(s3_client.put_object, Bucket=bucket_name, Key=page_s3_key(job_id, page_index),
+                        Body=page_png, ContentType='image/png',
+                        Metadata=dict(page_metadata, **{PAGE_PIXELS_METADATA: str(pixel_count)}))
+            for page_index, (page_png, pixel_count) in enumerate(iter_document_pages(image_bytes))
+        ]
+        for future in futures:
+            future.result()
+    logger.info(f"Wrote {len(futures)} page objects for job_id {job_id}")
+    return True
+
+def process_page_record(record, deadline, trace, metadata=None):
+    """
+    Runs Textract on a single page written by split_document(), stores the page result and
+    increments the job's completion counter. The invocation that completes the last page
+    assembles the final result; a redelivered page event of a job whose pages are all counted
+    but which is not COMPLETED (its fan-in failed) assembles it again.
+    metadata is the page object's metadata, which carries its pixel count for the metrics.
+    Returns True on success, False if the job failed. Transient errors (see is_retryable()) are
+    raised instead, so that Lambda's retry of the event runs the page again; failing the job
+    would leave its page counter short for good.
+    """
+    bucket_name = record['s3']['bucket']['name']
+    page_key = record['s3']['object']['key']
+    job_id, page_index = parse_page_key(page_key)
+
+    if not deadline.has_time_for(TEXTRACT_MIN_REMAINING_MS):
+        raise DeadlineApproaching(f"{deadline.remaining_ms()} ms left before Textract for page {page_index} of job_id {job_id}")
+
+    timer = StageTimer('page', trace)
+    timer.set_property('job_id', job_id)
+    timer.set_property('page', page_index + 1)
+    # Textract reads the page from S3, so its size comes from the event and the page's metadata
+    timer.image_bytes = record['s3']['object'].get('size')
+    if (metadata or {}).get(PAGE_PIXELS_METADATA, '').isdigit():
+        timer.pixel_count = int(metadata[PAGE_PIXELS_METADATA])
+    try:
+        with timer.stage('textract'):
+            textract_response = textract_client.detect_document_text(
+                Document={'S3Object': {'Bucket': bucket_name, 'Name': page_key}}
+            )
+        blocks = textract_response.get('Blocks', [])
+        timer.block_count = len(blocks)
+        result, _ = ocr_pipeline.TEXTRACT_TEXT.run(ocr_pipeline.TextractBlocks(blocks), timer=timer)
+        page_text, words = result.text, result.words
+        for word in words:
+            word['page'] = page_index + 1
+
+        with timer.stage('upload'):
+            s3_client.put_object(
+                Bucket=bucket_name,
+                Key=page_result_s3_key(job_id, page_index),
+                Body=json.dumps({'page': page_index + 1, 'text': page_text, 'words': words}).encode('utf-8'),
+                ContentType='application/json'
+            )
+
+        # The counter only moves once per page, so redelivered S3 events cannot complete a job early
+        try:
+            with timer.stage('dynamodb'):
+                response = dynamodb_client.update_item(
+                    TableName=DYNAMODB_TABLE_NAME,
+                    Key={'job_id': {'S': job_id}},
+                    UpdateExpression="SET updated_at = :updated_at ADD pages_completed :one, pages_done :page_set",
+                    ConditionExpression="NOT contains(pages_done, :page)",
+                    ExpressionAttributeValues={
+                        ':one': {'N': '1'},
+                        ':page': {'N': str(page_index)},
+                        ':page_set': {'NS': [str(page_index)]},
+                        ':updated_at': {'S': str(time.time())}
+                    },
+                    ReturnValues='ALL_NEW'
+                )
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                # A redelivered last page may be the retry of a fan-in that failed: every page is
+                # counted and stored, so the job can still be completed by aggregating again
+                item = dynamodb_client.get_item(
+                    TableName=DYNAMODB_TABLE_NAME, Key={'job_id': {'S': job_id}}, ConsistentRead=True).get('Item', {})
+                page_count = int(item.get('page_count', {}).get('N', 0))
+                if (page_count and int(item.get('pages_completed', {}).get('N', 0)) == page_count
+                        and item.get('status', {}).get('S') != 'COMPLETED'):
+                    logger.info(f"All {page_count} pages of job_id {job_id} are counted but the job is not COMPLETED; aggregating again.")
+                    with timer.stage('aggregate'):
+                        aggregate_pages(bucket_name, job_id, page_count)
+                    timer.set_property('outcome', 'aggregated_on_retry')
+                    return True
+                logger.info(f"Page {page_index} of job_id {job_id} was already counted; ignoring duplicate event.")
+                timer.set_property('outcome', 'duplicate')
+                return True
+            raise
+
+        item = response['Attributes']
+        pages_completed = int(item['pages_completed']['N'])
+        page_count = int(item['page_count']['N'])
+        logger.info(f"Page {page_index} of job_id {job_id} done ({pages_completed}/{page_count}).")
+        if pages_completed == page_count:
+            with timer.stage('aggregate'):
+                aggregate_pages(bucket_name, job_id, page_count)
+        timer.set_property('outcome', 'completed')
+        return True
 
     except Exception as e:
-        logger.error(f"Error during Lambda execution for S3 key {original_s3_key}: {e}", exc_info=True)
-        # Update DynamoDB with FAILED status
+        if is_retryable(e):
+            logger.warning(f"Transient error on page {page_index} of job_id {job_id}; leaving it to be retried: {e}")
+            timer.set_property('outcome', 'retrying')
+            raise
+        logger.error(f"Error processing page {page_index} of job_id {job_id}: {e}", exc_info=True)
+        mark_job_failed(job_id, f"Page {page_index + 1}: {e}")
+        timer.set_property('outcome', 'failed')
+        return False
+    finally:
+        timer.emit()
+
+def aggregate_pages(bucket_name, job_id, page_count):
+    """Fan-in: assembles the per-page results in page order, persists the final result and cleans up."""
+    def load_page(page_index):
+        response = s3_client.get_object(Bucket=bucket_name, Key=page_result_s3_key(job_id, page_index))
+        return json.loads(response['Body'].read())
+
+    with ThreadPoolExecutor(max_workers=SPLIT_UPLOAD_CONCURRENCY) as pool:
+        pages = list(pool.map(load_page, range(page_count))) # map() preserves page order
+
+    extracted_text = PAGE_SEPARATOR.join(page['text'] for page in pages).strip()
+    words = [word for page in pages for word in page['words']]
+    attributes = build_result_attributes(s3_client, bucket_name, job_id, extracted_text, words=words)
+    attributes.update({
+        'status': {'S': 'COMPLETED'},
+        'updated_at': {'S': str(time.time())}
+    })
+    update_job_item(job_id, attributes)
+    logger.info(f"DynamoDB updated for job_id: {job_id} with status COMPLETED ({page_count} pages).")
+
+    # Work objects are no longer needed once the result is persisted
+    keys = [page_s3_key(job_id, i) for i in range(page_count)] + [page_result_s3_key(job_id, i) for i in range(page_count)]
+    for start in range(0, len(keys), 1000): # delete_objects accepts at most 1000 keys per call
         try:
-            dynamodb_client.update_item(
-                TableName=DYNAMODB_TABLE_NAME,
-                Key={'job_id': {'S': job_id}},
-                UpdateExpression="SET #s = :status, error_message = :error_msg, updated_at = :updated_at",
-                ExpressionAttributeNames={'#s': 'status'},
-                ExpressionAttributeValues={
-                    ':status': {'S': 'FAILED'},
-                    ':error_msg': {'S': str(e)},
-                    ':updated_at': {'S': str(time.time())}
-                }
+            s3_client.delete_objects(
+                Bucket=bucket_name,
+                Delete={'Objects': [{'Key': key} for key in keys[start:start + 1000]], 'Quiet': True}
             )
-            logger.info(f"DynamoDB updated for job_id: {job_id} with status FAILED.")
-        except Exception as db_e:
-            logger.error(f"Failed to update DynamoDB with FAILED status for job_id {job_id}: {db_e}")
-        
-        return {'statusCode': 500, 'body': f'Error processing image: {e}'}
+        except Exception as e:
+            logger.error(f"Failed to clean up work objects for job_id {job_id}: {e}")
+
+
+def lambda_handler(event, context):
+    """
+    Processes the S3 records of an event (or of a hand-off). A page record that hits a transient
+    error raises out of the handler, so the asynchronous invocation is retried. S3 sends one
+    record per event, and a page already counted is ignored as a duplicate on the retry.
+    """
+    # Full events are large and mostly repetitive, so only a sample of them is logged
+    if random.random() < EVENT_LOG_SAMPLE_RATE:
+        logger.info(f"Received event: {json.dumps(event)}")
+    else:
+        logger.info(f"Received event with {len(event.get('Records', []))} record(s).")
+    
+    # Expecting an S3 PutObject event, or a hand-off event re-enqueued by a previous invocation
+    if 'Records' not in event:
+        logger.error("Event does not contain S3 records.")
+        return {'statusCode': 400, 'body': 'Invalid event format'}
+
+    if not DYNAMODB_TABLE_NAME:
+        logger.error("DYNAMODB_TABLE_NAME environment variable not set.")
+        return {'statusCode': 500, 'body': 'DynamoDB table name not configured.'}
+
+    deadline = Deadline(context)
+    work = PendingWork(event['Records'], event.get('checkpoints', {}), event.get('handoff_count', 0), context)
+
+    # The watchdog fires just before the function timeout so that a stage which overruns
+    # (e.g. a slow Textract call) still leaves a checkpoint and a re-enqueued invocation behind.
+    watchdog = None
+    if deadline.usable_ms() != float('inf'):
+        watchdog = threading.Timer(max(deadline.usable_ms(), 0) / 1000.0, work.hand_off, args=('function timeout approaching',))
+        watchdog.daemon = True
+        watchdog.start()
+
+    failed = 0
+    try:
+        for index, record in enumerate(work.records):
+            if work.handed_off:
+                break
+            s3_key = record['s3']['object']['key']
+            if work.handoff_count and not s3_key.startswith(WORK_PAGES_PREFIX) and job_completed(job_id_from_key(s3_key)):
+                # Finished by the previous invocation after its watchdog had already handed it off
+                logger.info(f"Skipping {s3_key}: its job is already COMPLETED.")
+                work.position = index + 1
+                continue
+            try:
+                if not process_record(record, deadline, work.checkpoints):
+                    failed += 1
+            except DeadlineApproaching as e:
+                work.hand_off(str(e))
+                break
+            work.position = index + 1
+    finally:
+        if watchdog:
+            watchdog.cancel()
+
+    if work.handed_off and work.position < len(work.records):
+        return {'statusCode': 202, 'body': f'Processed {work.position} record(s); remaining work handed off.'}
+    if failed:
+        return {'statusCode': 500, 'body': f'Error processing {failed} of {len(work.records)} image(s).'}
+    return {'statusCode': 200, 'body': 'OCR processed and results saved.'}
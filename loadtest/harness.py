@@ -0,0 +1,211 @@
+"""
+Offline load test for the Flask /upload route and lambda_handler().
+
+Both run in-process against the stand-ins from loadtest.local_aws, so no AWS account is
+needed. Latency, throttling and errors can be injected per service. Requests arrive
+open-loop according to an arrival-rate profile, and latency is measured from the scheduled
+arrival time, so queueing behind saturated workers counts. Without a profile the harness
+runs closed-loop: it sends --requests requests as fast as --concurrency workers allow.
+Every upload sends the same document, so request coalescing (single_flight.py) is switched
+off unless --coalesce is given; otherwise overlapping requests would share one OCR run.
+
+    python -m loadtest.harness --target upload --engine textract --concurrency 8 \\
+        --profile 5x20,20x20 --textract latency_ms=800,jitter_ms=600,throttle_rate=0.02
+    python -m loadtest.harness --target lambda --concurrency 16 --requests 500 \\
+        --dynamodb latency_ms=8,throttle_rate=0.01 --output report.json
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import contextlib
+import statistics
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+# lambda_function creates boto3 clients at import time, which need a region
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import app
+import lambda_function
+import single_flight
+from tracing import TraceContext
+from benchmarks.synthetic_docs import render_document, encode_image
+from loadtest.local_aws import LocalAWS, FaultProfile
+
+
+def parse_profile(spec):
+    """Parses "RATExSECONDS,RATExSECONDS,..." into [(requests_per_second, duration_seconds), ...]."""
+    segments = []
+    for part in spec.split(','):
+        rate, duration = part.lower().split('x')
+        segments.append((float(rate), float(duration)))
+    return segments
+
+
+def arrival_offsets(segments):
+    """Returns the scheduled arrival time (seconds from start) of every request in the profile."""
+    offsets, segment_start = [], 0.0
+    for rate, duration in segments:
+        if rate > 0:
+            interval = 1.0 / rate
+            t = 0.0
+            while t < duration:
+                offsets.append(segment_start + t)
+                t += interval
+        segment_start += duration
+    return offsets
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class LoadTest:
+    def __init__(self, args, local_aws, document_bytes):
+        self.args = args
+        self.aws = local_aws
+        self.document_bytes = document_bytes
+        self.latencies = []
+        self.errors = Counter()
+        self.stage_samples = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _upload(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = app.app.test_client()
+        response = client.post('/upload', data={
+            'image': (io.BytesIO(self.document_bytes), 'loadtest.png'),
+            'ocr_model': self.args.engine,
+        })
+        for entry in response.headers.get('Server-Timing', '').split(','):
+            if ';dur=' in entry:
+                name, duration = entry.strip().split(';dur=')
+                with self._lock:
+                    self.stage_samples.setdefault(name, []).append(float(duration))
+        if response.status_code != 200:
+            message = (response.get_json(silent=True) or {}).get('error', '')
+            return f"HTTP {response.status_code}: {message[:80]}"
+        return None
+
+    def _lambda(self):
+        trace = TraceContext()
+        key = f"uploads/{trace.job_id}-loadtest.png"
+        self.aws.s3.put_object(Bucket=self.args.bucket, Key=key, Body=self.document_bytes,
+                               ContentType='image/png', Metadata=trace.to_s3_metadata())
+        event = {'Records': [{'s3': {'bucket': {'name': self.args.bucket}, 'object': {'key': key}}}]}
+        result = lambda_function.lambda_handler(event, None)
+        if result.get('statusCode') != 200:
+            item = self.aws.dynamodb.get_item(TableName=self.args.table, Key={'job_id': {'S': trace.job_id}}).get('Item', {})
+            message = item.get('error_message', {}).get('S', result.get('body', ''))
+            return f"status {result.get('statusCode')}: {message[:80]}"
+        return None
+
+    def run_one(self, scheduled_at=None):
+        # Open-loop requests are timed from their scheduled arrival, closed-loop ones from when they start
+        scheduled_at = scheduled_at or time.perf_counter()
+        try:
+            error = self._upload() if self.args.target == 'upload' else self._lambda()
+        except Exception as e:
+            error = f"{type(e).__name__}: {str(e)[:80]}"
+        latency = time.perf_counter() - scheduled_at
+        with self._lock:
+            self.latencies.append(latency)
+            if error:
+                self.errors[error] += 1
+
+    def run(self):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+            if self.args.profile:
+                for offset in arrival_offsets(parse_profile(self.args.profile)):
+                    delay = started + offset - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    pool.submit(self.run_one, started + offset)
+            else:
+                for _ in range(self.args.requests):
+                    pool.submit(self.run_one)
+        return time.perf_counter() - started
+
+    def report(self, elapsed):
+        latencies = sorted(self.latencies)
+        failed = sum(self.errors.values())
+        report = {
+            'target': self.args.target,
+            'engine': self.args.engine if self.args.target == 'upload' else 'textract',
+            'concurrency': self.args.concurrency,
+            'requests': len(latencies),
+            'errors': failed,
+            'error_rate': round(failed / len(latencies), 4) if latencies else 0.0,
+            'elapsed_s': round(elapsed, 3),
+            'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else None,
+            'latency_ms': {
+                name: round(percentile(latencies, pct) * 1000, 2) if latencies else None
+                for name, pct in (('p50', 50), ('p95', 95), ('p99', 99), ('max', 100))
+            },
+            'error_breakdown': dict(self.errors.most_common()),
+        }
+        if self.stage_samples:
+            report['stage_median_ms'] = {name: round(statistics.median(values), 2)
+                                         for name, values in self.stage_samples.items()}
+        return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', choices=['upload', 'lambda'], default='upload')
+    parser.add_argument('--engine', choices=['tesseract', 'textract'], default='textract', help="OCR model for --target upload")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help="Closed-loop request count (ignored with --profile)")
+    parser.add_argument('--profile', help="Open-loop arrival profile, e.g. 5x30,20x30 (requests/s x seconds)")
+    parser.add_argument('--resolution', default='1240x1754', help="Synthetic document size WIDTHxHEIGHT")
+    parser.add_argument('--encoding', default='png', choices=['png', 'jpg', 'tiff'])
+    parser.add_argument('--s3', default='', help="S3 fault profile, e.g. latency_ms=20,jitter_ms=10")
+    parser.add_argument('--textract', default='latency_ms=400,jitter_ms=200,per_mb_ms=50', help="Textract fault profile")
+    parser.add_argument('--dynamodb', default='latency_ms=5', help="DynamoDB fault profile")
+    parser.add_argument('--bucket', default='loadtest-bucket')
+    parser.add_argument('--table', default='loadtest-jobs')
+    parser.add_argument('--coalesce', action='store_true', help="Let identical overlapping uploads share one OCR run")
+    parser.add_argument('--output', help="Write the report as JSON to this file")
+    parser.add_argument('--verbose', action='store_true', help="Show the application's own output")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    local_aws = LocalAWS(
+        s3_faults=FaultProfile.parse(args.s3),
+        textract_faults=FaultProfile.parse(args.textract),
+        dynamodb_faults=FaultProfile.parse(args.dynamodb, throttle_code='ProvisionedThroughputExceededException'),
+    )
+    local_aws.install(app, lambda_function, args.bucket, args.table)
+    single_flight.COALESCE_ENABLED = args.coalesce
+
+    width, height = (int(v) for v in args.resolution.split('x'))
+    image, _ = render_document(width, height, font_px=24)
+    load_test = LoadTest(args, local_aws, encode_image(image, args.encoding))
+
+    # The app and the Lambda log every step; keep the report readable unless asked otherwise
+    sink = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with sink:
+        elapsed = load_test.run()
+
+    report = load_test.report(elapsed)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
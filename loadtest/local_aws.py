@@ -0,0 +1,335 @@
+"""
+In-process stand-ins for the S3, Textract, DynamoDB and Lambda clients used by app.py and
+lambda_function.py. They implement only the calls (and expression forms) this project makes,
+keep all state in memory, and can inject latency, throttling and errors per service.
+"""
+import io
+import re
+import time
+import random
+import threading
+from decimal import Decimal
+
+import cv2
+import numpy as np
+from botocore.exceptions import ClientError
+
+
+def client_error(code, message, operation):
+    return ClientError({'Error': {'Code': code, 'Message': message}, 'ResponseMetadata': {'HTTPStatusCode': 400}}, operation)
+
+
+class FaultProfile:
+    """
+    Latency and failure behaviour of one stand-in service.
+    latency_ms (+ uniform jitter_ms) is added to every call; per_mb_ms scales with the payload size.
+    throttle_rate and error_rate are probabilities (0..1) of raising a throttling or internal error.
+    """
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, per_mb_ms=0.0, throttle_rate=0.0, error_rate=0.0,
+                 throttle_code='ThrottlingException', seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.per_mb_ms = per_mb_ms
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.throttle_code = throttle_code
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def parse(cls, spec, **defaults):
+        """Builds a profile from "latency_ms=40,jitter_ms=10,throttle_rate=0.01" style strings."""
+        options = dict(defaults)
+        for part in filter(None, (spec or '').split(',')):
+            key, value = part.split('=', 1)
+            options[key.strip()] = value.strip() if key.strip() == 'throttle_code' else float(value)
+        return cls(**options)
+
+    def apply(self, operation, payload_bytes=0):
+        with self._lock:
+            roll = self._random.random()
+            jitter = self._random.uniform(0, self.jitter_ms) if self.jitter_ms else 0.0
+        delay_ms = self.latency_ms + jitter + self.per_mb_ms * payload_bytes / 1_000_000
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000.0)
+        if roll < self.throttle_rate:
+            raise client_error(self.throttle_code, 'Rate exceeded (injected)', operation)
+        if roll < self.throttle_rate + self.error_rate:
+            raise client_error('InternalServerError', 'Internal error (injected)', operation)
+
+
+class LocalS3:
+    def __init__(self, faults=None):
+        self.faults = faults or FaultProfile()
+        self.objects = {} # (bucket, key) -> {'Body': bytes, 'ContentType': str, 'Metadata': dict}
+        self._lock = threading.Lock()
+
+    def create_bucket(self, Bucket, **kwargs):
+        return {}
+
+    def put_object(self, Bucket, Key, Body, ContentType='binary/octet-stream', Metadata=None, **kwargs):
+        body = Body if isinstance(Body, bytes) else bytes(Body)
+        self.faults.apply('PutObject', len(body))
+        with self._lock:
+            self.objects[(Bucket, Key)] = {'Body': body, 'ContentType': ContentType, 'Metadata': dict(Metadata or {})}
+        return {'ETag': f'"{hash(body) & 0xffffffff:08x}"'}
+
+    def _get(self, Bucket, Key, operation):
+        with self._lock:
+            stored = self.objects.get((Bucket, Key))
+        if stored is None:
+            raise client_error('NoSuchKey', 'The specified key does not exist.', operation)
+        return stored
+
+    def get_object(self, Bucket, Key, **kwargs):
+        stored = self._get(Bucket, Key, 'GetObject')
+        self.faults.apply('GetObject', len(stored['Body']))
+        return {'Body': io.BytesIO(stored['Body']), 'ContentLength': len(stored['Body']),
+                'ContentType': stored['ContentType'], 'Metadata': dict(stored['Metadata'])}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self.faults.apply('HeadObject')
+        stored = self._get(Bucket, Key, 'HeadObject')
+        return {'ContentLength': len(stored['Body']), 'ContentType': stored['ContentType'], 'Metadata': dict(stored['Metadata'])}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self.faults.apply('DeleteObject')
+        with self._lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        self.faults.apply('DeleteObjects')
+        with self._lock:
+            for entry in Delete.get('Objects', []):
+                self.objects.pop((Bucket, entry['Key']), None)
+        return {}
+
+
+class LocalTextract:
+    """
+    Answers detect_document_text with synthetic LINE and WORD blocks: one line per
+    lines_per_megapixel of the decoded image, so block counts scale with the page size.
+    """
+
+    def __init__(self, s3, faults=None, lines_per_megapixel=20):
+        self.s3 = s3
+        self.faults = faults or FaultProfile()
+        self.lines_per_megapixel = lines_per_megapixel
+
+    def detect_document_text(self, Document):
+        if 'Bytes' in Document:
+            image_bytes = Document['Bytes']
+        else:
+            location = Document['S3Object']
+            try:
+                image_bytes = self.s3._get(location['Bucket'], location['Name'], 'DetectDocumentText')['Body']
+            except ClientError:
+                raise client_error('InvalidS3ObjectException', 'Unable to get object metadata from S3.', 'DetectDocumentText')
+        self.faults.apply('DetectDocumentText', len(image_bytes))
+
+        header = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+        if header is None:
+            raise client_error('UnsupportedDocumentException', 'Request has unsupported document format', 'DetectDocumentText')
+        megapixels = header.shape[0] * header.shape[1] * 64 / 1_000_000
+        line_count = max(1, int(megapixels * self.lines_per_megapixel))
+
+        blocks = [{'BlockType': 'PAGE', 'Id': 'page-1'}]
+        for i in range(line_count):
+            top = (i + 0.5) / (line_count + 1)
+            blocks.append({'BlockType': 'LINE', 'Id': f'line-{i}', 'Text': f'synthetic line {i}', 'Confidence': 99.0,
+                           'Geometry': {'BoundingBox': {'Left': 0.05, 'Top': top, 'Width': 0.5, 'Height': 0.02}}})
+            for j, word in enumerate(('synthetic', 'line', str(i))):
+                blocks.append({'BlockType': 'WORD', 'Id': f'word-{i}-{j}', 'Text': word, 'Confidence': 99.0,
+                               'Geometry': {'BoundingBox': {'Left': 0.05 + j * 0.17, 'Top': top, 'Width': 0.15, 'Height': 0.02}}})
+        return {'Blocks': blocks, 'DocumentMetadata': {'Pages': 1}}
+
+
+class LocalDynamoDB:
+    """
+    Low-level DynamoDB client stand-in supporting get_item, put_item and update_item with
+    the expression forms used in this project: SET (including if_not_exists), ADD for numbers and
+    number/string sets, and conditions built from attribute_not_exists, contains, =, <> joined by AND/OR/NOT.
+    """
+
+    def __init__(self, faults=None, key_names=('job_id',)):
+        self.faults = faults or FaultProfile(throttle_code='ProvisionedThroughputExceededException')
+        self.key_names = key_names
+        self.tables = {} # table name -> {key: item}
+        self._lock = threading.Lock()
+
+    def _table(self, name):
+        return self.tables.setdefault(name, {})
+
+    @staticmethod
+    def _key(key):
+        return tuple(sorted((name, tuple(value.items())) for name, value in key.items()))
+
+    def get_item(self, TableName, Key, **kwargs):
+        self.faults.apply('GetItem')
+        with self._lock:
+            item = self._table(TableName).get(self._key(Key))
+            return {'Item': _copy_item(item)} if item else {}
+
+    def put_item(self, TableName, Item, **kwargs):
+        self.faults.apply('PutItem')
+        with self._lock:
+            self._table(TableName)[self._key({k: Item[k] for k in self.key_names})] = _copy_item(Item)
+        return {}
+
+    def update_item(self, TableName, Key, UpdateExpression, ExpressionAttributeValues=None,
+                    ExpressionAttributeNames=None, ConditionExpression=None, ReturnValues='NONE', **kwargs):
+        self.faults.apply('UpdateItem')
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        with self._lock:
+            table = self._table(TableName)
+            key = self._key(Key)
+            item = _copy_item(table.get(key)) or _copy_item(Key)
+
+            if ConditionExpression and not _evaluate_condition(ConditionExpression, item, names, values):
+                raise client_error('ConditionalCheckFailedException', 'The conditional request failed', 'UpdateItem')
+
+            updated = set()
+            for action, body in _split_clauses(UpdateExpression):
+                for part in _split_top_level(body):
+                    if action == 'SET':
+                        path, expression = (p.strip() for p in part.split('=', 1))
+                        name = names.get(path, path)
+                        item[name] = _evaluate_value(expression, item, names, values)
+                        updated.add(name)
+                    elif action == 'ADD':
+                        path, placeholder = part.split()
+                        name = names.get(path, path)
+                        item[name] = _add(item.get(name), values[placeholder])
+                        updated.add(name)
+                    elif action == 'REMOVE':
+                        name = names.get(part.strip(), part.strip())
+                        item.pop(name, None)
+
+            table[key] = item
+            if ReturnValues == 'ALL_NEW':
+                return {'Attributes': _copy_item(item)}
+            if ReturnValues == 'UPDATED_NEW':
+                return {'Attributes': {name: item[name] for name in updated if name in item}}
+            return {}
+
+
+def _copy_item(item):
+    if item is None:
+        return None
+    return {name: {t: (list(v) if isinstance(v, list) else v) for t, v in value.items()} for name, value in item.items()}
+
+
+def _split_clauses(expression):
+    parts = re.split(r'\b(SET|ADD|REMOVE|DELETE)\b', expression)
+    return [(parts[i], parts[i + 1]) for i in range(1, len(parts) - 1, 2)]
+
+
+def _split_top_level(body):
+    parts, depth, current = [], 0, ''
+    for char in body:
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        if char == ',' and depth == 0:
+            parts.append(current.strip())
+            current = ''
+        else:
+            current += char
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+def _evaluate_value(expression, item, names, values):
+    match = re.fullmatch(r'if_not_exists\(\s*([^,]+?)\s*,\s*(:\w+)\s*\)', expression)
+    if match:
+        name = names.get(match.group(1), match.group(1))
+        return item[name] if name in item else values[match.group(2)]
+    return values[expression]
+
+
+def _add(current, delta):
+    if 'N' in delta:
+        base = Decimal(current['N']) if current else Decimal(0)
+        return {'N': str(base + Decimal(delta['N']))}
+    for set_type in ('NS', 'SS'):
+        if set_type in delta:
+            existing = current.get(set_type, []) if current else []
+            return {set_type: sorted(set(existing) | set(delta[set_type]))}
+    raise ValueError(f"Unsupported ADD operand: {delta}")
+
+
+def _evaluate_condition(expression, item, names, values):
+    def resolve(path):
+        return item.get(names.get(path, path))
+
+    def same(a, b):
+        if a is None or b is None:
+            return False
+        return a == b
+
+    def term(text):
+        text = text.strip()
+        if text.startswith('NOT '):
+            return not term(text[4:])
+        match = re.fullmatch(r'attribute_not_exists\(\s*(\S+?)\s*\)', text)
+        if match:
+            return resolve(match.group(1)) is None
+        match = re.fullmatch(r'attribute_exists\(\s*(\S+?)\s*\)', text)
+        if match:
+            return resolve(match.group(1)) is not None
+        match = re.fullmatch(r'contains\(\s*(\S+?)\s*,\s*(:\w+)\s*\)', text)
+        if match:
+            attribute, operand = resolve(match.group(1)), values[match.group(2)]
+            if attribute is None:
+                return False
+            needle = next(iter(operand.values()))
+            haystack = next(iter(attribute.values()))
+            return needle in haystack
+        match = re.fullmatch(r'(\S+)\s*(<>|=)\s*(:\w+)', text)
+        if match:
+            equal = same(resolve(match.group(1)), values[match.group(3)])
+            return equal if match.group(2) == '=' else (resolve(match.group(1)) is not None and not equal)
+        raise ValueError(f"Unsupported condition: {text}")
+
+    return any(all(term(t) for t in re.split(r'\bAND\b', clause)) for clause in re.split(r'\bOR\b', expression))
+
+
+class LocalLambda:
+    """Records asynchronous self-invocations (hand-offs) instead of running them."""
+
+    def __init__(self):
+        self.invocations = []
+        self._lock = threading.Lock()
+
+    def invoke(self, FunctionName, InvocationType='RequestResponse', Payload=b'', **kwargs):
+        with self._lock:
+            self.invocations.append({'FunctionName': FunctionName, 'InvocationType': InvocationType, 'Payload': Payload})
+        return {'StatusCode': 202}
+
+
+class LocalAWS:
+    """Bundles one stand-in per service, sharing a single S3 object store."""
+
+    def __init__(self, s3_faults=None, textract_faults=None, dynamodb_faults=None):
+        self.s3 = LocalS3(s3_faults)
+        self.textract = LocalTextract(self.s3, textract_faults)
+        self.dynamodb = LocalDynamoDB(dynamodb_faults)
+        self.lambda_ = LocalLambda()
+
+    def install(self, app_module=None, lambda_module=None, bucket_name='loadtest-bucket', table_name='loadtest-jobs'):
+        """Points the module-level clients of app.py and/or lambda_function.py at these stand-ins."""
+        if app_module is not None:
+            app_module.s3_client = self.s3
+            app_module.textract_client = self.textract
+            app_module.S3_BUCKET_NAME = bucket_name
+        if lambda_module is not None:
+            lambda_module.s3_client = self.s3
+            lambda_module.textract_client = self.textract
+            lambda_module.dynamodb_client = self.dynamodb
+            lambda_module.lambda_client = self.lambda_
+            lambda_module.DYNAMODB_TABLE_NAME = table_name
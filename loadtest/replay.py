@@ -0,0 +1,226 @@
+"""
+Replays a traffic trace captured by traffic_capture.py against any build and compares the
+replayed latency distribution with the one recorded in production.
+
+The comparison is like for like: the trace holds the server-side total of every request
+(RequestTimer, from arrival to response), and the replayed server-side total is read from
+the total entry of the Server-Timing header. The latency the replay client observes also
+includes queueing in the client and the network; it is reported separately, not compared.
+
+Images come from the capture corpus when it was enabled. Otherwise a synthetic document
+with the recorded dimensions and format is generated, with a per-request mark along its top
+edge so that requests which were distinct in production are not coalesced (single_flight.py)
+into one OCR run. Requests keep their original spacing, scaled by --speed (2 = twice as fast,
+0 = as fast as possible).
+
+    python -m loadtest.replay capture/trace.jsonl --url http://localhost:5000 --speed 4
+    python -m loadtest.replay capture/trace.jsonl --in-process --corpus capture/corpus --speed 0
+"""
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+import contextlib
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+from loadtest.harness import percentile
+
+SYNTHETIC_ENCODINGS = {'png': 'png', 'jpeg': 'jpg', 'jpg': 'jpg', 'tiff': 'tiff'}
+
+
+def load_trace(path):
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return sorted(records, key=lambda record: record['timestamp'])
+
+
+class ImageSource:
+    """
+    Resolves the bytes to send for a trace record: the captured image if available, else a
+    synthetic stand-in that is unique to the request.
+    """
+
+    def __init__(self, corpus_dir=None):
+        self.corpus_dir = corpus_dir
+        self._synthetic = {}
+        self._sent = 0
+        self._lock = threading.Lock()
+
+    def image_for(self, record):
+        if self.corpus_dir:
+            path = os.path.join(self.corpus_dir, f"{record['sha256']}.{record['format']}")
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    return f.read(), record['format']
+
+        from benchmarks.synthetic_docs import render_document, encode_image
+        encoding = SYNTHETIC_ENCODINGS.get(record.get('format'), 'png')
+        width, height = record.get('width') or 1240, record.get('height') or 1754
+        key = (width, height)
+        with self._lock:
+            if key not in self._synthetic:
+                self._synthetic[key], _ = render_document(width, height, font_px=max(12, height // 70))
+            self._sent += 1
+            serial = self._sent
+        image = self._synthetic[key].copy()
+        for bit in range(min(32, image.shape[1] // 4)): # The request's serial number, in 4-pixel blocks on the top row
+            image[0, bit * 4:bit * 4 + 4] = 0 if serial >> bit & 1 else 255
+        return encode_image(image, encoding), encoding
+
+
+def _multipart_body(fields, file_field, filename, file_bytes):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    parts.append((f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+                  f'Content-Type: application/octet-stream\r\n\r\n').encode() + file_bytes + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def server_total_ms(server_timing):
+    """The 'total' duration of a Server-Timing header value, or None if it is missing."""
+    for entry in (server_timing or '').split(','):
+        name, _, params = entry.strip().partition(';')
+        if name == 'total' and params.startswith('dur='):
+            return float(params[4:])
+    return None
+
+
+class HttpTarget:
+    def __init__(self, base_url, timeout):
+        self.url = base_url.rstrip('/') + '/upload'
+        self.timeout = timeout
+
+    def send(self, image_bytes, extension, ocr_model):
+        body, content_type = _multipart_body({'ocr_model': ocr_model}, 'image', f'replay.{extension}', image_bytes)
+        request = urllib.request.Request(self.url, data=body, headers={'Content-Type': content_type}, method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+                return response.status, server_total_ms(response.headers.get('Server-Timing'))
+        except urllib.error.HTTPError as e:
+            return e.code, server_total_ms(e.headers.get('Server-Timing'))
+
+
+class InProcessTarget:
+    """Sends requests to the Flask app in this process, backed by the local AWS stand-ins."""
+
+    def __init__(self, textract_faults):
+        import app
+        from loadtest.local_aws import LocalAWS, FaultProfile
+        LocalAWS(textract_faults=FaultProfile.parse(textract_faults)).install(app)
+        self.app = app.app
+        self._local = threading.local()
+
+    def send(self, image_bytes, extension, ocr_model):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.post('/upload', data={'image': (io.BytesIO(image_bytes), f'replay.{extension}'),
+                                                'ocr_model': ocr_model})
+        return response.status_code, server_total_ms(response.headers.get('Server-Timing'))
+
+
+def replay(records, target, images, speed, concurrency):
+    """Re-issues every record at its (scaled) original offset; returns one result dict per record."""
+    results = [None] * len(records)
+    start_timestamp = records[0]['timestamp'] if records else 0.0
+    started = time.perf_counter()
+
+    def run(index, record, scheduled_at):
+        image_bytes, extension = images.image_for(record)
+        server_ms = None
+        try:
+            status, server_ms = target.send(image_bytes, extension, record.get('ocr_model', 'tesseract'))
+        except Exception as e:
+            status = f"{type(e).__name__}: {e}"
+        results[index] = {'ocr_model': record.get('ocr_model'), 'status': status, 'server_ms': server_ms,
+                          'client_ms': (time.perf_counter() - scheduled_at) * 1000.0}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for index, record in enumerate(records):
+            scheduled_at = time.perf_counter()
+            if speed > 0:
+                scheduled_at = started + (record['timestamp'] - start_timestamp) / speed
+                delay = scheduled_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            pool.submit(run, index, record, scheduled_at)
+    return results
+
+
+def _distribution(values):
+    values = sorted(values)
+    return {name: (round(percentile(values, pct), 2) if values else None)
+            for name, pct in (('p50', 50), ('p95', 95), ('p99', 99))}
+
+
+def compare(records, results):
+    """
+    Compares recorded and replayed server-side latency percentiles per OCR model; the
+    client-observed latency of the replay is reported alongside (see the module docstring).
+    """
+    report = {}
+    for model in sorted({record.get('ocr_model') for record in records}):
+        recorded = [r['total_ms'] for r in records if r.get('ocr_model') == model]
+        replayed = [r for r in results if r and r['ocr_model'] == model]
+        errors = [r for r in replayed if r['status'] != 200]
+        before = _distribution(recorded)
+        after = _distribution([r['server_ms'] for r in replayed if r['server_ms'] is not None])
+        report[model] = {
+            'requests': len(replayed),
+            'error_rate': round(len(errors) / len(replayed), 4) if replayed else 0.0,
+            'recorded_server_ms': before,
+            'replayed_server_ms': after,
+            'replayed_client_ms': _distribution([r['client_ms'] for r in replayed]),
+            'change_pct': {name: (round((after[name] - before[name]) / before[name] * 100.0, 1)
+                                  if before[name] and after[name] is not None else None) for name in before},
+        }
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('trace', help="JSONL trace written by traffic_capture.py")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--url', help="Base URL of a running build, e.g. http://localhost:5000")
+    target.add_argument('--in-process', action='store_true', help="Replay against this checkout with local AWS stand-ins")
+    parser.add_argument('--corpus', help="Directory of captured images (CAPTURE_CORPUS_DIR)")
+    parser.add_argument('--speed', type=float, default=1.0, help="Time scale; 0 sends as fast as possible")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--timeout', type=float, default=120.0, help="HTTP timeout in seconds")
+    parser.add_argument('--textract', default='latency_ms=400,jitter_ms=200', help="Textract fault profile for --in-process")
+    parser.add_argument('--output', help="Write the comparison as JSON to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    records = load_trace(args.trace)
+    if not records:
+        print("Trace is empty.")
+        return 1
+
+    target = HttpTarget(args.url, args.timeout) if args.url else InProcessTarget(args.textract)
+    sink = contextlib.redirect_stdout(io.StringIO()) if args.in_process else contextlib.nullcontext()
+    with sink:
+        results = replay(records, target, ImageSource(args.corpus), args.speed, args.concurrency)
+
+    report = compare(records, results)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
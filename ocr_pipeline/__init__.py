@@ -0,0 +1,15 @@
+"""
+The OCR pipeline shared by the Flask app and the Lambda.
+
+A pipeline is a declarative list of stages, each in one of the phases decode, normalize,
+binarize and postprocess, passing typed buffers (buffers.py) from one to the next.
+Runs are configured by a PipelineConfig (config.py) and timed stage by stage through the
+caller's timer and hooks (engine.py). A new stage added to stages.py is therefore available,
+and measured, in both deployments:
+
+    page, decisions = PREPROCESS.run(EncodedImage(image_bytes), PipelineConfig(binarization='sauvola'), timer)
+"""
+from ocr_pipeline.buffers import EncodedImage, GrayImage, BinaryImage, TextractBlocks, OcrText
+from ocr_pipeline.config import SCHEMA, PipelineConfig
+from ocr_pipeline.engine import PHASES, Stage, Pipeline
+from ocr_pipeline.stages import UPRIGHT, PREPROCESS, PREPROCESS_PNG, TEXTRACT_TEXT
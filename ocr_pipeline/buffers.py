@@ -0,0 +1,36 @@
+# Typed buffers passed between pipeline stages. Every stage declares the buffer type it consumes
+# and the one it produces (see engine.py), so a pipeline whose stages do not fit together is
+# rejected when it is built rather than when a request runs through it.
+
+
+class EncodedImage:
+    """Image file bytes: an upload (PNG, JPEG, TIFF...) or a page encoded for storage."""
+
+    def __init__(self, data):
+        self.data = data
+
+
+class GrayImage:
+    """A decoded 8-bit single-channel page (numpy array). Stages may modify pixels in place."""
+
+    def __init__(self, pixels):
+        self.pixels = pixels
+
+
+class BinaryImage(GrayImage):
+    """A grey page thresholded to ink (0) and background (255), ready for OCR."""
+
+
+class TextractBlocks:
+    """The Blocks list of a Textract DetectDocumentText response."""
+
+    def __init__(self, blocks):
+        self.blocks = blocks
+
+
+class OcrText:
+    """Recognised text plus its words ({'text', 'confidence', 'bbox'}), if known."""
+
+    def __init__(self, text, words=None):
+        self.text = text
+        self.words = words if words is not None else []
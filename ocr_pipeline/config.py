@@ -0,0 +1,45 @@
+import binarization
+import deskew
+import page_crop
+import quality_probe
+
+# --- Configuration ---
+# The schema of a pipeline run: setting -> (type, module, attribute, allowed values or None).
+# Defaults are read from the module-level configuration of the module that implements the
+# stage (and so from the same environment variables) when a PipelineConfig is created, so the
+# Flask app and the Lambda are configured identically. A setting without a module is per run
+# only, and attribute is its default.
+# binarization_requested says the request named its binarization backend, which light pages
+# then keep instead of the global Otsu threshold (see stages.threshold()).
+SCHEMA = {
+    'page_crop': (bool, page_crop, 'PAGE_CROP', None),
+    'deskew': (bool, deskew, 'DESKEW', None),
+    'quality_probe': (bool, quality_probe, 'QUALITY_PROBE', None),
+    'binarization': (str, binarization, 'BINARIZATION', tuple(binarization.BACKENDS)),
+    'binarization_requested': (bool, None, False, None),
+}
+
+
+class PipelineConfig:
+    """
+    The settings of one pipeline run, validated against SCHEMA. Settings that are not given,
+    or given as None, keep their default. Raises ValueError for unknown settings and for
+    values of the wrong type or outside the allowed ones.
+    """
+
+    def __init__(self, **settings):
+        unknown = sorted(set(settings) - set(SCHEMA))
+        if unknown:
+            raise ValueError(f"Unknown pipeline setting(s): {', '.join(unknown)}.")
+        for name, (kind, module, attribute, allowed) in SCHEMA.items():
+            value = settings.get(name)
+            if value is None:
+                value = getattr(module, attribute) if module else attribute
+            if not isinstance(value, kind):
+                raise ValueError(f"Pipeline setting '{name}' must be {kind.__name__}, not {type(value).__name__}.")
+            if allowed is not None and value not in allowed:
+                raise ValueError(f"Pipeline setting '{name}' must be one of {', '.join(allowed)}, not '{value}'.")
+            setattr(self, name, value)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in SCHEMA}
@@ -0,0 +1,84 @@
+import time
+from contextlib import nullcontext
+
+from ocr_pipeline.config import PipelineConfig
+
+# Every stage belongs to one phase, and a pipeline lists its stages in phase order. OCR itself is
+# not a phase: the engines read whole pages, bands, tiles, crops or S3 objects, and callers run them
+# between a preprocessing pipeline and TEXTRACT_TEXT.
+PHASES = ('decode', 'normalize', 'binarize', 'postprocess')
+
+
+class Stage:
+    """
+    One step of a pipeline. function(buffer, config, decisions) turns a buffer of type consumes
+    into one of type produces (see buffers.py); config is the run's PipelineConfig and decisions
+    a dict shared by the stages of one run, for what later stages and the caller need to know
+    (page corners, rotation, the quality profile...).
+    when(config, decisions), if given, decides per run whether the stage runs at all; a skipped
+    stage passes its input on unchanged.
+    """
+
+    def __init__(self, name, phase, function, consumes, produces, when=None):
+        if phase not in PHASES:
+            raise ValueError(f"Unknown phase '{phase}' for stage '{name}'; choose one of {', '.join(PHASES)}.")
+        self.name = name
+        self.phase = phase
+        self.function = function
+        self.consumes = consumes
+        self.produces = produces
+        self.when = when
+
+
+class Pipeline:
+    """
+    An ordered list of stages that accepts buffers of type accepts. The stages are checked when
+    the pipeline is built: phases must not go backwards, and every stage must consume whatever
+    the stages before it may produce, optional stages included. Raises ValueError or TypeError.
+    """
+
+    def __init__(self, stages, accepts):
+        self.stages = list(stages)
+        self.accepts = accepts
+        self.produces = self._check()
+
+    def _check(self):
+        """Returns the buffer types the pipeline may produce."""
+        possible, phase = {self.accepts}, 0
+        for stage in self.stages:
+            if PHASES.index(stage.phase) < phase:
+                raise ValueError(f"Stage '{stage.name}' ({stage.phase}) comes after a stage of a later phase.")
+            phase = PHASES.index(stage.phase)
+            unfit = sorted(kind.__name__ for kind in possible if not issubclass(kind, stage.consumes))
+            if unfit:
+                raise TypeError(f"Stage '{stage.name}' consumes {stage.consumes.__name__} but may receive {', '.join(unfit)}.")
+            possible = possible | {stage.produces} if stage.when else {stage.produces}
+        return possible
+
+    def then(self, *stages):
+        """A new pipeline with stages appended: how callers plug their own stages in."""
+        return Pipeline(self.stages + list(stages), self.accepts)
+
+    def run(self, buffer, config=None, timer=None, hooks=()):
+        """
+        Runs the stages on buffer and returns (final buffer, decisions).
+        Every stage that runs is timed as timer.stage(name) when a timer is given (a
+        RequestTimer or the Lambda's StageTimer), and each hook is called as
+        hook(name, seconds, output buffer) after it.
+        """
+        if not isinstance(buffer, self.accepts):
+            raise TypeError(f"Pipeline accepts {self.accepts.__name__}, not {type(buffer).__name__}.")
+        config = config or PipelineConfig()
+        decisions = {}
+        for stage in self.stages:
+            if stage.when and not stage.when(config, decisions):
+                continue
+            start = time.perf_counter()
+            with timer.stage(stage.name) if timer else nullcontext():
+                buffer = stage.function(buffer, config, decisions)
+            seconds = time.perf_counter() - start
+            if not isinstance(buffer, stage.produces):
+                raise TypeError(f"Stage '{stage.name}' returned {type(buffer).__name__}, not {stage.produces.__name__}.")
+            for hook in hooks:
+                hook(stage.name, seconds, buffer)
+        return buffer, decisions
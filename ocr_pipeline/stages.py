@@ -0,0 +1,105 @@
+import cv2
+import numpy as np
+
+import binarization
+import deskew
+import page_crop
+import quality_probe
+from result_store import extract_words
+from ocr_pipeline.buffers import EncodedImage, GrayImage, BinaryImage, TextractBlocks, OcrText
+from ocr_pipeline.engine import Stage, Pipeline
+
+# Stage functions take (buffer, config, decisions) and return the next buffer (see engine.py).
+# Grey pages are modified in place wherever the operation allows it, so the decoded array
+# stays the only full-size buffer of a run.
+
+
+def decode(image, config, decisions):
+    """Decodes straight to grey: no full-size colour copy is ever made."""
+    pixels = cv2.imdecode(np.frombuffer(image.data, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if pixels is None:
+        raise ValueError("Could not decode image bytes for preprocessing.")
+    return GrayImage(pixels)
+
+
+def crop_page(page, config, decisions):
+    """Cuts a photographed page out of its background and rectifies it (see page_crop.py)."""
+    corners = page_crop.detect_quad(page.pixels)
+    decisions['page_corners'] = None if corners is None else corners.round().astype(int).tolist()
+    return page if corners is None else GrayImage(page_crop.warp_page(page.pixels, corners))
+
+
+def level_page(page, config, decisions):
+    """Turns sideways, upside-down and skewed pages upright (see deskew.py)."""
+    quarter_turns, skew = deskew.detect(page.pixels)
+    decisions.update(rotation=int(quarter_turns) * 90, skew=round(float(skew), 2))
+    return GrayImage(deskew.correct(page.pixels, quarter_turns, skew))
+
+
+def probe_quality(page, config, decisions):
+    """Measures the page and picks its preprocessing profile (see quality_probe.py)."""
+    decisions.update(quality_probe.probe(page.pixels))
+    return page
+
+
+def denoise(page, config, decisions):
+    cv2.medianBlur(page.pixels, 3, dst=page.pixels)
+    return page
+
+
+def blur(page, config, decisions):
+    binarization.blur(page.pixels, dst=page.pixels)
+    return page
+
+
+def threshold(page, config, decisions):
+    """
+    Thresholds with config.binarization, or one global Otsu threshold for 'light' pages unless
+    the request named its backend.
+    """
+    light = decisions.get('profile') == 'light' and not config.binarization_requested
+    method = 'otsu' if light else config.binarization
+    return BinaryImage(binarization.threshold(page.pixels, method, dst=page.pixels))
+
+
+def encode_png(page, config, decisions):
+    is_success, buffer = cv2.imencode('.png', page.pixels)
+    if not is_success:
+        raise Exception("Failed to encode preprocessed image.")
+    return EncodedImage(buffer.tobytes())
+
+
+def textract_text(blocks, config, decisions):
+    """Joins Textract's LINE blocks into text, one line each, and keeps the WORD blocks as words."""
+    text = "\n".join(block['Text'] for block in blocks.blocks if block['BlockType'] == 'LINE')
+    return OcrText(text.strip(), extract_words(blocks.blocks))
+
+
+def _profile_in(*profiles):
+    """A when() that runs the stage for pages of the given quality profiles ('standard' without a probe)."""
+    return lambda config, decisions: decisions.get('profile', 'standard') in profiles
+
+
+# Decode, then (as configured) cut the page out of a photo and turn it upright
+UPRIGHT = Pipeline([
+    Stage('decode', 'decode', decode, EncodedImage, GrayImage),
+    Stage('page_crop', 'normalize', crop_page, GrayImage, GrayImage, when=lambda config, decisions: config.page_crop),
+    Stage('deskew', 'normalize', level_page, GrayImage, GrayImage, when=lambda config, decisions: config.deskew),
+], accepts=EncodedImage)
+
+# UPRIGHT plus the preprocessing the page's quality profile calls for (see quality_probe.PROFILES)
+PREPROCESS = UPRIGHT.then(
+    Stage('probe', 'normalize', probe_quality, GrayImage, GrayImage, when=lambda config, decisions: config.quality_probe),
+    Stage('denoise', 'binarize', denoise, GrayImage, GrayImage, when=_profile_in('full')),
+    Stage('blur', 'binarize', blur, GrayImage, GrayImage, when=_profile_in('standard', 'full')),
+    Stage('threshold', 'binarize', threshold, GrayImage, BinaryImage, when=_profile_in('light', 'standard', 'full')),
+)
+
+# PREPROCESS with the result encoded as PNG, for storing the preprocessed page
+PREPROCESS_PNG = PREPROCESS.then(
+    Stage('encode', 'postprocess', encode_png, GrayImage, EncodedImage),
+)
+
+TEXTRACT_TEXT = Pipeline([
+    Stage('postprocess', 'postprocess', textract_text, TextractBlocks, OcrText),
+], accepts=TextractBlocks)
@@ -0,0 +1,86 @@
+import os
+
+import numpy as np
+
+# --- Configuration ---
+# With OCR_BAND_WORKERS > 1 a page is cut into up to that many horizontal bands, which are OCR'd
+# concurrently. Bands are at least OCR_BAND_MIN_HEIGHT pixels tall so that per-call overhead
+# does not dominate. Cuts are only made through blank rows: rows where at most
+# OCR_BAND_BLANK_FRACTION of the pixels are ink, or no more than twice the noise level of the
+# emptiest rows (see blank_gaps()). A cut through a gap more than OCR_BAND_PARAGRAPH_GAP times
+# the page's median gap height separates paragraphs, and the band texts are joined with a blank line.
+OCR_BAND_WORKERS = int(os.environ.get('OCR_BAND_WORKERS', 1))
+OCR_BAND_MIN_HEIGHT = int(os.environ.get('OCR_BAND_MIN_HEIGHT', 300))
+OCR_BAND_BLANK_FRACTION = float(os.environ.get('OCR_BAND_BLANK_FRACTION', 0.002))
+OCR_BAND_PARAGRAPH_GAP = float(os.environ.get('OCR_BAND_PARAGRAPH_GAP', 1.5))
+
+LINE_SEPARATOR = "\n"
+PARAGRAPH_SEPARATOR = "\n\n"
+
+# Each band already gets its own tesseract process; OpenMP threads inside each would oversubscribe the cores
+if OCR_BAND_WORKERS > 1:
+    os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+
+
+def row_profile(binary):
+    """Ink pixels per row of a thresholded page (dark ink on a light background)."""
+    return np.count_nonzero(binary < 128, axis=1)
+
+
+def blank_gaps(ink_per_row, width):
+    """
+    Returns (start, end, cut) for each run of rows between text lines, where cut is the row to
+    cut at. Runs are found with a loose threshold (relative to the text rows) so that ascenders,
+    descenders and scanner noise do not fragment them; cut is the emptiest row of the middle half
+    of the run, and is only kept if that row is also blank by the strict threshold.
+    """
+    # Scanner noise leaves speckles in every row; the emptiest rows (between lines) show its level
+    noise_floor, text_level = np.percentile(ink_per_row, (10, 90))
+    strict = max(OCR_BAND_BLANK_FRACTION * width, 2 * noise_floor)
+    loose = max(strict, noise_floor + 0.2 * (text_level - noise_floor))
+    # Run boundaries of the blank mask, found without a Python loop over rows
+    blank = (ink_per_row <= loose).astype(np.int8)
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], blank, [0]))))
+    smoothed = np.convolve(ink_per_row, np.ones(3) / 3.0, mode='same')
+    gaps = []
+    for start, end in zip(edges[0::2], edges[1::2]):
+        quarter = (end - start) // 4
+        cut = start + quarter + int(smoothed[start + quarter:end - quarter].argmin())
+        if smoothed[cut] <= strict:
+            gaps.append((start, end, cut))
+    return gaps
+
+
+def band_ranges(binary, bands):
+    """
+    Splits the page into at most bands (top, bottom) row ranges covering every row exactly once.
+    Each cut is placed in the blank gap closest to an even split, so no text line
+    is ever cut and the seams can neither duplicate nor drop a line.
+    Returns (ranges, separators): separators[i] joins the texts of bands i and i + 1, and is
+    PARAGRAPH_SEPARATOR if that cut went through a gap between paragraphs, LINE_SEPARATOR if it
+    went between two lines of one paragraph.
+    """
+    height = binary.shape[0]
+    bands = max(1, min(bands, height // max(1, OCR_BAND_MIN_HEIGHT)))
+    if bands == 1:
+        return [(0, height)], []
+
+    gaps = [(start, end, cut) for start, end, cut in blank_gaps(row_profile(binary), binary.shape[1])
+            if 0 < start and end < height]
+    if not gaps:
+        return [(0, height)], []
+    cut_candidates = np.array([cut for _, _, cut in gaps])
+    gap_heights = np.array([end - start for start, end, _ in gaps])
+    paragraph_gap = OCR_BAND_PARAGRAPH_GAP * float(np.median(gap_heights))
+
+    cuts, separators = [], []
+    for i in range(1, bands):
+        target = height * i // bands
+        nearest = int(np.abs(cut_candidates - target).argmin())
+        cut = int(cut_candidates[nearest])
+        previous = cuts[-1] if cuts else 0
+        if cut - previous >= OCR_BAND_MIN_HEIGHT // 2 and height - cut >= OCR_BAND_MIN_HEIGHT // 2:
+            cuts.append(cut)
+            separators.append(PARAGRAPH_SEPARATOR if gap_heights[nearest] > paragraph_gap else LINE_SEPARATOR)
+    bounds = [0] + cuts + [height]
+    return list(zip(bounds[:-1], bounds[1:])), separators
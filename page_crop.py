@@ -0,0 +1,105 @@
+import os
+
+import cv2
+import numpy as np
+
+# --- Configuration ---
+# With PAGE_CROP on, photos are searched for the page outline (edges and contours on a copy whose
+# longer side is at most PAGE_CROP_MAX_SIDE). When a convex quadrilateral covering between
+# PAGE_CROP_MIN_AREA and PAGE_CROP_MAX_AREA of the image is found, only the page is warped to a
+# rectified crop before any further preprocessing; the table, hands and background around it
+# are never binarized or OCR'd. Scans, where the page fills the image, are left alone.
+# A quadrilateral is only taken for the page when it stands out from a distinct background:
+# its inside must be at least PAGE_CROP_MIN_CONTRAST grey levels brighter than a band just
+# outside it, or every corner must lie within PAGE_CROP_EDGE_MARGIN (a fraction of the longer
+# side) of the image border, where a page filling the photo leaves too little background to
+# measure. A box drawn on a flat scan (a bordered table, a frame) is paper on both sides and
+# is left alone.
+# The crop keeps the page's own resolution (its longest edge in the photo), or is scaled so
+# its longer side is PAGE_CROP_TARGET_SIDE pixels when that is set.
+PAGE_CROP = os.environ.get('PAGE_CROP', 'false').lower() == 'true'
+PAGE_CROP_MAX_SIDE = int(os.environ.get('PAGE_CROP_MAX_SIDE', 800))
+PAGE_CROP_MIN_AREA = float(os.environ.get('PAGE_CROP_MIN_AREA', 0.2))
+PAGE_CROP_MAX_AREA = float(os.environ.get('PAGE_CROP_MAX_AREA', 0.95))
+PAGE_CROP_TARGET_SIDE = int(os.environ.get('PAGE_CROP_TARGET_SIDE', 0))
+PAGE_CROP_MIN_CONTRAST = float(os.environ.get('PAGE_CROP_MIN_CONTRAST', 30))
+PAGE_CROP_EDGE_MARGIN = float(os.environ.get('PAGE_CROP_EDGE_MARGIN', 0.04))
+PAGE_CROP_BAND = 0.03 # Width of the background band outside the quadrilateral, as a fraction of the shorter side
+
+
+def _edges(small):
+    """Canny edges with thresholds derived from the median brightness, closed into outlines."""
+    blurred = cv2.GaussianBlur(small, (5, 5), 0)
+    median = float(np.median(blurred))
+    edges = cv2.Canny(blurred, int(max(0, 0.66 * median)), int(min(255, 1.33 * median)))
+    return cv2.dilate(edges, cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3)))
+
+
+def order_corners(points):
+    """Orders four (x, y) points as top-left, top-right, bottom-right, bottom-left."""
+    points = np.asarray(points, dtype=np.float32).reshape(4, 2)
+    sums = points.sum(axis=1)
+    differences = points[:, 1] - points[:, 0]
+    return np.array([points[sums.argmin()], points[differences.argmin()],
+                     points[sums.argmax()], points[differences.argmax()]], dtype=np.float32)
+
+
+def _near_edges(corners, shape):
+    """True if every corner lies within PAGE_CROP_EDGE_MARGIN of the image border."""
+    height, width = shape
+    margin = PAGE_CROP_EDGE_MARGIN * max(height, width)
+    return all(min(x, y, width - 1 - x, height - 1 - y) <= margin for x, y in corners)
+
+
+def separates_page(small, corners):
+    """
+    True if the quadrilateral (corners in small's pixels) looks like paper on a background:
+    brighter inside than in a band just outside, or reaching the image border (see PAGE_CROP_MIN_CONTRAST).
+    """
+    if _near_edges(corners, small.shape):
+        return True
+    inside = np.zeros(small.shape, np.uint8)
+    cv2.fillConvexPoly(inside, np.round(corners).astype(np.int32), 255)
+    band_px = max(3, int(PAGE_CROP_BAND * min(small.shape)))
+    outside = cv2.dilate(inside, cv2.getStructuringElement(cv2.MORPH_RECT, (2 * band_px + 1, 2 * band_px + 1)))
+    outside[inside > 0] = 0
+    if not outside.any():
+        return True
+    return cv2.mean(small, inside)[0] - cv2.mean(small, outside)[0] >= PAGE_CROP_MIN_CONTRAST
+
+
+def detect_quad(gray):
+    """
+    Returns the page corners in full-resolution pixels (top-left, top-right, bottom-right,
+    bottom-left), or None if no plausible page outline is found (see separates_page()).
+    """
+    scale = min(1.0, PAGE_CROP_MAX_SIDE / float(max(gray.shape)))
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1.0 else gray
+    contours, _ = cv2.findContours(_edges(small), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    image_area = float(small.shape[0] * small.shape[1])
+
+    for contour in sorted(contours, key=cv2.contourArea, reverse=True)[:5]:
+        hull = cv2.convexHull(contour)
+        area_fraction = cv2.contourArea(hull) / image_area
+        if area_fraction < PAGE_CROP_MIN_AREA:
+            break # Sorted by area: every remaining contour is smaller still
+        approx = cv2.approxPolyDP(hull, 0.02 * cv2.arcLength(hull, True), True)
+        if len(approx) == 4 and area_fraction <= PAGE_CROP_MAX_AREA:
+            corners = approx.reshape(4, 2).astype(np.float32)
+            if separates_page(small, corners):
+                return order_corners(corners / scale)
+    return None
+
+
+def warp_page(gray, corners):
+    """Warps the quadrilateral to an upright rectangle (see PAGE_CROP_TARGET_SIDE for its size)."""
+    top_left, top_right, bottom_right, bottom_left = corners
+    width = max(np.linalg.norm(top_right - top_left), np.linalg.norm(bottom_right - bottom_left))
+    height = max(np.linalg.norm(bottom_left - top_left), np.linalg.norm(bottom_right - top_right))
+    if PAGE_CROP_TARGET_SIDE:
+        factor = PAGE_CROP_TARGET_SIDE / float(max(width, height))
+        width, height = width * factor, height * factor
+    width, height = int(round(width)), int(round(height))
+    target = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype=np.float32)
+    matrix = cv2.getPerspectiveTransform(corners, target)
+    return cv2.warpPerspective(gray, matrix, (width, height), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
@@ -0,0 +1,152 @@
+import os
+import sys
+import hmac
+import time
+import random
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+# --- Configuration ---
+# Profiling is off unless PROFILE_TOKEN or PROFILE_SAMPLE_RATE is set. A request is profiled when it
+# sends a matching X-Profile-Token header, or when it is picked by PROFILE_SAMPLE_RATE (0-1).
+# For each profiled request two files are written to PROFILE_DIR:
+#   <trace_id>.cpu.folded  sampled wall-clock stacks in collapsed format (flamegraph.pl, speedscope)
+#   <trace_id>.tracemalloc allocation snapshot; compare two with tracemalloc.Snapshot.load(...).compare_to(...)
+# When neither setting is configured the only cost per request is should_profile()'s two comparisons.
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', 5))
+PROFILE_TRACEMALLOC_FRAMES = int(os.environ.get('PROFILE_TRACEMALLOC_FRAMES', 16))
+PROFILE_HEADER = 'X-Profile-Token'
+
+# tracemalloc is process-wide, so only one request is profiled at a time; others run unprofiled
+_profile_lock = threading.Lock()
+_active = {} # Request name -> its RequestProfile, while it is being profiled
+
+
+def should_profile(headers):
+    """Decides whether the current request is profiled, from its headers and the sampling rate."""
+    if not PROFILE_TOKEN and PROFILE_SAMPLE_RATE <= 0:
+        return False
+    supplied = headers.get(PROFILE_HEADER)
+    if PROFILE_TOKEN and supplied and hmac.compare_digest(supplied, PROFILE_TOKEN):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _collapse(frame):
+    """Turns a frame into a root-first "file:function;..." stack string."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class StackSampler:
+    """
+    Samples the Python stacks of a set of threads every interval from a background thread.
+    Threads can be added and removed while sampling (see sampled_thread()).
+    Time spent inside C extensions (cv2, numpy) or waiting on the tesseract subprocess is
+    attributed to the Python frame that made the call, so the profile is wall-clock, not CPU-only.
+    """
+
+    def __init__(self, thread_id, interval_seconds):
+        self.thread_ids = {thread_id}
+        self.interval_seconds = interval_seconds
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            frames = sys._current_frames()
+            for thread_id in list(self.thread_ids):
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self.stacks[_collapse(frame)] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write_folded(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+@contextmanager
+def sampled_thread(name):
+    """
+    Adds the calling thread to the profile of request name for the duration of the block, for
+    work a request hands to another thread (e.g. a coalesced OCR run). A no-op when that
+    request is not being profiled or the thread is already sampled.
+    """
+    profile = _active.get(name)
+    thread_id = threading.get_ident()
+    if profile is None or thread_id in profile._sampler.thread_ids:
+        yield
+        return
+    profile._sampler.thread_ids.add(thread_id)
+    try:
+        yield
+    finally:
+        profile._sampler.thread_ids.discard(thread_id)
+
+
+class RequestProfile:
+    """
+    Context manager that profiles the calling thread, plus any thread that joins through
+    sampled_thread(name), for the duration of the block.
+    If another request is already being profiled the block runs unprofiled and paths stays empty.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.paths = []
+        self._sampler = None
+        self._started_tracemalloc = False
+
+    def __enter__(self):
+        if not _profile_lock.acquire(blocking=False):
+            return self
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+            self._started_tracemalloc = True
+        self._sampler = StackSampler(threading.get_ident(), PROFILE_INTERVAL_MS / 1000.0)
+        self._started = time.perf_counter()
+        self._sampler.start()
+        _active[self.name] = self
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._sampler is None:
+            return False
+        _active.pop(self.name, None)
+        try:
+            self._sampler.stop()
+            snapshot = tracemalloc.take_snapshot()
+            elapsed_ms = (time.perf_counter() - self._started) * 1000
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            cpu_path = os.path.join(PROFILE_DIR, f"{self.name}.cpu.folded")
+            memory_path = os.path.join(PROFILE_DIR, f"{self.name}.tracemalloc")
+            self._sampler.write_folded(cpu_path)
+            snapshot.dump(memory_path)
+            self.paths = [cpu_path, memory_path]
+            print(f"Profiled request {self.name} ({elapsed_ms:.0f}ms, {sum(self._sampler.stacks.values())} samples) "
+                  f"to {cpu_path} and {memory_path}")
+        except Exception as e:
+            print(f"Error writing profile for {self.name}: {e}")
+        finally:
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+            _profile_lock.release()
+        return False
@@ -0,0 +1,89 @@
+import os
+
+import cv2
+import numpy as np
+
+import binarization
+import region_packing
+import scratch_buffers
+
+# --- Configuration ---
+# 'progressive' model: the first pass reads a copy of the page reduced by PROGRESSIVE_SCALE,
+# which holds most of the text legibly at a fraction of the pixels. Only lines whose mean word
+# confidence is below PROGRESSIVE_MIN_CONFIDENCE are read again, each from a padded crop of
+# the full-resolution page with heavier preprocessing (median denoise, then the
+# PROGRESSIVE_REFINE_BINARIZATION backend). A re-read line replaces the first-pass line only
+# when its own mean confidence is higher.
+PROGRESSIVE_SCALE = float(os.environ.get('PROGRESSIVE_SCALE', 0.5))
+PROGRESSIVE_MIN_CONFIDENCE = float(os.environ.get('PROGRESSIVE_MIN_CONFIDENCE', 70))
+PROGRESSIVE_REFINE_BINARIZATION = os.environ.get('PROGRESSIVE_REFINE_BINARIZATION', 'sauvola').lower()
+PROGRESSIVE_WORKERS = int(os.environ.get('PROGRESSIVE_WORKERS', os.cpu_count() or 2))
+PROGRESSIVE_LINE_PADDING = 0.3 # Crop margin around a line, as a fraction of the line height
+
+
+def reduce(gray):
+    """Returns (reduced copy of gray, scale); the copy may be binarized in place."""
+    scale = min(1.0, PROGRESSIVE_SCALE)
+    if scale >= 1.0:
+        return gray.copy(), 1.0
+    return cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA), scale
+
+
+def scale_words(words, factor):
+    """Scales the word bboxes (in place) by factor, e.g. from the reduced page back to full resolution."""
+    for word in words:
+        word['bbox'] = [int(round(v * factor)) for v in word['bbox']]
+    return words
+
+
+def refine_preprocess(crop):
+    """
+    Median denoise plus blur and PROGRESSIVE_REFINE_BINARIZATION, into the calling thread's
+    scratch buffer (crop is a view of the page); valid until the thread's next line.
+    """
+    denoised = cv2.medianBlur(crop, 3, dst=scratch_buffers.scratch('refine', crop.shape))
+    return binarization.binarize(denoised, PROGRESSIVE_REFINE_BINARIZATION, dst=denoised)
+
+
+def _mean_confidence(words):
+    return float(np.mean([word['confidence'] for word in words])) if words else 0.0
+
+
+def line_box(line_words, width, height):
+    """The full-resolution crop box of a line: its words' union, padded by PROGRESSIVE_LINE_PADDING."""
+    box = region_packing.union_box([word['bbox'] for word in line_words])
+    return region_packing.clip_box(box, width, height, padding=int(PROGRESSIVE_LINE_PADDING * box[3]) + 2)
+
+
+def refine_lines(gray, lines, ocr_line):
+    """
+    Re-reads the low-confidence lines of a first pass from the full-resolution page.
+
+    lines are the first-pass lines as from group_lines(), with bboxes in gray's pixels.
+    ocr_line(crop) returns the words of one grey line crop.
+    Returns (replacements, details): replacements maps line indexes to the re-read text, for
+    the lines whose re-read is more confident; lines keep their place in the reading order,
+    so the merge is by the geometry of the first pass.
+    """
+    height, width = gray.shape
+    low = [i for i, (_, line_words) in enumerate(lines)
+           if _mean_confidence(line_words) < PROGRESSIVE_MIN_CONFIDENCE]
+    boxes = {i: line_box(lines[i][1], width, height) for i in low}
+    low = [i for i in low if boxes[i][2] and boxes[i][3]]
+    crops = [gray[t:t + h, l:l + w] for l, t, w, h in (boxes[i] for i in low)]
+
+    replacements = {}
+    if crops:
+        results = scratch_buffers.map_crops(ocr_line, crops, limit=PROGRESSIVE_WORKERS)
+        for index, words in zip(low, results):
+            if words and _mean_confidence(words) > _mean_confidence(lines[index][1]):
+                replacements[index] = " ".join(word['text'] for word in words)
+
+    refined_pixels = sum(boxes[i][2] * boxes[i][3] for i in low)
+    details = {
+        'lines': len(lines),
+        'refined_lines': len(low),
+        'replaced_lines': len(replacements),
+        'refined_pixel_fraction': round(refined_pixels / float(gray.size), 4),
+    }
+    return replacements, details
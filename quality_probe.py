@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+
+# --- Configuration ---
+# With QUALITY_PROBE on, every decoded page is measured on a thumbnail-sized sample and given
+# the cheapest preprocessing profile (see PROFILES) that suits it. The sample is a grid of at
+# most QUALITY_PROBE_SIDE points along the longer side, each read together with its four
+# full-resolution neighbours: an averaged thumbnail would hide pixel noise and blur, and
+# turn a bilevel page grey.
+QUALITY_PROBE = os.environ.get('QUALITY_PROBE', 'false').lower() == 'true'
+QUALITY_PROBE_SIDE = int(os.environ.get('QUALITY_PROBE_SIDE', 512))
+QUALITY_BILEVEL_FRACTION = float(os.environ.get('QUALITY_BILEVEL_FRACTION', 0.97)) # Share of pixels at the two extremes
+# A global threshold needs evenly lit paper, which shows as most pixels sitting at the two extremes
+QUALITY_LIGHT_BILEVEL_FRACTION = float(os.environ.get('QUALITY_LIGHT_BILEVEL_FRACTION', 0.8))
+QUALITY_MIN_CONTRAST = float(os.environ.get('QUALITY_MIN_CONTRAST', 100)) # Paper minus ink level, 0-255
+QUALITY_MAX_CLEAN_NOISE = float(os.environ.get('QUALITY_MAX_CLEAN_NOISE', 2.0)) # Noise sigma of a born-digital page
+QUALITY_MAX_NOISE = float(os.environ.get('QUALITY_MAX_NOISE', 8.0)) # Above this sigma the page is denoised first
+QUALITY_MIN_SHARPNESS = float(os.environ.get('QUALITY_MIN_SHARPNESS', 500)) # Laplacian variance of crisp text
+
+# From cheapest to most thorough:
+#   none     - already bilevel: OCR the grey page as it is
+#   light    - clean, crisp, contrasty and evenly lit (screenshots, renders): one global Otsu threshold
+#   standard - the usual blur plus the request's binarization backend
+#   full     - noisy or low contrast (phone photos): median denoise, then standard
+PROFILES = ('none', 'light', 'standard', 'full')
+
+
+def _sample(gray):
+    """Returns (centre, left, right, up, down) uint8 pixel grids for a thumbnail-sized set of points."""
+    height, width = gray.shape
+    step = max(1, int(np.ceil(max(height, width) / float(QUALITY_PROBE_SIDE))))
+    ys = np.arange(1, height - 1, step)
+    xs = np.arange(1, width - 1, step)
+    rows = {dy: gray[ys + dy] for dy in (-1, 0, 1)}
+    return [rows[dy][:, xs + dx] for dy, dx in ((0, 0), (0, -1), (0, 1), (-1, 0), (1, 0))]
+
+
+def _percentiles(values, fractions):
+    """Percentiles (as fractions) of 8-bit values, from their histogram rather than a sort."""
+    cumulative = np.cumsum(np.bincount(values.ravel(), minlength=256))
+    return [float(np.searchsorted(cumulative, fraction * cumulative[-1])) for fraction in fractions]
+
+
+def measure(gray):
+    """
+    Returns the quality figures of a grey page, from the sample described above:
+    sharpness (variance of the 4-neighbour Laplacian), contrast (95th minus 5th percentile),
+    noise (sigma estimated from the median difference between horizontal neighbours; most
+    neighbour pairs lie on paper or inside strokes, so text edges barely move the median) and
+    bilevel (share of pixels within 16 levels of the darkest or lightest percentile).
+    """
+    if min(gray.shape) < 3:
+        return {'sharpness': 0.0, 'contrast': 0.0, 'noise': 0.0, 'bilevel': 0.0}
+    centre, left, right, up, down = _sample(gray)
+    centre_wide = centre.astype(np.int16)
+    laplacian = left + right.astype(np.int16) + up + down - 4 * centre_wide
+    dark, light, lowest, highest = _percentiles(centre, (0.05, 0.95, 0.005, 0.995))
+    difference = np.abs(right.astype(np.int16) - centre_wide).astype(np.uint8)
+    noise = _percentiles(difference, (0.5,))[0] / 0.6745 / 2 ** 0.5
+    extreme = int(np.count_nonzero((centre <= lowest + 16) | (centre >= highest - 16)))
+    return {
+        'sharpness': round(float(laplacian.var()), 1),
+        'contrast': round(light - dark, 1),
+        'noise': round(noise, 2),
+        'bilevel': round(extreme / float(centre.size), 4) if highest - lowest >= QUALITY_MIN_CONTRAST else 0.0,
+    }
+
+
+def choose_profile(figures):
+    """Maps the figures from measure() to one of PROFILES."""
+    if figures['bilevel'] >= QUALITY_BILEVEL_FRACTION and figures['noise'] <= QUALITY_MAX_CLEAN_NOISE:
+        return 'none'
+    if figures['noise'] > QUALITY_MAX_NOISE or figures['contrast'] < QUALITY_MIN_CONTRAST:
+        return 'full'
+    if (figures['noise'] <= QUALITY_MAX_CLEAN_NOISE and figures['sharpness'] >= QUALITY_MIN_SHARPNESS
+            and figures['bilevel'] >= QUALITY_LIGHT_BILEVEL_FRACTION):
+        return 'light'
+    return 'standard'
+
+
+def probe(gray):
+    """Returns {'profile', 'sharpness', 'contrast', 'noise', 'bilevel'} for a grey page."""
+    figures = measure(gray)
+    return dict(figures, profile=choose_profile(figures))
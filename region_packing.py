@@ -0,0 +1,58 @@
+import numpy as np
+
+# Crops sent to Textract are packed onto one canvas, so several regions cost a single API call.
+# Padding keeps neighbouring crops from being read as one line.
+PACK_PADDING = 12
+
+
+def clip_box(box, width, height, padding=0):
+    """Grows [left, top, width, height] by padding on every side and clips it to the image."""
+    left, top, box_width, box_height = box
+    x0, y0 = max(0, int(left) - padding), max(0, int(top) - padding)
+    x1 = min(width, int(left + box_width) + padding)
+    y1 = min(height, int(top + box_height) + padding)
+    return [x0, y0, max(0, x1 - x0), max(0, y1 - y0)]
+
+
+def union_box(boxes):
+    """Returns the smallest [left, top, width, height] containing every box."""
+    x0 = min(b[0] for b in boxes)
+    y0 = min(b[1] for b in boxes)
+    x1 = max(b[0] + b[2] for b in boxes)
+    y1 = max(b[1] + b[3] for b in boxes)
+    return [x0, y0, x1 - x0, y1 - y0]
+
+
+def pack_vertically(image, boxes, padding=PACK_PADDING):
+    """
+    Copies the crops of image at boxes onto one white canvas, stacked top to bottom.
+    Returns (canvas, slots) where slots[i] is the (top, height) of crop i on the canvas.
+    """
+    canvas_width = max(b[2] for b in boxes) + 2 * padding
+    canvas_height = sum(b[3] for b in boxes) + padding * (len(boxes) + 1)
+    canvas = np.full((canvas_height, canvas_width) + image.shape[2:], 255, dtype=image.dtype)
+
+    slots, y = [], padding
+    for left, top, width, height in boxes:
+        canvas[y:y + height, padding:padding + width] = image[top:top + height, left:left + width]
+        slots.append((y, height))
+        y += height + padding
+    return canvas, slots
+
+
+def lines_by_slot(blocks, slots, canvas_height):
+    """
+    Assigns Textract LINE blocks of a packed canvas back to the crop they came from, using the
+    vertical centre of each line. Returns {slot_index: [line text, ...]} in reading order.
+    """
+    assigned = {}
+    lines = [b for b in blocks if b.get('BlockType') == 'LINE']
+    lines.sort(key=lambda b: (b['Geometry']['BoundingBox']['Top'], b['Geometry']['BoundingBox']['Left']))
+    for line in lines:
+        box = line['Geometry']['BoundingBox']
+        centre = (box['Top'] + box['Height'] / 2) * canvas_height
+        for index, (top, height) in enumerate(slots):
+            if top - PACK_PADDING / 2 <= centre < top + height + PACK_PADDING / 2:
+                assigned.setdefault(index, []).append(line['Text'])
+                break
+    return assigned
@@ -0,0 +1,105 @@
+import os
+
+import cv2
+import numpy as np
+
+import region_packing
+import scratch_buffers
+
+# --- Configuration ---
+# A region goes to Textract when any of these says it is hard for Tesseract:
+#   contrast (grey-level gap between the paper and the stroke cores of the ink) below
+#     REGION_MIN_CONTRAST; on the benchmark pages it is 228-255 for clean and noisy print at
+#     12-28 px, and 64-102 for print faded to 25-40% of its darkness,
+#   stroke-width variation (std / mean of the ink's stroke width) above REGION_MAX_STROKE_CV,
+#     which is typical of handwriting, whereas printed text has near-constant strokes,
+#   or Tesseract's mean word confidence for the region below REGION_MIN_CONFIDENCE.
+REGION_MIN_CONTRAST = float(os.environ.get('REGION_MIN_CONTRAST', 80))
+REGION_MAX_STROKE_CV = float(os.environ.get('REGION_MAX_STROKE_CV', 0.5))
+REGION_MIN_CONFIDENCE = float(os.environ.get('REGION_MIN_CONFIDENCE', 60))
+REGION_MIN_AREA = int(os.environ.get('REGION_MIN_AREA', 400)) # Smaller blobs are specks, not text
+REGION_WORKERS = int(os.environ.get('REGION_WORKERS', os.cpu_count() or 2))
+
+
+def ink_mask(gray):
+    """
+    Marks pixels darker than their neighbourhood. Being local, it finds faint text next to dark text;
+    the blur and the opening keep scanner noise from being marked as ink.
+    """
+    ink = cv2.adaptiveThreshold(cv2.GaussianBlur(gray, (5, 5), 0), 255,
+                                cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 25, 15)
+    return cv2.morphologyEx(ink, cv2.MORPH_OPEN, np.ones((2, 2), np.uint8))
+
+
+def segment_regions(gray):
+    """
+    Finds text blocks: the ink is smeared horizontally (and a little vertically) so words and
+    lines merge, and each merged blob becomes one region.
+    Returns [left, top, width, height] boxes in reading order (top to bottom, then left to right).
+    """
+    height, width = gray.shape
+    ink = ink_mask(gray)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(9, width // 60), max(3, height // 200)))
+    smeared = cv2.dilate(ink, kernel)
+    contours, _ = cv2.findContours(smeared, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    boxes = [list(cv2.boundingRect(c)) for c in contours]
+    boxes = [b for b in boxes if b[2] * b[3] >= REGION_MIN_AREA]
+    line_height = max(1, height // 100)
+    return sorted(boxes, key=lambda b: (b[1] // line_height, b[0]))
+
+
+def region_features(gray, box):
+    """Measures the contrast and stroke-width variation of one region."""
+    left, top, width, height = box
+    crop = gray[top:top + height, left:left + width]
+    ink = ink_mask(crop)
+    if not ink.any():
+        return {'contrast': 0.0, 'stroke_cv': 0.0}
+    paper = crop[ink == 0]
+    # Most ink pixels of small print are antialiased stroke edges, so the ink level is taken from
+    # its darkest pixels (5th percentile) rather than its median
+    contrast = (np.median(paper) if paper.size else 255.0) - np.percentile(crop[ink > 0], 5)
+    # The distance transform peaks on the centre line of each stroke at half the stroke width
+    distance = cv2.distanceTransform(ink, cv2.DIST_L2, 3)
+    centre = distance[(distance > 0) & (distance >= cv2.dilate(distance, np.ones((3, 3), np.uint8)))]
+    stroke_cv = float(centre.std() / centre.mean()) if centre.size else 0.0
+    return {'contrast': float(contrast), 'stroke_cv': round(stroke_cv, 3)}
+
+
+def route_regions(gray, ocr_local, ocr_remote):
+    """
+    Segments gray into regions, reads every region locally and re-reads the hard ones remotely.
+
+    ocr_local(crop) returns (text, mean confidence) for one region crop.
+    ocr_remote(canvas) returns Textract blocks for a canvas of packed crops; it is called at most
+    once, and not at all when no region is hard.
+    Returns (text, details); region texts are joined in reading order.
+    """
+    boxes = segment_regions(gray)
+    if not boxes:
+        return "", {'regions': 0, 'hard_regions': 0, 'remote_pixel_fraction': 0.0}
+
+    features = [region_features(gray, box) for box in boxes]
+    crops = [gray[t:t + h, l:l + w] for l, t, w, h in boxes]
+    local_results = scratch_buffers.map_crops(ocr_local, crops, limit=REGION_WORKERS)
+
+    texts = [text for text, _ in local_results]
+    hard = [i for i, ((text, confidence), f) in enumerate(zip(local_results, features))
+            if f['contrast'] < REGION_MIN_CONTRAST or f['stroke_cv'] > REGION_MAX_STROKE_CV
+            or confidence < REGION_MIN_CONFIDENCE]
+
+    if hard:
+        height, width = gray.shape
+        padded = [region_packing.clip_box(boxes[i], width, height, padding=4) for i in hard]
+        canvas, slots = region_packing.pack_vertically(gray, padded)
+        blocks = ocr_remote(canvas)
+        for slot, lines in region_packing.lines_by_slot(blocks, slots, canvas.shape[0]).items():
+            texts[hard[slot]] = "\n".join(lines)
+
+    remote_pixels = sum(boxes[i][2] * boxes[i][3] for i in hard)
+    details = {
+        'regions': len(boxes),
+        'hard_regions': len(hard),
+        'remote_pixel_fraction': round(remote_pixels / float(gray.size), 4),
+    }
+    return "\n\n".join(t.strip() for t in texts if t.strip()), details
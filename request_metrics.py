@@ -0,0 +1,244 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from tracing import start_span
+
+# --- Per-request stage timing ---
+
+# Upper bounds (in megapixels) of the image-size buckets used as a metric label here and as
+# an EMF dimension in the Lambda (see emf_metrics.py)
+SIZE_BUCKETS_MP = (1, 4, 16, 64)
+
+# Histogram bucket upper bounds in seconds, spanning fast decodes up to slow Textract calls
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+# Histogram bucket upper bounds in bytes for memory usage, 16 MB to 4 GB
+MEMORY_BUCKETS = tuple(2**20 * mb for mb in (16, 32, 64, 128, 256, 512, 1024, 2048, 4096))
+
+try:
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+
+def current_rss():
+    """Resident set size of this process in bytes, or None where /proc is unavailable (not Linux)."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def size_bucket(pixel_count):
+    """Maps a pixel count to a low-cardinality label value such as '1-4MP'."""
+    if not pixel_count:
+        return 'unknown'
+    megapixels = pixel_count / 1_000_000
+    lower = 0
+    for upper in SIZE_BUCKETS_MP:
+        if megapixels < upper:
+            return f"{lower}-{upper}MP"
+        lower = upper
+    return f">{lower}MP"
+
+
+class RequestTimer:
+    """
+    Records how long each stage of one request takes (in the order the stages ran).
+    current_stage names the stage in progress (it stays set if the stage raises),
+    so errors can be attributed to it via failed_stage. If a trace is given, every stage
+    is also exported as a span of that trace.
+    The process RSS is sampled when the request starts and after every stage: peak_rss is
+    the highest sample, and rss_growth how far it rose above the starting RSS during this
+    request. Both are approximate: memory allocated and freed within one stage is missed,
+    so the true peak can be higher, and RSS is shared by concurrent requests, so growth is
+    attributed to whichever requests happen to be sampling.
+    preprocessing holds the page-crop, orientation and quality-probe decisions, if any were
+    made (see page_crop.py, deskew.py and quality_probe.py).
+    """
+
+    def __init__(self, trace=None):
+        self.trace = trace
+        self.timings = OrderedDict()
+        self.current_stage = None
+        self.failed_stage = None
+        self.pixel_count = None
+        self.preprocessing = None
+        self.start_rss = self.peak_rss = current_rss()
+        self.started_at = time.time() # Wall-clock arrival time
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        self.current_stage = name
+        start = time.perf_counter()
+        try:
+            with start_span(name, self.trace) if self.trace else nullcontext():
+                yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + (time.perf_counter() - start)
+            rss = current_rss()
+            if rss is not None:
+                self.peak_rss = max(self.peak_rss or 0, rss)
+        self.current_stage = None
+
+    def merge(self, other):
+        """
+        Adds the stages another timer of the same request recorded (e.g. on a worker thread) to this
+        one. Call it only once the other timer's work has finished.
+        """
+        for name, seconds in other.timings.items():
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+        self.failed_stage = self.failed_stage or other.failed_stage or other.current_stage
+        self.pixel_count = self.pixel_count or other.pixel_count
+        self.preprocessing = self.preprocessing or other.preprocessing
+        if other.peak_rss is not None:
+            self.peak_rss = max(self.peak_rss or 0, other.peak_rss)
+
+    def rss_growth(self):
+        """Bytes the process RSS rose above its value at the start of the request (None if unknown)."""
+        if self.start_rss is None or self.peak_rss is None:
+            return None
+        return self.peak_rss - self.start_rss
+
+    def total_seconds(self):
+        return time.perf_counter() - self._start
+
+    def server_timing_header(self):
+        """Formats the stage durations as a Server-Timing header value (durations in milliseconds)."""
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.timings.items()]
+        entries.append(f"total;dur={self.total_seconds() * 1000:.1f}")
+        return ", ".join(entries)
+
+
+# --- Prometheus metrics ---
+# Metrics live in process memory; with several worker processes each one exposes its own series.
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = ('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+
+class Counter:
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def render(self, metric_type='counter'):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {metric_type}"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def render(self):
+        return super().render(metric_type='gauge')
+
+
+class Histogram:
+    def __init__(self, name, documentation, label_names=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {} # label values -> [per-bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, series in sorted(self._series.items()):
+                for i, upper in enumerate(self.buckets):
+                    labels = _format_labels(self.label_names, label_values, ('le', repr(float(upper))))
+                    lines.append(f"{self.name}_bucket{labels} {series[i]}")
+                labels = _format_labels(self.label_names, label_values, ('le', '+Inf'))
+                lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+                labels = _format_labels(self.label_names, label_values)
+                lines.append(f"{self.name}_sum{labels} {series[-2]}")
+                lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+STAGE_DURATION = Histogram(
+    'ocr_stage_duration_seconds', 'Duration of each OCR request stage.', ('stage', 'engine', 'size_bucket'))
+REQUEST_DURATION = Histogram(
+    'ocr_request_duration_seconds', 'End-to-end duration of /upload requests.', ('engine', 'size_bucket'))
+REQUESTS_TOTAL = Counter(
+    'ocr_requests_total', 'Completed /upload requests by outcome.', ('engine', 'status'))
+REQUEST_ERRORS = Counter(
+    'ocr_request_errors_total', 'Failed /upload requests by the stage that failed.', ('engine', 'stage'))
+IN_FLIGHT = Gauge(
+    'ocr_requests_in_flight', 'Requests currently being processed.', ('engine',))
+# Escalation rate of the auto model: sum of the textract_* routes divided by the total
+AUTO_ROUTES = Counter(
+    'ocr_auto_routes_total', 'Auto-model requests by the route taken (tesseract, textract_page, textract_regions).',
+    ('route',))
+COALESCED_REQUESTS = Counter(
+    'ocr_coalesced_requests_total', 'Requests answered by an identical request already in flight.', ('engine',))
+PREPROCESSING_PROFILES = Counter(
+    'ocr_preprocessing_profiles_total', 'Pages by the preprocessing profile the quality probe chose (none, light, standard, full).',
+    ('profile',))
+REQUEST_PEAK_RSS = Histogram(
+    'ocr_request_peak_rss_bytes', 'Highest process RSS sampled at the stage ends of each /upload request (approximate).',
+    ('engine', 'size_bucket'), buckets=MEMORY_BUCKETS)
+REQUEST_RSS_GROWTH = Histogram(
+    'ocr_request_rss_growth_bytes', 'How far the process RSS rose above its starting value by the stage ends of each /upload request (approximate).',
+    ('engine', 'size_bucket'), buckets=MEMORY_BUCKETS)
+
+REGISTRY = [STAGE_DURATION, REQUEST_DURATION, REQUESTS_TOTAL, REQUEST_ERRORS, IN_FLIGHT, AUTO_ROUTES, COALESCED_REQUESTS,
+            PREPROCESSING_PROFILES, REQUEST_PEAK_RSS, REQUEST_RSS_GROWTH]
+
+
+def record_request(timer, engine, status):
+    """Folds a finished request's stage timings into the histograms and counters."""
+    bucket = size_bucket(timer.pixel_count)
+    for stage, seconds in timer.timings.items():
+        STAGE_DURATION.observe(seconds, stage, engine, bucket)
+    REQUEST_DURATION.observe(timer.total_seconds(), engine, bucket)
+    REQUESTS_TOTAL.inc(engine, str(status))
+    if timer.peak_rss is not None:
+        REQUEST_PEAK_RSS.observe(timer.peak_rss, engine, bucket)
+        REQUEST_RSS_GROWTH.observe(timer.rss_growth(), engine, bucket)
+
+
+def render_metrics():
+    """Renders every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
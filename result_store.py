@@ -0,0 +1,116 @@
+import os
+import json
+import gzip
+import zlib
+import logging
+from contextlib import nullcontext
+
+logger = logging.getLogger()
+
+# --- Configuration ---
+# Results whose compressed text is at most this many bytes are stored inline on the
+# DynamoDB job item. Anything larger goes to S3 and only a pointer is kept on the item.
+# DynamoDB items are capped at 400 KB, so keep this well below that.
+RESULT_INLINE_MAX_BYTES = int(os.environ.get('RESULT_INLINE_MAX_BYTES', 32 * 1024))
+RESULTS_PREFIX = os.environ.get('RESULTS_PREFIX', 'ocr-results/')
+# Number of leading characters kept on the item as a preview when the result is offloaded to S3
+RESULT_SUMMARY_CHARS = int(os.environ.get('RESULT_SUMMARY_CHARS', 280))
+
+STORAGE_INLINE = 'INLINE'
+STORAGE_S3 = 'S3'
+
+
+def extract_words(blocks):
+    """
+    Converts Textract WORD blocks into a compact list of words with their
+    confidence and bounding box ([left, top, width, height], normalized 0..1).
+    """
+    words = []
+    for block in blocks or []:
+        if block.get('BlockType') != 'WORD':
+            continue
+        box = block.get('Geometry', {}).get('BoundingBox', {})
+        words.append({
+            'text': block.get('Text', ''),
+            'confidence': round(float(block.get('Confidence', 0.0)), 2),
+            'bbox': [round(float(box.get(k, 0.0)), 5) for k in ('Left', 'Top', 'Width', 'Height')],
+        })
+    return words
+
+
+def build_result_attributes(s3_client, bucket_name, job_id, extracted_text, blocks=None, words=None, timer=None):
+    """
+    Prepares the DynamoDB attributes describing an OCR result.
+    Small results are zlib-compressed into a binary attribute. Large results are written to
+    S3 as gzip-compressed JSON (text plus word-level data) and the item keeps a pointer and a summary.
+    Word-level data is taken from words if given, otherwise extracted from the Textract blocks.
+    The S3 offload is recorded as the 'offload' stage on timer if one is given.
+    Returns a dict of attribute name -> DynamoDB typed value.
+    """
+    compressed_text = zlib.compress(extracted_text.encode('utf-8'))
+    attributes = {
+        'text_length': {'N': str(len(extracted_text))},
+    }
+
+    if len(compressed_text) <= RESULT_INLINE_MAX_BYTES:
+        attributes['result_storage'] = {'S': STORAGE_INLINE}
+        attributes['extracted_text_z'] = {'B': compressed_text}
+        return attributes
+
+    if words is None:
+        words = extract_words(blocks)
+    result_s3_key = f"{RESULTS_PREFIX}{job_id}.json.gz"
+    with timer.stage('offload') if timer else nullcontext():
+        document = json.dumps({'job_id': job_id, 'text': extracted_text, 'words': words}, separators=(',', ':'))
+        s3_client.put_object(
+            Bucket=bucket_name,
+            Key=result_s3_key,
+            Body=gzip.compress(document.encode('utf-8')),
+            ContentType='application/json',
+            ContentEncoding='gzip'
+        )
+    logger.info(f"Result for job_id {job_id} offloaded to s3://{bucket_name}/{result_s3_key}")
+
+    attributes['result_storage'] = {'S': STORAGE_S3}
+    attributes['result_s3_bucket'] = {'S': bucket_name}
+    attributes['result_s3_key'] = {'S': result_s3_key}
+    attributes['text_summary'] = {'S': extracted_text[:RESULT_SUMMARY_CHARS]}
+    attributes['word_count'] = {'N': str(len(words))}
+    return attributes
+
+
+def read_result(s3_client, item):
+    """
+    Decodes the OCR result from a DynamoDB job item (as returned by get_item).
+    Handles inline compressed results, S3-offloaded results and items written before
+    results were compressed. Returns a dict with 'text' and 'words' (None when not stored).
+    """
+    storage = item.get('result_storage', {}).get('S')
+
+    if storage == STORAGE_S3:
+        response = s3_client.get_object(Bucket=item['result_s3_bucket']['S'], Key=item['result_s3_key']['S'])
+        document = json.loads(gzip.decompress(response['Body'].read()).decode('utf-8'))
+        return {'text': document.get('text', ''), 'words': document.get('words')}
+
+    if storage == STORAGE_INLINE:
+        return {'text': zlib.decompress(bytes(item['extracted_text_z']['B'])).decode('utf-8'), 'words': None}
+
+    # Legacy items stored the plain text as a string attribute
+    return {'text': item.get('extracted_text', {}).get('S', ''), 'words': None}
+
+
+def load_result(dynamodb_client, s3_client, table_name, job_id):
+    """Fetches a job item from DynamoDB and returns its status together with the decoded result."""
+    response = dynamodb_client.get_item(TableName=table_name, Key={'job_id': {'S': job_id}})
+    item = response.get('Item')
+    if not item:
+        return None
+
+    result = {'job_id': job_id, 'status': item.get('status', {}).get('S')}
+    if result['status'] == 'COMPLETED':
+        result.update(read_result(s3_client, item))
+        if 'preprocessing' in item: # Page crop, orientation and quality profile chosen by the Lambda
+            result['preprocessing'] = json.loads(item['preprocessing']['S'])
+    elif 'error_message' in item:
+        result['error_message'] = item['error_message']['S']
+    return result
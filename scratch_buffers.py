@@ -0,0 +1,60 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# --- Configuration ---
+# Per-thread scratch arrays for the crop/tile workers. A worker that preprocesses many crops
+# (text blocks, regions, tiles) reuses one backing buffer per name instead of allocating
+# (and page-faulting in) a fresh array for every crop. A buffer only ever grows: it is
+# sized to the largest crop the thread has seen, and is freed when the thread exits.
+# The workers are one pool of CROP_WORKERS threads that lives as long as the process and is
+# shared by all requests (see map_crops()), so the buffers carry over from one request to the
+# next; a pool per request would start new threads, and new buffers, every time.
+CROP_WORKERS = int(os.environ.get('CROP_WORKERS', os.cpu_count() or 2))
+
+_local = threading.local()
+_pool = ThreadPoolExecutor(max_workers=CROP_WORKERS, thread_name_prefix='crop-worker')
+
+
+def scratch(name, shape, dtype=np.uint8):
+    """
+    Returns an uninitialised C-contiguous array of shape backed by this thread's buffer for name.
+    The contents are only valid until the same thread asks for name again.
+    """
+    buffers = getattr(_local, 'buffers', None)
+    if buffers is None:
+        buffers = _local.buffers = {}
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape)) * dtype.itemsize
+    backing = buffers.get(name)
+    if backing is None or backing.size < size:
+        backing = buffers[name] = np.empty(size, np.uint8)
+    return backing[:size].view(dtype).reshape(shape)
+
+
+def map_crops(function, items, limit=None):
+    """
+    Returns [function(item) for item in items], computed on the shared crop workers with at
+    most limit items of this call in flight at once (as many as there are workers by default).
+    Raises the first exception of function, once every item has finished. Must not be called
+    from a crop worker: a worker waiting for the pool could wait for itself.
+    """
+    items = list(items)
+    if limit is None or limit >= len(items):
+        return list(_pool.map(function, items))
+
+    gate = threading.BoundedSemaphore(max(1, limit))
+
+    def run(item):
+        try:
+            return function(item)
+        finally:
+            gate.release()
+
+    futures = []
+    for item in items:
+        gate.acquire()
+        futures.append(_pool.submit(run, item))
+    return [future.result() for future in futures]
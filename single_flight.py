@@ -0,0 +1,92 @@
+import os
+import hashlib
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+# --- Configuration ---
+# Identical requests (same image bytes, engine and parameters) that overlap in time share one
+# execution. A waiter gives up after COALESCE_WAIT_SECONDS; the shared work is abandoned only
+# once every waiter has given up. Finished results are not kept: this is not a cache.
+COALESCE_ENABLED = os.environ.get('COALESCE_ENABLED', 'true').lower() == 'true'
+COALESCE_WAIT_SECONDS = float(os.environ.get('COALESCE_WAIT_SECONDS', 300))
+
+
+class Abandoned(Exception):
+    """Raised inside shared work (via Flight.check_cancelled) once nobody is waiting for it."""
+
+
+def coalescing_key(image_bytes, engine, parameters=None):
+    """Content hash plus engine plus any parameters that change the result."""
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    extra = ";".join(f"{name}={value}" for name, value in sorted((parameters or {}).items()))
+    return f"{digest}:{engine}:{extra}"
+
+
+class Flight:
+    """One in-flight execution and the requests waiting for it."""
+
+    def __init__(self, key):
+        self.key = key
+        self.future = Future()
+        self.waiters = 0
+        self.cancel_event = threading.Event()
+
+    def check_cancelled(self):
+        """Called by the work between stages; raises Abandoned once every waiter has left."""
+        if self.cancel_event.is_set():
+            raise Abandoned(f"all waiters left {self.key}")
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def join(self, key, function):
+        """
+        Attaches the caller to the in-flight execution for key, starting function(flight) on a
+        background thread if there is none. The work runs on its own thread so that it does not
+        depend on the first caller staying around. Returns (flight, is_leader); every join must
+        be paired with one wait().
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight(key)
+            flight.waiters += 1
+        if leader:
+            threading.Thread(target=self._run, args=(flight, function), name='single-flight', daemon=True).start()
+        return flight, leader
+
+    def wait(self, flight, timeout=COALESCE_WAIT_SECONDS):
+        """Returns the shared result (or raises the shared error); raises TimeoutError after timeout."""
+        try:
+            return flight.future.result(timeout)
+        except FutureTimeoutError:
+            raise TimeoutError(f"no result for {flight.key} after {timeout}s") # Distinct classes before Python 3.11
+        finally:
+            self._leave(flight)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
+
+    def _leave(self, flight):
+        with self._lock:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.future.done():
+                flight.cancel_event.set()
+                # A new identical request must start fresh rather than join work being abandoned
+                if self._flights.get(flight.key) is flight:
+                    del self._flights[flight.key]
+
+    def _run(self, flight, function):
+        try:
+            flight.future.set_result(function(flight))
+        except BaseException as e:
+            flight.future.set_exception(e)
+        finally:
+            with self._lock:
+                if self._flights.get(flight.key) is flight:
+                    del self._flights[flight.key]
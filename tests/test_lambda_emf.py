@@ -0,0 +1,104 @@
+"""
+The CloudWatch Embedded Metric Format records lambda_function.py prints for the original and the
+per-page path, run against the in-process AWS stand-ins of loadtest/local_aws.py.
+
+    python -m pytest tests
+"""
+import contextlib
+import io
+import json
+import os
+import unittest
+from unittest import mock
+
+# lambda_function creates boto3 clients at import time, which need a region
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import numpy as np
+from PIL import Image
+
+import emf_metrics
+import lambda_function
+import quality_probe
+from request_metrics import size_bucket
+
+from loadtest.local_aws import LocalAWS
+
+BUCKET = 'loadtest-bucket'
+TABLE = 'loadtest-jobs'
+JOB_ID = '12345678-1234-1234-1234-123456789abc'
+
+
+def encoded(images, image_format):
+    buffer = io.BytesIO()
+    images[0].save(buffer, format=image_format, save_all=len(images) > 1, append_images=images[1:])
+    return buffer.getvalue()
+
+
+def page(width, height):
+    return Image.fromarray(np.full((height, width), 255, np.uint8))
+
+
+class EmfRecordTest(unittest.TestCase):
+
+    def setUp(self):
+        self.aws = LocalAWS()
+        self.aws.install(lambda_module=lambda_function, bucket_name=BUCKET, table_name=TABLE)
+
+    def handle(self, key):
+        """Runs the handler on the object at key and returns the EMF records it printed."""
+        size = len(self.aws.s3.objects[(BUCKET, key)]['Body'])
+        event = {'Records': [{'s3': {'bucket': {'name': BUCKET}, 'object': {'key': key, 'size': size}}}]}
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            self.assertEqual(lambda_function.lambda_handler(event, None)['statusCode'], 200)
+        return [json.loads(line) for line in stdout.getvalue().splitlines() if line.startswith('{"_aws"')]
+
+    def assertMetrics(self, record, stages, image_bytes, pixel_count):
+        directive, = record['_aws']['CloudWatchMetrics']
+        self.assertEqual(directive['Namespace'], emf_metrics.METRICS_NAMESPACE)
+        self.assertEqual(directive['Dimensions'], [['FunctionName'], ['FunctionName', 'SizeBucket']])
+        names = {metric['Name'] for metric in directive['Metrics']}
+        for stage in stages:
+            self.assertIn(emf_metrics.metric_name(stage), names)
+            self.assertIn(emf_metrics.metric_name(stage), record)
+        self.assertEqual(record['SizeBucket'], size_bucket(pixel_count))
+        self.assertNotEqual(record['SizeBucket'], 'unknown')
+        self.assertEqual(record['ImageBytes'], image_bytes)
+        self.assertAlmostEqual(record['Megapixels'], pixel_count / 1_000_000, places=4)
+        self.assertGreater(record['BlockCount'], 0)
+
+    def test_a_single_image_reports_its_size_and_stages(self):
+        key = f"original-images/{JOB_ID}-scan.png"
+        body = encoded([page(800, 1000)], 'PNG')
+        self.aws.s3.put_object(Bucket=BUCKET, Key=key, Body=body)
+
+        record, = self.handle(key)
+        self.assertEqual(record['path'], 'record')
+        self.assertMetrics(record, ('download', 'textract', 'dynamodb'), len(body), 800 * 1000)
+        self.assertNotIn('profile', record) # The quality probe is off by default
+
+    def test_the_quality_profile_is_a_property_not_a_dimension(self):
+        key = f"original-images/{JOB_ID}-scan.png"
+        self.aws.s3.put_object(Bucket=BUCKET, Key=key, Body=encoded([page(800, 1000)], 'PNG'))
+
+        with mock.patch.object(quality_probe, 'QUALITY_PROBE', True):
+            record, = self.handle(key)
+        self.assertIn(record['profile'], quality_probe.PROFILES)
+        dimensions = record['_aws']['CloudWatchMetrics'][0]['Dimensions']
+        self.assertNotIn('profile', {name for dimension_set in dimensions for name in dimension_set})
+
+    def test_a_page_reports_its_own_size(self):
+        key = f"original-images/{JOB_ID}-scan.tif"
+        self.aws.s3.put_object(Bucket=BUCKET, Key=key, Body=encoded([page(400, 500), page(400, 1000)], 'TIFF'))
+        self.handle(key)
+
+        page_key = lambda_function.page_s3_key(JOB_ID, 1)
+        page_bytes = len(self.aws.s3.objects[(BUCKET, page_key)]['Body'])
+        record, = self.handle(page_key)
+        self.assertEqual(record['path'], 'page')
+        self.assertMetrics(record, ('textract', 'dynamodb'), page_bytes, 400 * 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
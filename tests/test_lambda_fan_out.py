@@ -0,0 +1,137 @@
+"""
+The multi-page flow of lambda_function.py (split -> per-page Textract -> aggregate) against the
+in-process AWS stand-ins of loadtest/local_aws.py, so no AWS account or network is needed.
+
+    python -m pytest tests
+"""
+import io
+import os
+import unittest
+
+# lambda_function creates boto3 clients at import time, which need a region
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import numpy as np
+from PIL import Image
+
+import lambda_function
+from botocore.exceptions import ClientError
+
+from loadtest.local_aws import LocalAWS, FaultProfile
+from result_store import load_result
+
+BUCKET = 'loadtest-bucket'
+TABLE = 'loadtest-jobs'
+JOB_ID = '12345678-1234-1234-1234-123456789abc'
+ORIGINAL_KEY = f"original-images/{JOB_ID}-scan.tif"
+PAGE_COUNT = 3
+
+
+def multi_page_tiff(page_count):
+    """A TIFF whose pages differ in height, so the stand-in Textract reads a different line count per page."""
+    pages = [Image.fromarray(np.full((500 * (i + 1), 400), 255, np.uint8)) for i in range(page_count)]
+    buffer = io.BytesIO()
+    pages[0].save(buffer, format='TIFF', save_all=True, append_images=pages[1:])
+    return buffer.getvalue()
+
+
+def s3_event(key):
+    return {'Records': [{'s3': {'bucket': {'name': BUCKET}, 'object': {'key': key}}}]}
+
+
+class FanOutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.aws = LocalAWS()
+        self.aws.install(lambda_module=lambda_function, bucket_name=BUCKET, table_name=TABLE)
+        self.aws.s3.put_object(Bucket=BUCKET, Key=ORIGINAL_KEY, Body=multi_page_tiff(PAGE_COUNT))
+
+    def job(self):
+        return load_result(self.aws.dynamodb, self.aws.s3, TABLE, JOB_ID)
+
+    def page_keys(self):
+        return [lambda_function.page_s3_key(JOB_ID, i) for i in range(PAGE_COUNT)]
+
+    def split(self):
+        response = lambda_function.lambda_handler(s3_event(ORIGINAL_KEY), None)
+        self.assertEqual(response['statusCode'], 200)
+
+    def test_split_writes_one_object_per_page(self):
+        self.split()
+        for key in self.page_keys():
+            self.assertIn((BUCKET, key), self.aws.s3.objects)
+        self.assertEqual(self.job()['status'], 'PROCESSING')
+
+    def test_pages_are_aggregated_in_order_once_all_are_done(self):
+        self.split()
+        for key in self.page_keys():
+            self.assertEqual(lambda_function.lambda_handler(s3_event(key), None)['statusCode'], 200)
+
+        job = self.job()
+        self.assertEqual(job['status'], 'COMPLETED')
+        pages = job['text'].split(lambda_function.PAGE_SEPARATOR)
+        line_counts = [len(page.splitlines()) for page in pages]
+        self.assertEqual(len(pages), PAGE_COUNT)
+        self.assertTrue(line_counts[0] < line_counts[1] < line_counts[2], line_counts) # Taller pages come later
+        for key in self.page_keys():
+            self.assertNotIn((BUCKET, key), self.aws.s3.objects) # Work objects are cleaned up
+
+    def test_duplicate_page_events_are_counted_once(self):
+        self.split()
+        first, *rest = self.page_keys()
+        for key in [first, first] + rest[:-1]:
+            lambda_function.lambda_handler(s3_event(key), None)
+        self.assertEqual(self.job()['status'], 'PROCESSING') # The duplicate did not stand in for the last page
+
+        lambda_function.lambda_handler(s3_event(rest[-1]), None)
+        self.assertEqual(self.job()['status'], 'COMPLETED')
+
+    def test_redelivered_last_page_retries_a_failed_fan_in(self):
+        self.split()
+        for key in self.page_keys()[:-1]:
+            lambda_function.lambda_handler(s3_event(key), None)
+
+        aggregate_pages = lambda_function.aggregate_pages
+        def failing_aggregate(*args):
+            raise RuntimeError("injected fan-in failure")
+        lambda_function.aggregate_pages = failing_aggregate
+        try:
+            response = lambda_function.lambda_handler(s3_event(self.page_keys()[-1]), None)
+        finally:
+            lambda_function.aggregate_pages = aggregate_pages
+        self.assertEqual(response['statusCode'], 500)
+        self.assertEqual(self.job()['status'], 'FAILED')
+
+        # S3 redelivers the event of the last page, which is already counted
+        self.assertEqual(lambda_function.lambda_handler(s3_event(self.page_keys()[-1]), None)['statusCode'], 200)
+        job = self.job()
+        self.assertEqual(job['status'], 'COMPLETED')
+        self.assertEqual(len(job['text'].split(lambda_function.PAGE_SEPARATOR)), PAGE_COUNT)
+
+    def test_a_throttled_page_is_retried_instead_of_failing_the_job(self):
+        self.split()
+        first, *rest = self.page_keys()
+        self.aws.textract.faults = FaultProfile(throttle_rate=1.0)
+        with self.assertRaises(ClientError): # Raised out of the handler, so Lambda retries the event
+            lambda_function.lambda_handler(s3_event(first), None)
+        self.assertEqual(self.job()['status'], 'PROCESSING')
+
+        self.aws.textract.faults = FaultProfile()
+        for key in [first] + rest: # Lambda's retry of the throttled page, then the other pages
+            self.assertEqual(lambda_function.lambda_handler(s3_event(key), None)['statusCode'], 200)
+        self.assertEqual(self.job()['status'], 'COMPLETED')
+
+    def test_splitting_a_completed_job_again_leaves_it_completed(self):
+        self.split()
+        for key in self.page_keys():
+            lambda_function.lambda_handler(s3_event(key), None)
+
+        # A record resumed after a hand-off reaches the split once more
+        self.split()
+        self.assertEqual(self.job()['status'], 'COMPLETED')
+        for key in self.page_keys():
+            self.assertNotIn((BUCKET, key), self.aws.s3.objects)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+"""
+Where page_bands.py cuts a page into bands, and how the band texts are to be joined again.
+
+    python -m pytest tests
+"""
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import page_bands
+
+
+def page_of_paragraphs(paragraphs=3, lines=6):
+    """A thresholded page of 20px text lines 15px apart, with 75px between paragraphs."""
+    page = np.full((1000, 800), 255, np.uint8)
+    top = 40
+    for _ in range(paragraphs):
+        for _ in range(lines):
+            page[top:top + 20, 50:750:3] = 0
+            top += 35
+        top += 60
+    return page
+
+
+class BandRangesTest(unittest.TestCase):
+
+    def test_cuts_between_paragraphs_are_joined_with_a_blank_line(self):
+        with mock.patch.object(page_bands, 'OCR_BAND_MIN_HEIGHT', 20):
+            ranges, separators = page_bands.band_ranges(page_of_paragraphs(), 40)
+        self.assertEqual(len(separators), len(ranges) - 1)
+        paragraph_cuts = [top for (top, _), separator in zip(ranges[1:], separators)
+                          if separator == page_bands.PARAGRAPH_SEPARATOR]
+        self.assertEqual(len(paragraph_cuts), 2)
+        for cut in paragraph_cuts:
+            self.assertTrue(235 <= cut < 310 or 505 <= cut < 580, cut)
+        self.assertIn(page_bands.LINE_SEPARATOR, separators)
+
+    def test_a_single_band_has_no_separators(self):
+        self.assertEqual(page_bands.band_ranges(page_of_paragraphs(), 1), ([(0, 1000)], []))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+"""
+When page_crop.py takes a quadrilateral for a photographed page, and when it leaves the image alone.
+
+    python -m pytest tests
+"""
+import unittest
+
+import cv2
+import numpy as np
+
+import page_crop
+from benchmarks.synthetic_docs import render_document
+
+
+def scanned_page():
+    """A flat grey scan of a text page."""
+    image, _ = render_document(1000, 1400, font_px=20)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+def photographed(page, background, size, corners):
+    """page warped onto corners of a size (width, height) photo of a flat background."""
+    height, width = page.shape
+    source = np.float32([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]])
+    matrix = cv2.getPerspectiveTransform(source, np.float32(corners))
+    return cv2.warpPerspective(page, matrix, size, borderMode=cv2.BORDER_CONSTANT, borderValue=background)
+
+
+class DetectQuadTest(unittest.TestCase):
+
+    def test_a_bordered_box_on_a_flat_scan_is_left_alone(self):
+        page = scanned_page()
+        cv2.rectangle(page, (150, 200), (850, 1100), 0, 4)
+        self.assertIsNone(page_crop.detect_quad(page))
+
+    def test_a_page_on_a_darker_desk_is_found(self):
+        corners = [[260, 140], [1020, 190], [980, 1260], [210, 1200]]
+        photo = photographed(scanned_page(), 90, (1200, 1400), corners)
+        found = page_crop.detect_quad(photo)
+        self.assertIsNotNone(found)
+        self.assertLess(np.abs(found - np.float32(corners)).max(), 25)
+
+    def test_a_page_filling_the_photo_is_found(self):
+        corners = [[20, 15], [1180, 30], [1170, 1385], [30, 1370]]
+        photo = photographed(scanned_page(), 90, (1200, 1400), corners)
+        self.assertIsNotNone(page_crop.detect_quad(photo))
+
+
+if __name__ == '__main__':
+    unittest.main()
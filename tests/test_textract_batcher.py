@@ -0,0 +1,50 @@
+"""
+How textract_batcher.py lays images out on a mosaic and hands Textract's blocks back to them.
+
+    python -m pytest tests
+"""
+import unittest
+
+import numpy as np
+
+import textract_batcher
+
+
+class MosaicTest(unittest.TestCase):
+
+    def setUp(self):
+        self.canvas, self.placements = textract_batcher.build_mosaic(
+            [np.zeros((100, 300), np.uint8), np.zeros((50, 200), np.uint8)])
+        self.canvas_size = (self.canvas.shape[1], self.canvas.shape[0])
+
+    def block(self, block_type, block_id, text, x, y, width, height):
+        canvas_width, canvas_height = self.canvas_size
+        block = {'BlockType': block_type, 'Id': block_id, 'Text': text, 'Confidence': 90.0,
+                 'Geometry': {'BoundingBox': {'Left': x / canvas_width, 'Top': y / canvas_height,
+                                              'Width': width / canvas_width, 'Height': height / canvas_height}}}
+        return block
+
+    def test_images_are_stacked_without_sharing_rows(self):
+        (_, top0, _, height0), (_, top1, _, _) = self.placements
+        self.assertGreater(top1, top0 + height0)
+
+    def test_a_line_read_across_two_images_is_split_by_its_words(self):
+        (x0, y0, _, _), (x1, y1, _, _) = self.placements
+        blocks = [
+            self.block('LINE', 'line', 'first second', x0, y0 + 10, 60, y1 + 20 - y0),
+            self.block('WORD', 'first', 'first', x0, y0 + 10, 40, 10),
+            self.block('WORD', 'second', 'second', x1, y1 + 20, 40, 10),
+        ]
+        blocks[0]['Relationships'] = [{'Type': 'CHILD', 'Ids': ['first', 'second']}]
+
+        per_image = textract_batcher.split_blocks(blocks, self.placements, self.canvas_size)
+        for image_blocks, word in zip(per_image, ('first', 'second')):
+            lines = [b for b in image_blocks if b['BlockType'] == 'LINE']
+            self.assertEqual([line['Text'] for line in lines], [word])
+            self.assertEqual(lines[0]['Relationships'], [{'Type': 'CHILD', 'Ids': [word]}])
+            box = lines[0]['Geometry']['BoundingBox']
+            self.assertTrue(0 <= box['Top'] < 1 and 0 < box['Height'] <= 1, box)
+
+
+if __name__ == '__main__':
+    unittest.main()
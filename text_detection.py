@@ -0,0 +1,107 @@
+import os
+import threading
+
+import cv2
+import numpy as np
+
+# --- Configuration ---
+# TEXT_DETECTION selects how text is located before OCR: 'off' (OCR the whole page), 'morph'
+# (gradient + closing), 'mser' (stable extremal regions) or 'db' (cv2.dnn.TextDetectionModel_DB
+# with the ONNX model at TEXT_DETECTION_MODEL, e.g. DB_TD500_resnet18.onnx from the OpenCV zoo;
+# 'morph' is used if the model file is missing). Detection runs on a copy whose longer side is at
+# most TEXT_DETECTION_MAX_SIDE. When the detected boxes cover more than
+# TEXT_DETECTION_MAX_COVERAGE of the page, the page is dense and is OCR'd whole instead.
+TEXT_DETECTION = os.environ.get('TEXT_DETECTION', 'off').lower()
+TEXT_DETECTION_MODEL = os.environ.get('TEXT_DETECTION_MODEL', 'models/DB_TD500_resnet18.onnx')
+TEXT_DETECTION_MAX_SIDE = int(os.environ.get('TEXT_DETECTION_MAX_SIDE', 1280))
+TEXT_DETECTION_MAX_COVERAGE = float(os.environ.get('TEXT_DETECTION_MAX_COVERAGE', 0.5))
+TEXT_DETECTION_PADDING = 6 # Pixels (at full resolution) kept around each detected block
+
+_db_model = None
+_db_lock = threading.Lock() # cv2.dnn models are not safe to call from several threads at once
+
+
+def _candidate_mask_morph(gray):
+    """Marks character-like blobs: strong local gradients, closed horizontally into words."""
+    gradient = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+    _, edges = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    closed = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (9, 1)))
+    # RETR_LIST rather than EXTERNAL: text inside a framed box (a sign, a label) is its own candidate
+    contours, _ = cv2.findContours(closed, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    mask = np.zeros_like(gray)
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if h < 6 or w < 6 or h > gray.shape[0] // 4:
+            continue
+        # Text fills a good part of its box with edges; photo textures and long rules do not
+        fill = cv2.countNonZero(edges[y:y + h, x:x + w]) / float(w * h)
+        if 0.2 <= fill <= 0.9 and w / float(h) < 40:
+            mask[y:y + h, x:x + w] = 255
+    return mask
+
+
+def _candidate_mask_mser(gray):
+    mser = cv2.MSER_create()
+    mser.setMinArea(20)
+    mser.setMaxArea(max(100, gray.size // 200))
+    _, boxes = mser.detectRegions(gray)
+    mask = np.zeros_like(gray)
+    for x, y, w, h in boxes:
+        if 0.1 < w / float(h) < 10: # Character-shaped regions
+            mask[y:y + h, x:x + w] = 255
+    return mask
+
+
+def _load_db_model():
+    global _db_model
+    if _db_model is None:
+        model = cv2.dnn.TextDetectionModel_DB(TEXT_DETECTION_MODEL)
+        model.setBinaryThreshold(0.3).setPolygonThreshold(0.5).setMaxCandidates(200).setUnclipRatio(2.0)
+        model.setInputParams(1.0 / 255, (736, 736), (122.67891434, 116.66876762, 104.00698793))
+        _db_model = model
+    return _db_model
+
+
+def _candidate_mask_db(gray):
+    with _db_lock:
+        quads, _ = _load_db_model().detect(cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR))
+    mask = np.zeros_like(gray)
+    for quad in quads:
+        x, y, w, h = cv2.boundingRect(np.asarray(quad, dtype=np.int32))
+        mask[max(0, y):y + h, max(0, x):x + w] = 255
+    return mask
+
+
+def detect_text_boxes(gray, method=None):
+    """
+    Returns [left, top, width, height] boxes (full-resolution pixels, reading order) of the text
+    blocks in gray. Detected words are merged into blocks so each box is worth one OCR call.
+    """
+    method = method or TEXT_DETECTION
+    if method == 'db' and not os.path.exists(TEXT_DETECTION_MODEL):
+        print(f"Text detection model {TEXT_DETECTION_MODEL} not found; using morphology instead.")
+        method = 'morph'
+
+    height, width = gray.shape
+    scale = min(1.0, TEXT_DETECTION_MAX_SIDE / float(max(height, width)))
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1.0 else gray
+
+    mask = {'mser': _candidate_mask_mser, 'db': _candidate_mask_db}.get(method, _candidate_mask_morph)(small)
+    # Join words into lines and neighbouring lines into blocks
+    mask = cv2.dilate(mask, cv2.getStructuringElement(cv2.MORPH_RECT, (15, 7)))
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    boxes = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        x0 = max(0, int(x / scale) - TEXT_DETECTION_PADDING)
+        y0 = max(0, int(y / scale) - TEXT_DETECTION_PADDING)
+        x1 = min(width, int((x + w) / scale) + TEXT_DETECTION_PADDING)
+        y1 = min(height, int((y + h) / scale) + TEXT_DETECTION_PADDING)
+        boxes.append([x0, y0, x1 - x0, y1 - y0])
+    return sorted(boxes, key=lambda b: (b[1], b[0]))
+
+
+def coverage(boxes, shape):
+    """Fraction of the page covered by boxes (blocks do not overlap after merging)."""
+    return sum(w * h for _, _, w, h in boxes) / float(shape[0] * shape[1])
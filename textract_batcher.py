@@ -0,0 +1,225 @@
+import os
+import threading
+from concurrent.futures import Future
+
+import cv2
+import numpy as np
+
+# --- Configuration ---
+# With MOSAIC_ENABLED=true, Textract requests for images of at most MOSAIC_MAX_IMAGE_PIXELS are
+# held for up to MOSAIC_WINDOW_MS, stacked top to bottom with other small images on one canvas
+# and sent as a single detect_document_text call. Stacking (not side by side) keeps Textract
+# from reading across two images into one LINE. A batch is sent early once it holds
+# MOSAIC_MAX_IMAGES images; a canvas taller than TEXTRACT_MAX_SIDE is sent one call per image.
+MOSAIC_ENABLED = os.environ.get('MOSAIC_ENABLED', 'false').lower() == 'true'
+MOSAIC_WINDOW_MS = float(os.environ.get('MOSAIC_WINDOW_MS', 150))
+MOSAIC_MAX_IMAGES = int(os.environ.get('MOSAIC_MAX_IMAGES', 8))
+MOSAIC_MAX_IMAGE_PIXELS = int(os.environ.get('MOSAIC_MAX_IMAGE_PIXELS', 500_000))
+MOSAIC_PADDING = int(os.environ.get('MOSAIC_PADDING', 24))
+TEXTRACT_MAX_BYTES = 10 * 1024 * 1024 # Synchronous Textract limit for Document.Bytes
+TEXTRACT_MAX_SIDE = 10_000 # Synchronous Textract limit for either side of an image, in pixels
+
+
+def layout_column(sizes, padding=MOSAIC_PADDING):
+    """
+    Places (width, height) rectangles top to bottom, left-aligned, padding apart.
+    Returns ([(x, y), ...], (canvas width, canvas height)).
+    """
+    positions, y = [], padding
+    for _, height in sizes:
+        positions.append((padding, y))
+        y += height + padding
+    return positions, (max(width for width, _ in sizes) + 2 * padding, y)
+
+
+def build_mosaic(images):
+    """Copies grey images onto one white canvas. Returns (canvas, [(x, y, width, height), ...])."""
+    sizes = [(image.shape[1], image.shape[0]) for image in images]
+    positions, (canvas_width, canvas_height) = layout_column(sizes)
+    canvas = np.full((canvas_height, canvas_width), 255, dtype=np.uint8)
+    placements = []
+    for image, (x, y) in zip(images, positions):
+        height, width = image.shape
+        canvas[y:y + height, x:x + width] = image
+        placements.append((x, y, width, height))
+    return canvas, placements
+
+
+def _to_image_geometry(geometry, placement, canvas_size):
+    """Re-expresses a canvas-normalised Textract geometry relative to one placed image."""
+    x, y, width, height = placement
+    canvas_width, canvas_height = canvas_size
+
+    def convert(left, top):
+        return (left * canvas_width - x) / width, (top * canvas_height - y) / height
+
+    box = geometry['BoundingBox']
+    left, top = convert(box['Left'], box['Top'])
+    converted = {'BoundingBox': {'Left': left, 'Top': top,
+                                 'Width': box['Width'] * canvas_width / width,
+                                 'Height': box['Height'] * canvas_height / height}}
+    if 'Polygon' in geometry:
+        converted['Polygon'] = [dict(zip(('X', 'Y'), convert(p['X'], p['Y']))) for p in geometry['Polygon']]
+    return converted
+
+
+def _placement_of(box, placements, canvas_size):
+    """The index of the placement containing the centre of a canvas-normalised box, or None."""
+    canvas_width, canvas_height = canvas_size
+    cx = (box['Left'] + box['Width'] / 2) * canvas_width
+    cy = (box['Top'] + box['Height'] / 2) * canvas_height
+    for index, (x, y, width, height) in enumerate(placements):
+        if x <= cx < x + width and y <= cy < y + height:
+            return index
+    return None
+
+
+def _union_geometry(words):
+    """The canvas-normalised bounding box around WORD blocks."""
+    boxes = [word['Geometry']['BoundingBox'] for word in words]
+    left, top = min(b['Left'] for b in boxes), min(b['Top'] for b in boxes)
+    right = max(b['Left'] + b['Width'] for b in boxes)
+    bottom = max(b['Top'] + b['Height'] for b in boxes)
+    return {'BoundingBox': {'Left': left, 'Top': top, 'Width': right - left, 'Height': bottom - top}}
+
+
+def _split_line(line, words_by_id, owner):
+    """
+    Splits a LINE block by the images its WORD children belong to.
+    Returns [(image index, block), ...]: the LINE itself when its words all belong to one image,
+    otherwise one LINE per image made of that image's words. Empty when no word was placed.
+    """
+    groups = {}
+    for relationship in line.get('Relationships', []):
+        if relationship['Type'] != 'CHILD':
+            continue
+        for word_id in relationship['Ids']:
+            if owner.get(word_id) is not None:
+                groups.setdefault(owner[word_id], []).append(word_id)
+    if len(groups) <= 1:
+        return [(index, line) for index in groups]
+
+    parts = []
+    for index, ids in groups.items():
+        words = [words_by_id[i] for i in ids]
+        parts.append((index, dict(line, Id=f"{line['Id']}-{index}",
+                                  Text=" ".join(word['Text'] for word in words),
+                                  Confidence=float(np.mean([word.get('Confidence', 0.0) for word in words])),
+                                  Geometry=_union_geometry(words),
+                                  Relationships=[{'Type': 'CHILD', 'Ids': ids}])))
+    return parts
+
+
+def split_blocks(blocks, placements, canvas_size):
+    """
+    Assigns each WORD block to the image whose placement contains its centre, and each LINE to
+    the image of its words; a LINE whose words fall in more than one image is split into one
+    LINE per image. LINEs without WORD children go by their own centre. Geometry is normalised
+    to the image, and relationships are kept only between blocks of the same image.
+    Returns one block list per placement.
+    """
+    words_by_id = {block['Id']: block for block in blocks if block.get('BlockType') == 'WORD'}
+    owner = {word_id: _placement_of(word['Geometry']['BoundingBox'], placements, canvas_size)
+             for word_id, word in words_by_id.items()}
+
+    per_image = [[] for _ in placements]
+    for block in blocks:
+        if block.get('BlockType') == 'WORD':
+            assigned = [] if owner[block['Id']] is None else [(owner[block['Id']], block)]
+        elif block.get('BlockType') == 'LINE':
+            assigned = _split_line(block, words_by_id, owner)
+            if not assigned:
+                index = _placement_of(block['Geometry']['BoundingBox'], placements, canvas_size)
+                assigned = [] if index is None else [(index, block)]
+        else:
+            continue
+        for index, part in assigned:
+            per_image[index].append(dict(part, Geometry=_to_image_geometry(part['Geometry'], placements[index], canvas_size)))
+
+    for index, image_blocks in enumerate(per_image):
+        for block in image_blocks:
+            relationships = []
+            for relationship in block.get('Relationships', []):
+                ids = [i for i in relationship['Ids'] if owner.get(i) == index]
+                if ids:
+                    relationships.append(dict(relationship, Ids=ids))
+            if 'Relationships' in block:
+                block['Relationships'] = relationships
+    return per_image
+
+
+class MosaicBatcher:
+    """
+    Collects small images submitted within a time window and OCRs them with one Textract call.
+    detect_document_text(document) is called with a Textract Document dict ({'Bytes': ...}) and
+    must return the Textract response; it is looked up per call, so the client can be swapped.
+    """
+
+    def __init__(self, detect_document_text, window_seconds=MOSAIC_WINDOW_MS / 1000.0, max_images=MOSAIC_MAX_IMAGES):
+        self.detect_document_text = detect_document_text
+        self.window_seconds = window_seconds
+        self.max_images = max_images
+        self._pending = []
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def submit(self, image_bytes, gray):
+        """
+        Queues one image and returns a Future for its blocks (geometry relative to that image).
+        gray is the image decoded to grey, for the mosaic; a batch of one sends image_bytes as they are.
+        """
+        future = Future()
+        with self._lock:
+            self._pending.append((image_bytes, gray, future))
+            if len(self._pending) >= self.max_images:
+                batch = self._take_batch()
+            else:
+                batch = None
+                if self._timer is None:
+                    self._timer = threading.Timer(self.window_seconds, self._flush_on_timer)
+                    self._timer.daemon = True
+                    self._timer.start()
+        if batch:
+            self._run_batch(batch)
+        return future
+
+    def detect(self, image_bytes, gray, timeout=None):
+        """Blocking form of submit(): returns the image's Textract blocks."""
+        return self.submit(image_bytes, gray).result(timeout)
+
+    def _take_batch(self):
+        # Called with the lock held
+        batch, self._pending = self._pending, []
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    def _flush_on_timer(self):
+        with self._lock:
+            batch = self._take_batch()
+        if batch:
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        try:
+            if len(batch) == 1:
+                image_bytes, _, future = batch[0]
+                future.set_result(self.detect_document_text({'Bytes': image_bytes}).get('Blocks', []))
+                return
+
+            canvas, placements = build_mosaic([gray for _, gray, _ in batch])
+            ok, encoded = cv2.imencode('.png', canvas)
+            if not ok or len(encoded) > TEXTRACT_MAX_BYTES or max(canvas.shape) > TEXTRACT_MAX_SIDE:
+                for item in batch: # Too big for one call; fall back to one call per image
+                    self._run_batch([item])
+                return
+            response = self.detect_document_text({'Bytes': encoded.tobytes()})
+            print(f"Textract mosaic: {len(batch)} images in one call ({canvas.shape[1]}x{canvas.shape[0]})")
+            canvas_size = (canvas.shape[1], canvas.shape[0])
+            for (_, _, future), blocks in zip(batch, split_blocks(response.get('Blocks', []), placements, canvas_size)):
+                future.set_result(blocks)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
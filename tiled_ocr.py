@@ -0,0 +1,147 @@
+import os
+import threading
+from contextlib import contextmanager
+
+from PIL import Image
+
+import scratch_buffers
+
+# --- Configuration ---
+# Images of at least TILED_MIN_PIXELS are decoded straight to grey (1 byte per pixel, instead of
+# the 3 for BGR plus the grey, blurred and thresholded full-size copies of the normal path) and
+# then preprocessed and OCR'd in overlapping TILE_SIZE tiles. Tiles overlap by TILE_OVERLAP
+# pixels, which must exceed the largest word, so every word lies wholly inside some tile.
+# How many tiles run at once is chosen so the grey page plus the working set of the tiles in
+# flight (about TILE_BYTES_PER_PIXEL bytes per tile pixel: blur and threshold buffers, the PIL
+# copy and tesseract's own memory) stays within TILED_MEMORY_BUDGET_MB.
+TILED_MIN_PIXELS = int(os.environ.get('TILED_MIN_PIXELS', 50_000_000))
+TILE_SIZE = int(os.environ.get('TILE_SIZE', 4096))
+TILE_OVERLAP = int(os.environ.get('TILE_OVERLAP', 512))
+TILED_MEMORY_BUDGET_MB = int(os.environ.get('TILED_MEMORY_BUDGET_MB', 1536))
+TILE_BYTES_PER_PIXEL = 12
+# PIL rejects images over twice its MAX_IMAGE_PIXELS as decompression bombs as soon as it reads the
+# header; header reads under header_pixel_limit() accept up to OpenCV's own decode limit (1 GP).
+HEADER_MAX_PIXELS = 2**30
+
+_header_limit_lock = threading.Lock()
+
+
+class OverMemoryBudget(Exception):
+    pass
+
+
+@contextmanager
+def header_pixel_limit():
+    """
+    Raises PIL's decompression-bomb limit to HEADER_MAX_PIXELS for the duration of the block, so
+    the header of a gigapixel scan can be read to route it here. Only wrap header reads in it:
+    the limit is a PIL global and is restored on exit, so full decodes keep PIL's default limit.
+    """
+    with _header_limit_lock:
+        saved = Image.MAX_IMAGE_PIXELS
+        if saved is not None:
+            Image.MAX_IMAGE_PIXELS = max(saved, HEADER_MAX_PIXELS)
+        try:
+            yield
+        finally:
+            Image.MAX_IMAGE_PIXELS = saved
+
+
+def check_budget(pixel_count):
+    """Raises OverMemoryBudget if even the grey page plus one tile cannot fit in the budget."""
+    needed = pixel_count + TILE_SIZE * TILE_SIZE * TILE_BYTES_PER_PIXEL
+    if needed > TILED_MEMORY_BUDGET_MB * 1024 * 1024:
+        raise OverMemoryBudget(f"A {pixel_count / 1e6:.0f} MP image needs about {needed / 2**20:.0f} MB, "
+                               f"over the {TILED_MEMORY_BUDGET_MB} MB budget (TILED_MEMORY_BUDGET_MB).")
+
+
+def tile_workers(pixel_count):
+    """Number of tiles that can be processed at once within the memory budget (at least 1)."""
+    free = TILED_MEMORY_BUDGET_MB * 1024 * 1024 - pixel_count
+    per_tile = TILE_SIZE * TILE_SIZE * TILE_BYTES_PER_PIXEL
+    return max(1, min(os.cpu_count() or 2, free // per_tile))
+
+
+def _axis_tiles(length):
+    """Tile starts along one axis plus the core interval each tile owns (cores partition the axis)."""
+    if length <= TILE_SIZE:
+        return [(0, length, 0, length)]
+    step = TILE_SIZE - TILE_OVERLAP
+    starts = list(range(0, length - TILE_SIZE, step)) + [length - TILE_SIZE]
+    tiles = []
+    for i, start in enumerate(starts):
+        core_start = 0 if i == 0 else (start + starts[i - 1] + TILE_SIZE) // 2
+        core_end = length if i == len(starts) - 1 else (starts[i + 1] + start + TILE_SIZE) // 2
+        tiles.append((start, TILE_SIZE, core_start, core_end))
+    return tiles
+
+
+def tile_grid(width, height):
+    """Returns [(x, y, w, h, (core_x0, core_y0, core_x1, core_y1))]; the cores partition the image."""
+    return [(x, y, w, h, (cx0, cy0, cx1, cy1))
+            for y, h, cy0, cy1 in _axis_tiles(height)
+            for x, w, cx0, cx1 in _axis_tiles(width)]
+
+
+def words_to_lines(words):
+    """
+    Groups words (page coordinates) into text lines by vertical overlap and orders them for
+    reading: lines top to bottom, words left to right. Returns the text.
+    """
+    lines = []
+    for word in sorted(words, key=lambda w: w['bbox'][1] + w['bbox'][3] / 2.0):
+        left, top, width, height = word['bbox']
+        centre = top + height / 2.0
+        if lines and abs(centre - lines[-1]['centre']) <= max(height, lines[-1]['height']) / 2.0:
+            line = lines[-1]
+            line['words'].append(word)
+            line['centre'] = (line['centre'] * (len(line['words']) - 1) + centre) / len(line['words'])
+        else:
+            lines.append({'centre': centre, 'height': height, 'words': [word]})
+    return "\n".join(" ".join(w['text'] for w in sorted(line['words'], key=lambda w: w['bbox'][0]))
+                     for line in lines)
+
+
+def _iou(a, b):
+    x0, y0 = max(a[0], b[0]), max(a[1], b[1])
+    x1, y1 = min(a[0] + a[2], b[0] + b[2]), min(a[1] + a[3], b[1] + b[3])
+    intersection = max(0, x1 - x0) * max(0, y1 - y0)
+    union = a[2] * a[3] + b[2] * b[3] - intersection
+    return intersection / float(union) if union else 0.0
+
+
+def dedupe_words(words):
+    """Drops a word when an identical word overlapping it by more than half has already been kept."""
+    kept = []
+    for word in sorted(words, key=lambda w: -w['confidence']):
+        if not any(k['text'] == word['text'] and _iou(k['bbox'], word['bbox']) > 0.5 for k in kept):
+            kept.append(word)
+    return kept
+
+
+def ocr_tiled(gray, ocr_tile):
+    """
+    OCRs a large grey image tile by tile. ocr_tile(tile) preprocesses one grey tile and returns
+    its words (bbox in tile coordinates, see app.ocr_with_tesseract_data()).
+    A word is kept only by the tile whose core contains its centre, so words in the overlaps are
+    not counted twice; dedupe_words() then catches words that tiles segmented slightly differently.
+    Returns (text, details).
+    """
+    height, width = gray.shape
+    tiles = tile_grid(width, height)
+
+    def run(tile):
+        x, y, w, h, (cx0, cy0, cx1, cy1) = tile
+        words = []
+        for word in ocr_tile(gray[y:y + h, x:x + w]):
+            left, top, word_width, word_height = word['bbox']
+            page_box = [left + x, top + y, word_width, word_height]
+            centre_x, centre_y = page_box[0] + word_width / 2.0, page_box[1] + word_height / 2.0
+            if cx0 <= centre_x < cx1 and cy0 <= centre_y < cy1:
+                words.append(dict(word, bbox=page_box))
+        return words
+
+    workers = tile_workers(gray.size)
+    words = [word for tile_words in scratch_buffers.map_crops(run, tiles, limit=workers) for word in tile_words]
+    words = dedupe_words(words)
+    return words_to_lines(words), {'tiles': len(tiles), 'workers': workers, 'words': len(words)}
@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+
+# --- Configuration ---
+# TRACE_EXPORTER selects where finished spans go: 'none' (default), 'console' (one JSON line per
+# span on stdout) or 'file' (JSON lines appended to TRACE_FILE). Other exporters can be installed
+# at runtime with set_exporter().
+TRACE_EXPORTER = os.environ.get('TRACE_EXPORTER', 'none').lower()
+TRACE_FILE = os.environ.get('TRACE_FILE', 'traces.jsonl')
+
+# S3 user metadata keys used to carry the trace from the Flask app to the Lambda
+METADATA_JOB_ID = 'job-id'
+METADATA_TRACE_ID = 'trace-id'
+METADATA_PARENT_SPAN_ID = 'parent-span-id'
+
+
+def _new_span_id():
+    return uuid.uuid4().hex[:16]
+
+
+class TraceContext:
+    """
+    Identifies one document's journey across both tiers: the job_id used as the DynamoDB key,
+    the trace_id shared by every span, and the span that new spans should be parented to.
+    """
+
+    def __init__(self, job_id=None, trace_id=None, parent_span_id=None):
+        self.job_id = job_id or str(uuid.uuid4())
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.parent_span_id = parent_span_id
+
+    def child(self, span_id):
+        """Returns a context whose new spans are parented to span_id."""
+        return TraceContext(self.job_id, self.trace_id, span_id)
+
+    def to_s3_metadata(self):
+        metadata = {METADATA_JOB_ID: self.job_id, METADATA_TRACE_ID: self.trace_id}
+        if self.parent_span_id:
+            metadata[METADATA_PARENT_SPAN_ID] = self.parent_span_id
+        return metadata
+
+    @classmethod
+    def from_s3_metadata(cls, metadata):
+        """Rebuilds the context from S3 object metadata; returns None if the object carries none."""
+        metadata = metadata or {}
+        if METADATA_JOB_ID not in metadata:
+            return None
+        return cls(metadata[METADATA_JOB_ID], metadata.get(METADATA_TRACE_ID), metadata.get(METADATA_PARENT_SPAN_ID))
+
+
+class Span:
+    def __init__(self, name, trace, attributes=None):
+        self.name = name
+        self.trace_id = trace.trace_id
+        self.job_id = trace.job_id
+        self.span_id = _new_span_id()
+        self.parent_span_id = trace.parent_span_id
+        self.attributes = dict(attributes or {})
+        self.status = 'OK'
+        self.start_time = time.time()
+        self.end_time = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_span_id': self.parent_span_id,
+            'job_id': self.job_id,
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+            'duration_ms': round((self.end_time - self.start_time) * 1000.0, 3) if self.end_time else None,
+            'status': self.status,
+            'attributes': self.attributes,
+        }
+
+
+# --- Exporters ---
+
+class NullSpanExporter:
+    def export(self, span):
+        pass
+
+
+class ConsoleSpanExporter:
+    def export(self, span):
+        print(json.dumps({'span': span.to_dict()}), flush=True)
+
+
+class FileSpanExporter:
+    """Appends spans as JSON lines to a local file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(span.to_dict())
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line + "\n")
+
+
+def _exporter_from_config():
+    if TRACE_EXPORTER == 'console':
+        return ConsoleSpanExporter()
+    if TRACE_EXPORTER == 'file':
+        return FileSpanExporter(TRACE_FILE)
+    return NullSpanExporter()
+
+
+_exporter = _exporter_from_config()
+
+
+def set_exporter(exporter):
+    """Installs the exporter that receives every finished span (any object with an export(span) method)."""
+    global _exporter
+    _exporter = exporter
+
+
+def get_exporter():
+    return _exporter
+
+
+@contextmanager
+def start_span(name, trace, **attributes):
+    """Times the enclosed block as a span of trace and hands it to the exporter when it ends."""
+    span = Span(name, trace, attributes)
+    try:
+        yield span
+    except BaseException as e:
+        span.status = 'ERROR'
+        span.set_attribute('error', str(e))
+        raise
+    finally:
+        span.end_time = time.time()
+        try:
+            _exporter.export(span)
+        except Exception as export_error:
+            # Tracing must never break request processing
+            print(f"Error exporting span {name}: {export_error}")
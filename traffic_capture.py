@@ -0,0 +1,89 @@
+import os
+import io
+import json
+import random
+import hashlib
+import threading
+
+from PIL import Image
+
+import tiled_ocr
+
+# --- Configuration ---
+# Capture is off unless CAPTURE_ENABLED=true. A sampled fraction of /upload requests is recorded to
+# CAPTURE_TRACE_FILE as JSON lines: content hash, size, dimensions, format, engine and stage timings.
+# No filenames or OCR text are recorded. The image itself is only kept when CAPTURE_CORPUS_DIR is set.
+CAPTURE_ENABLED = os.environ.get('CAPTURE_ENABLED', 'false').lower() == 'true'
+CAPTURE_SAMPLE_RATE = float(os.environ.get('CAPTURE_SAMPLE_RATE', 0.05))
+CAPTURE_TRACE_FILE = os.environ.get('CAPTURE_TRACE_FILE', 'capture/trace.jsonl')
+CAPTURE_CORPUS_DIR = os.environ.get('CAPTURE_CORPUS_DIR', '')
+
+_write_lock = threading.Lock()
+
+
+def should_capture():
+    return CAPTURE_ENABLED and random.random() < CAPTURE_SAMPLE_RATE
+
+
+def describe_image(image_bytes):
+    """Reads width, height and format from the image header without decoding pixels."""
+    try:
+        with tiled_ocr.header_pixel_limit(), Image.open(io.BytesIO(image_bytes)) as img:
+            return img.width, img.height, (img.format or 'unknown').lower()
+    except Exception:
+        return None, None, 'unknown'
+
+
+def describe_upload(image_bytes):
+    """
+    Takes what a capture needs from the uploaded bytes as soon as they are read, so the request can
+    release them before it finishes. The bytes themselves are only kept when CAPTURE_CORPUS_DIR is set.
+    """
+    width, height, image_format = describe_image(image_bytes)
+    return {
+        'sha256': hashlib.sha256(image_bytes).hexdigest(),
+        'byte_size': len(image_bytes),
+        'width': width,
+        'height': height,
+        'format': image_format,
+        'image': image_bytes if CAPTURE_CORPUS_DIR else None,
+    }
+
+
+def build_record(upload, ocr_model, timer, status_code):
+    """upload is the describe_upload() of the request's image."""
+    return {
+        'timestamp': timer.started_at, # Arrival, so a replay reproduces the arrival process
+        'sha256': upload['sha256'],
+        'byte_size': upload['byte_size'],
+        'width': upload['width'],
+        'height': upload['height'],
+        'format': upload['format'],
+        'ocr_model': ocr_model,
+        'status': status_code,
+        'stages_ms': {stage: round(seconds * 1000, 3) for stage, seconds in timer.timings.items()},
+        'total_ms': round(timer.total_seconds() * 1000, 3),
+    }
+
+
+def capture_request(upload, ocr_model, timer, status_code):
+    """
+    Appends one trace record (and optionally the image) for a finished request, given the
+    describe_upload() of its image. Never raises.
+    """
+    try:
+        record = build_record(upload, ocr_model, timer, status_code)
+        line = json.dumps(record)
+        with _write_lock:
+            os.makedirs(os.path.dirname(CAPTURE_TRACE_FILE) or '.', exist_ok=True)
+            with open(CAPTURE_TRACE_FILE, 'a') as f:
+                f.write(line + "\n")
+
+        if CAPTURE_CORPUS_DIR and upload['image'] is not None:
+            corpus_path = os.path.join(CAPTURE_CORPUS_DIR, f"{record['sha256']}.{record['format']}")
+            if not os.path.exists(corpus_path):
+                os.makedirs(CAPTURE_CORPUS_DIR, exist_ok=True)
+                with open(corpus_path, 'wb') as f:
+                    f.write(upload['image'])
+    except Exception as e:
+        print(f"Error capturing request trace: {e}")